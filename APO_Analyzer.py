@@ -8,6 +8,9 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 
+from utils.log_source import LogSource, split_lines
+from utils.wason_log import get_log_index
+
 
 
 @dataclass
@@ -17,16 +20,19 @@ class _SiteBucket:
     apop_lines: List[str] = field(default_factory=list)
     # (traffic_hex, conn_hex, state, raw_line)
     apop_rows: List[Tuple[str, str, str, str]] = field(default_factory=list)
+    # (call_id, conn_hex, raw_line) ของ Conn [...] ที่ ip แรก = ไซต์นี้ (เก็บตอน parse)
+    wason_calls: List[Tuple[int, str, str]] = field(default_factory=list)
 
 
 class ApoRemnantAnalyzer:
-    def __init__(self, raw_text: str, site_map: Dict[str, str] | None = None):
+    def __init__(self, raw_text: str | LogSource, site_map: Dict[str, str] | None = None):
         """
-        raw_text: เนื้อ log ทั้งไฟล์ (string)
+        raw_text: เนื้อ log ทั้งไฟล์ (string หรือ LogSource จาก loader .txt)
         site_map: map ip → ชื่อไซต์ (ไม่ส่งมาก็มีค่า default ให้)
         """
         self.raw_text = raw_text
-        self.lines = raw_text.splitlines()
+        self.index = get_log_index(raw_text)  # index เดียวกับ Line/Preset (log เดิมไม่ parse ซ้ำ)
+        self.lines = self.index.lines
         self.site_map = site_map or {
             "30.10.90.6":  "HYI-4",
             "30.10.10.6":  "Jasmine",
@@ -39,7 +45,7 @@ class ApoRemnantAnalyzer:
         # ===== regex =====
         self.re_wason_exec = re.compile(r'^\s*ZXPOTN\(.*\)#\s*exec\s+diag_c\("cc-cmd setcallcv SetupApo"\)')
         self.re_wason_end  = re.compile(r'^\[WASON\]ushell command finished\b', re.I)
-        self.re_wason_conn = re.compile(r"^\[WASON\]\s*Conn\s*\[")
+        # Conn [ip ip CALLID CONNNO] parse ไว้แล้วใน index (utils/wason_log.py: APO_CONN_RE / APO_CONN_PAIR_RE)
 
         self.re_apop_begin = re.compile(r'^\[APOPLUS\]\s*===\s*show all och-inst\s*===', re.I)
         self.re_apop_top   = re.compile(r'^\[APOPLUS\]\s*TopNeIp\s*:\s*([0-9\.]+)')
@@ -62,42 +68,37 @@ class ApoRemnantAnalyzer:
         x = m.group(3)
         return f"30.10.{x}.6"
 
-    @staticmethod
-    def _wason_pair_for_compare(conn_line: str) -> Optional[Tuple[str, int, str]]:
-        """
-        [WASON] Conn [30.10.x.x 30.10.y.y CALLID CONNNO] ...
-        return: (first_ip, call_id:int, conn_hex:str)
-        """
-        m = re.search(r"Conn\s*\[\s*([\d\.]+)\s+([\d\.]+)\s+(\d+)\s+(\d+)\s*\]", conn_line)
-        if not m:
-            return None
-        first_ip, _second_ip, call_id_str, conn_no_str = m.groups()
-        call_id = int(call_id_str)
-        conn_hex = f"0x{int(conn_no_str):08x}".lower()
-        return first_ip, call_id, conn_hex
-
     def _ensure_bucket(self, ip: str):
         if ip not in self.per_site:
             self.per_site[ip] = _SiteBucket(name=self.site_map.get(ip, ip))
 
+    def _add_wason(self, ip: str, i: int, ln: str):
+        bucket = self.per_site[ip]
+        bucket.wason_lines.append(ln)
+        info = self.index.apo_conns.get(i)
+        if info and info[0] == ip:
+            bucket.wason_calls.append((info[1], info[2], ln))
+
     # ---------- ขั้นที่ 1: parse ----------
     def parse(self) -> Dict[str, _SiteBucket]:
-        wason_prebuf: List[str] = []
+        wason_prebuf: List[Tuple[int, str]] = []  # (เลขบรรทัด, บรรทัด)
         apop_prebuf:  List[str] = []
         cap_wason = cap_apop = False
         cur_wason_ip_ctx: Optional[str] = None
         cur_apop_site_ip: Optional[str] = None
 
-        for ln in self.lines:
+        # บรรทัดอื่นนอกจาก [WASON]/[APOPLUS]/ZXPOTN ไม่มีผลกับ state ใด ๆ → วนเฉพาะ index.apo_lines
+        for i in self.index.apo_lines:
+            ln = self.lines[i]
             # WASON begin / end
             if self.re_wason_exec.search(ln):
                 cap_wason = True
                 cur_wason_ip_ctx = None
                 wason_prebuf.clear()
-                wason_prebuf.append(ln)
+                wason_prebuf.append((i, ln))
             if self.re_wason_end.search(ln):
                 if cap_wason and cur_wason_ip_ctx:
-                    self.per_site[cur_wason_ip_ctx].wason_lines.append(ln)
+                    self._add_wason(cur_wason_ip_ctx, i, ln)
                 cap_wason = False
                 cur_wason_ip_ctx = None
                 wason_prebuf.clear()
@@ -122,17 +123,17 @@ class ApoRemnantAnalyzer:
             if cap_wason:
                 if ln.startswith("[WASON]"):
                     if cur_wason_ip_ctx is None:
-                        wason_prebuf.append(ln)
-                        if self.re_wason_conn.search(ln):
-                            info = self._wason_pair_for_compare(ln)
-                            if info:
-                                first_ip, _, _ = info
-                                cur_wason_ip_ctx = first_ip
-                                self._ensure_bucket(first_ip)
-                                self.per_site[first_ip].wason_lines.extend(wason_prebuf)
-                                wason_prebuf.clear()
+                        wason_prebuf.append((i, ln))
+                        info = self.index.apo_conns.get(i)  # Conn [...] ที่ parse ไว้แล้วใน index
+                        if info:
+                            first_ip, _, _ = info
+                            cur_wason_ip_ctx = first_ip
+                            self._ensure_bucket(first_ip)
+                            for j, ln_buf in wason_prebuf:
+                                self._add_wason(first_ip, j, ln_buf)
+                            wason_prebuf.clear()
                     else:
-                        self.per_site[cur_wason_ip_ctx].wason_lines.append(ln)
+                        self._add_wason(cur_wason_ip_ctx, i, ln)
                 continue
 
             # collect APOP
@@ -167,43 +168,37 @@ class ApoRemnantAnalyzer:
 
 
     def analyze(self):
+        """
+        เทียบ Conn ของ WASON กับ APOP ต่อไซต์ ด้วย dict ที่สร้างครั้งเดียวต่อไซต์ (ไม่ scan ซ้ำ):
+          - apop_by_traffic: traffic hex → {conn hex: บรรทัด APOP}
+          - wason_by_traffic: traffic hex (ตาม scheme ที่เลือก) → บรรทัด WASON
+        """
         self.rendered.clear()
+        valid_states = {"HEAD_DETECT_WAITING", "HEAD_ERROR_DETECTING"}
 
         for wip, bucket in self.per_site.items():
             site_name     = bucket.name
             wason_snippet = "\n".join(bucket.wason_lines)
             apop_snippet  = "\n".join(bucket.apop_lines)
+            wason_calls   = bucket.wason_calls  # (call_id, conn_hex, raw_line) จาก parse()
 
-            # --- index APOP: เอาเฉพาะ HEAD_DETECT_WAITING ---
+            # --- index APOP: เอาเฉพาะ HEAD_DETECT_WAITING / HEAD_ERROR_DETECTING ---
             apop_by_traffic: Dict[str, Dict[str, str]] = {}
-            valid_states = {"HEAD_DETECT_WAITING", "HEAD_ERROR_DETECTING"}
             for t, c, state, ln_ap in bucket.apop_rows:
                 if state in valid_states:
                     apop_by_traffic.setdefault(t, {})[c] = ln_ap
 
-
-            # --- collect WASON calls ---
-            wason_calls: List[Tuple[int, str, str]] = []  # (call_id, conn_hex, raw_line)
-            for ln_w in bucket.wason_lines:
-                if not self.re_wason_conn.search(ln_w):
-                    continue
-                parsed = self._wason_pair_for_compare(ln_w)
-                if not parsed:
-                    continue
-                first_ip, call_id, c_hex = parsed
-                if first_ip == wip:
-                    wason_calls.append((call_id, c_hex, ln_w))
-
             if not wason_calls:
                 self.rendered.append((wip, (site_name, wason_snippet, apop_snippet, set(), set()), False, site_name))
                 continue
 
-            # --- เลือก scheme ---
-            def score_scheme(scheme: str) -> int:
-                return sum(self._traffic_hex_from(call_id, scheme) in apop_by_traffic for call_id, _c, _l in wason_calls)
-
-            score_shifted = score_scheme("shifted")
-            score_direct  = score_scheme("direct")
+            # --- เลือก scheme: traffic hex ของทั้ง 2 แบบคำนวณครั้งเดียว ---
+            traffic = {
+                scheme: [self._traffic_hex_from(call_id, scheme) for call_id, _c, _l in wason_calls]
+                for scheme in ("shifted", "direct")
+            }
+            score_shifted = sum(t in apop_by_traffic for t in traffic["shifted"])
+            score_direct  = sum(t in apop_by_traffic for t in traffic["direct"])
             if score_shifted == score_direct:
                 shifted_like = sum(t.endswith("000000") for t in apop_by_traffic.keys())
                 scheme = "shifted" if shifted_like > 0 else "direct"
@@ -214,9 +209,10 @@ class ApoRemnantAnalyzer:
             to_red_apop: Set[str] = set()
             to_red_wason: Set[str] = set()
             seen_apop_keys: Set[Tuple[str, str]] = set()  # (traffic_hex, conn_hex) ที่ WASON เช็คแล้ว
+            wason_by_traffic: Dict[str, List[str]] = {}
 
-            for call_id, c_hex, ln_wason in wason_calls:
-                t_hex = self._traffic_hex_from(call_id, scheme)
+            for t_hex, (_call_id, c_hex, ln_wason) in zip(traffic[scheme], wason_calls):
+                wason_by_traffic.setdefault(t_hex, []).append(ln_wason)
                 apop_conns = apop_by_traffic.get(t_hex, {})
 
                 if c_hex in apop_conns:
@@ -225,8 +221,7 @@ class ApoRemnantAnalyzer:
                 else:
                     # ❌ mismatch → แดงทั้งคู่
                     to_red_wason.add(ln_wason)
-                    for ap_ln in apop_conns.values():
-                        to_red_apop.add(ap_ln)
+                    to_red_apop.update(apop_conns.values())
 
             # --- orphan APOP (Conn ที่มีใน APOP แต่ไม่เจอใน WASON เลย) ---
             for t_hex, conns in apop_by_traffic.items():
@@ -234,9 +229,7 @@ class ApoRemnantAnalyzer:
                     if (t_hex, c_hex) not in seen_apop_keys:
                         to_red_apop.add(ap_ln)
                         # ✅ symmetric: mark WASON ทั้งหมดที่ traffic ตรงนี้
-                        for call_id, c_hex_w, ln_w in wason_calls:
-                            if self._traffic_hex_from(call_id, scheme) == t_hex:
-                                to_red_wason.add(ln_w)
+                        to_red_wason.update(wason_by_traffic.get(t_hex, ()))
 
             has_mismatch = bool(to_red_apop or to_red_wason)
             self.rendered.append(
@@ -276,8 +269,8 @@ class ApoRemnantAnalyzer:
     # --- renderer ของแต่ละไซต์ ---
     def display_logs_separate(self, site_name: str, wason_text: str, apop_text: str,
                             wason_lines_to_red: Set[str], apop_lines_to_red: Set[str]):
-        wason_lines = wason_text.splitlines() if wason_text else ["<i>No WASON log</i>"]
-        apop_lines  = apop_text.splitlines()  if apop_text  else ["<i>No APOP log</i>"]
+        wason_lines = split_lines(wason_text) if wason_text else ["<i>No WASON log</i>"]
+        apop_lines  = split_lines(apop_text)  if apop_text  else ["<i>No APOP log</i>"]
 
         wason_rows = []
         for wl in wason_lines:
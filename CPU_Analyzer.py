@@ -2,11 +2,15 @@
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
-from pandas.io.formats.style import Styler
+from utils.ref_registry import prepare_ref
+from utils.keyed_join import RefKeyIndex, mapping_key
+from utils.rules import Rule, RuleSet, classify
+from utils.table_style import CSS_BAD, CSS_PRESET, render_table, render_unmatched
+from utils.analysis import AnalysisResult, HeadlessAnalyzer
 import altair as alt
 
 
-class CPU_Analyzer:
+class CPU_Analyzer(HeadlessAnalyzer):
     """
     วิเคราะห์ CPU:
       - ตรวจคอลัมน์ที่ต้องมี
@@ -15,11 +19,14 @@ class CPU_Analyzer:
       - ไฮไลต์สี: เทาแถว, แดงค่าผิด threshold, ฟ้า Route ที่เป็น Preset
       - สรุปสถานะ Warning/Normal
       - แสดง Visualization: Bar Chart + Heatmap
+
+    compute() คำนวณอย่างเดียว (ไม่แตะ Streamlit), render() วาด UI จากผลนั้น
     """
 
-    def __init__(self, df_cpu: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "cpu"):
+    def __init__(self, df_cpu: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "cpu", ref_index: RefKeyIndex | None = None):
         self.df_cpu = df_cpu
         self.df_ref = df_ref
+        self.ref_index = ref_index  # index ของ Mapping จาก registry (ถ้าไม่มีจะสร้างจาก df_ref)
         self.ns     = ns
 
         # column name mapping
@@ -30,9 +37,15 @@ class CPU_Analyzer:
         self.COL_MIN  = "Minimum threshold"
         self.COL_SITE = "Site Name"
 
-        # abnormal storage (เพิ่มเหมือน FAN)
+        # กฎ abnormal: ค่าต้องอยู่ในช่วง [Minimum, Maximum] ของ reference
+        self.rules = RuleSet([Rule(self.COL_VAL, max=self.COL_MAX, min=self.COL_MIN)])
+        self.cell_rules = RuleSet([Rule(self.COL_VAL, max=self.COL_MAX, min=self.COL_MIN, both_bounds=True)])
+        self.chart_rules = RuleSet([Rule("CPU%", max=90)])  # สีกราฟ: > 90% = Overload
+
+        # abnormal storage (เพิ่มเหมือน FAN) — ค่าจริงมาจาก compute()
         self.df_abnormal = pd.DataFrame()   # abnormal ทั้งหมด
-        self.df_abnormal_by_type = {}       # abnormal แยกตาม BoardType (SNP(E), NCPM, NCPQ)
+        self.df_abnormal_by_type = {}       # {"All": abnormal} สำหรับ Summary
+        self.df_unmatched = pd.DataFrame()  # แถวในไฟล์ที่ไม่พบใน reference
 
     # ---------- Utilities ----------
     @staticmethod
@@ -58,38 +71,20 @@ class CPU_Analyzer:
             raise ValueError(f"Reference file must contain columns: {', '.join(sorted(required_ref_cols))}")
 
     def _merge_with_ref(self) -> pd.DataFrame:
-        self.df_cpu["Mapping Format"] = (
-            self.df_cpu[self.COL_ME].astype(str).str.strip()
-            + self.df_cpu[self.COL_MOBJ].astype(str).str.strip()
-        )
-        self.df_ref["Mapping"] = self.df_ref["Mapping"].astype(str).str.strip()
-        self.df_ref["order"]   = range(len(self.df_ref))
+        self.df_cpu["Mapping Format"] = mapping_key(self.df_cpu, self.COL_ME, self.COL_MOBJ)
+        self.df_ref = prepare_ref(self.df_ref)  # ถ้ามาจาก registry จะเตรียมไว้แล้ว
 
         ref_cols = ["Mapping", self.COL_MAX, self.COL_MIN, "order"]
         for extra in ["Site Name", "Call ID", "Route"]:
             if extra in self.df_ref.columns:
                 ref_cols.append(extra)
 
-        df_merged = pd.merge(
-            self.df_cpu,
-            self.df_ref[ref_cols],
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = RefKeyIndex.for_ref(self.df_ref, self.ref_index).join(
+            self.df_cpu, "Mapping Format", self.df_ref, ref_cols
         )
         return df_merged
 
-    @staticmethod
-    def _row_has_issue(r, col_val, col_min, col_max) -> bool:
-        v  = r.get(col_val)
-        lo = r.get(col_min)
-        hi = r.get(col_max)
-        try:
-            return (pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi))
-        except:
-            return False
-
-    def _style_dataframe(self, df_view: pd.DataFrame) -> Styler:
+    def _render_dataframe(self, df_view: pd.DataFrame) -> None:
         for c in [self.COL_VAL, self.COL_MAX, self.COL_MIN]:
             if c in df_view.columns:
                 df_view[c] = pd.to_numeric(df_view[c], errors="coerce")
@@ -103,46 +98,39 @@ class CPU_Analyzer:
         if "Minimum threshold" in df_view.columns and df_view[self.COL_MIN].max() <= 1:
             df_view[self.COL_MIN] = df_view[self.COL_MIN] * 100
 
-        def gray_row(r):
-            return [
-                'background-color:#e6e6e6;color:black'
-                if self._row_has_issue(r, self.COL_VAL, self.COL_MIN, self.COL_MAX) else ''
-                for _ in r
-            ]
-
-        def red_value(_):
-            return [
-                'background-color:#ff4d4d;color:white'
-                if (pd.notna(v) and pd.notna(hi) and pd.notna(lo) and (v > hi or v < lo))
-                else ''
-                for v, hi, lo in zip(
-                    df_view.get(self.COL_VAL, pd.Series(index=df_view.index)),
-                    df_view.get(self.COL_MAX, pd.Series(index=df_view.index)),
-                    df_view.get(self.COL_MIN, pd.Series(index=df_view.index)),
-                )
-            ]
-
-        def blue_route(_):
-            return [
-                'background-color:lightblue;color:black' if str(x).startswith("Preset") else ''
-                for x in df_view["Route"]
-            ] if "Route" in df_view.columns else []
-
-        styled = (
-            df_view.style
-            .apply(gray_row, axis=1)
-            .apply(red_value, subset=[self.COL_VAL] if self.COL_VAL in df_view.columns else [])
-            .apply(blue_route, subset=["Route"] if "Route" in df_view.columns else [])
-            .format({
+        # เทาทั้งแถวเมื่อมีปัญหา, แดงเฉพาะค่าที่เกินช่วง (ต้องมีทั้ง min/max), ฟ้าถ้า Route เป็น Preset
+        cells = {
+            self.COL_VAL: (self.cell_rules.mask(df_view), CSS_BAD),
+        }
+        if "Route" in df_view.columns:
+            cells["Route"] = (df_view["Route"].astype(str).str.startswith("Preset"), CSS_PRESET)
+
+        render_table(
+            df_view,
+            row_mask=self.rules.mask(df_view),
+            cells=cells,
+            fmt={
                 self.COL_VAL: "{:.2f}%",
                 self.COL_MAX: "{:.2f}%",
                 self.COL_MIN: "{:.2f}%",
-            })
+            },
         )
-        return styled
 
-    # ---------- MAIN ----------
-    def process(self) -> pd.DataFrame:
+    # ---------- Compute (headless) ----------
+    BOARD_TYPES = {"SNP(E)": r"SNP\(E\)", "NCPM": r"NCPM", "NCPQ": r"NCPQ"}
+
+    def _board_frames(self, df_result: pd.DataFrame) -> dict:
+        """แยกตามชนิดบอร์ด + คอลัมน์ Site-Obj และ CPU% (คูณ 100 เพราะไฟล์ต้นทางเป็น ratio)"""
+        site_obj = df_result["Site Name"].astype(str) + " - " + df_result[self.COL_MOBJ].astype(str)
+        frames = {}
+        for btype, pattern in self.BOARD_TYPES.items():
+            df_sub = df_result[df_result[self.COL_MOBJ].str.contains(pattern)].copy()
+            df_sub["Site-Obj"] = site_obj.loc[df_sub.index]
+            df_sub["CPU%"] = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce") * 100
+            frames[btype] = df_sub
+        return frames
+
+    def compute(self) -> AnalysisResult:
         # 1) Normalize
         self.df_cpu = self._normalize_columns(self.df_cpu)
         self.df_ref = self._normalize_columns(self.df_ref)
@@ -154,18 +142,41 @@ class CPU_Analyzer:
         # 3) Merge
         df_merged = self._merge_with_ref()
         if df_merged.empty:
-            st.warning("No matching mapping found between CPU file and reference")
-            return pd.DataFrame()
+            return AnalysisResult("cpu", df_unmatched=self.df_unmatched)
 
-        # 4) Pick columns
+        # 4) Pick columns + เรียงตาม order ของ reference
         base_cols = [self.COL_ME, self.COL_MOBJ, self.COL_MAX, self.COL_MIN, self.COL_VAL, "order"]
         opt_cols  = [c for c in ["Site Name", "Call ID", "Route"] if c in df_merged.columns]
-        show_cols = opt_cols + base_cols
-
-        df_result = df_merged[show_cols].copy()
+        df_result = df_merged[opt_cols + base_cols].copy()
         df_result = df_result.sort_values("order").drop(columns=["order"]).reset_index(drop=True)
 
-        # 5) Cascading filter
+        # 5) Abnormal
+        ab_mask = self.rules.mask(df_result)
+        df_abn = df_result.loc[ab_mask, [
+            "Site Name", self.COL_ME, self.COL_MOBJ,
+            self.COL_MAX, self.COL_MIN, self.COL_VAL
+        ]].copy()
+
+        return AnalysisResult(
+            "cpu",
+            df_result=df_result,
+            masks={"abnormal": ab_mask},
+            df_abnormal=df_abn,
+            abnormal_by_type={"All": df_abn} if not df_abn.empty else {},
+            kpis={"rows": len(df_result), "abn_count": int(ab_mask.sum())},
+            frames=self._board_frames(df_result),
+            df_unmatched=self.df_unmatched,
+        )
+
+    # ---------- Render (Streamlit) ----------
+    def render(self, result: AnalysisResult) -> None:
+        render_unmatched(result.df_unmatched, "CPU")
+        if result.df_result.empty:
+            st.warning("No matching mapping found between CPU file and reference")
+            return
+        df_result = result.df_result
+
+        # 1) Cascading filter
         df_filtered, _sel = cascading_filter(
             df_result,
             cols=["Site Name", self.COL_ME, self.COL_MOBJ],
@@ -174,28 +185,12 @@ class CPU_Analyzer:
         )
         st.caption(f"CPU (showing {len(df_filtered)}/{len(df_result)} rows)")
 
-        # 6) Overall status + abnormal เก็บเหมือน FAN
-        val = pd.to_numeric(df_result[self.COL_VAL], errors="coerce")
-        hi  = pd.to_numeric(df_result[self.COL_MAX], errors="coerce")
-        lo  = pd.to_numeric(df_result[self.COL_MIN], errors="coerce")
-        ab_mask_all = (val > hi) | (val < lo)
-
-        st.session_state["cpu_abn_count"] = int(ab_mask_all.fillna(False).sum())
-        st.session_state["cpu_status"]    = "Abnormal" if ab_mask_all.any() else "Normal"
-
-        # ✅ เก็บ abnormal ทั้งหมด
-        self.df_abnormal = df_result.loc[ab_mask_all].copy()
-
-        # 7) Styled main table
-        styled = self._style_dataframe(df_filtered.copy())
+        # 2) Styled main table
         st.markdown("### CPU Performance")
-        st.write(styled)
+        self._render_dataframe(df_filtered.copy())
 
-        # 8) Summary banner
-        failed_rows = df_filtered.apply(
-            lambda r: self._row_has_issue(r, self.COL_VAL, self.COL_MIN, self.COL_MAX),
-            axis=1
-        )
+        # 3) Summary banner
+        failed_rows = self.rules.mask(df_filtered)
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>CPU Performance {}</div>".format(
                 "red" if failed_rows.any() else "green",
@@ -204,31 +199,10 @@ class CPU_Analyzer:
             unsafe_allow_html=True
         )
 
-        # 9) Site-Obj column
-        df_result["Site-Obj"] = (
-            df_result["Site Name"].astype(str) + " - " + df_result[self.COL_MOBJ].astype(str)
-        )
-
-        # 10) Subsets
-        df_snp  = df_result[df_result[self.COL_MOBJ].str.contains(r"SNP\(E\)")].copy()
-        df_ncpm = df_result[df_result[self.COL_MOBJ].str.contains(r"NCPM")].copy()
-        df_ncpq = df_result[df_result[self.COL_MOBJ].str.contains(r"NCPQ")].copy()
-
-        # 11) CPU% (คูณ 100 เพราะไฟล์ต้นทางเป็น ratio)
-        for df_sub in [df_snp, df_ncpm, df_ncpq]:
-            df_sub["CPU%"] = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce") * 100
+        # 4) Subsets
+        df_snp, df_ncpm, df_ncpq = (result.frames[b] for b in self.BOARD_TYPES)
 
-        # ✅ เก็บ abnormal แยกตาม type
-        self.df_abnormal_by_type = {}
-        for btype, df_sub in {"SNP(E)": df_snp, "NCPM": df_ncpm, "NCPQ": df_ncpq}.items():
-            v  = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce")
-            hi = pd.to_numeric(df_sub[self.COL_MAX], errors="coerce")
-            lo = pd.to_numeric(df_sub[self.COL_MIN], errors="coerce")
-            ab_mask = (v > hi) | (v < lo)
-            if ab_mask.any():
-                self.df_abnormal_by_type[btype] = df_sub.loc[ab_mask].copy()
-
-        # 12) Global X scale
+        # 5) Global X scale
         global_max = max(df_snp["CPU%"].max(), df_ncpm["CPU%"].max(), df_ncpq["CPU%"].max())
         x_max = (global_max or 0) * 1.1  # กันชน 10%
 
@@ -236,7 +210,7 @@ class CPU_Analyzer:
         def plot_chart(df_sub: pd.DataFrame, title: str, height: int):
             # ✅ เรียงจากมากไปน้อย
             df_sub = df_sub.sort_values(by="CPU%", ascending=False).copy()
-            df_sub["Status"] = df_sub["CPU%"].apply(lambda x: "Overload" if x > 90 else "Normal")
+            df_sub["Status"] = classify(df_sub.index, [("Overload", self.chart_rules.mask(df_sub))], "Normal")
 
             # ✅ กำหนด order ของ Y-axis ตาม DataFrame ที่เรียงแล้ว
             y_order = df_sub["Site-Obj"].tolist()
@@ -266,7 +240,7 @@ class CPU_Analyzer:
             v  = pd.to_numeric(df_sub[self.COL_VAL], errors="coerce") * 100
             hi = pd.to_numeric(df_sub[self.COL_MAX], errors="coerce") * 100
             lo = pd.to_numeric(df_sub[self.COL_MIN], errors="coerce") * 100
-            ab_mask = (v > hi) | (v < lo)
+            ab_mask = self.rules.mask(df_sub)
 
             if not ab_mask.any():
                 st.info("✅ No abnormal rows (Normal)")
@@ -290,24 +264,15 @@ class CPU_Analyzer:
             for col in percent_cols:
                 df_abn[col] = pd.to_numeric(df_abn[col], errors="coerce").round(1).astype(str) + "%"
 
-            # ✅ Highlight CPU utilization (%) เป็นสีแดง
-            def highlight_red(val):
-                try:
-                    v = float(val.strip('%'))
-                    return "background-color: #ff4d4d; color: white"
-                except:
-                    return ""
-
-            styled_abn = (
-                df_abn.style
-                .applymap(highlight_red, subset=["CPU utilization (%)"])
+            # ✅ Highlight CPU utilization (%) เป็นสีแดง (ทุกแถวในตารางนี้ abnormal)
+            render_table(
+                df_abn,
+                cells={"CPU utilization (%)": (pd.Series(True, index=df_abn.index), CSS_BAD)},
             )
 
-            st.dataframe(styled_abn, use_container_width=True)
-
         # ---------- /Helpers ----------
 
-        # 13) SNP(E)
+        # 6) SNP(E)
         st.markdown(f"#### CPU Performance – SNP(E) Board")
 
         rows = len(df_snp)
@@ -326,7 +291,7 @@ class CPU_Analyzer:
         show_abnormal(df_snp, "SNP(E)")
         st.markdown("<br><br><br>", unsafe_allow_html=True)
 
-        # 14) NCPM
+        # 7) NCPM
         st.markdown(f"#### CPU Performance – NCPM Board")
         st.altair_chart(
             plot_chart(df_ncpm, "NCPM CPU Utilization (8 Boards)", 400),
@@ -335,47 +300,9 @@ class CPU_Analyzer:
         show_abnormal(df_ncpm, "NCPM")
         st.markdown("<br><br><br>", unsafe_allow_html=True)
 
-        # 15) NCPQ
+        # 8) NCPQ
         st.markdown(f"#### CPU Performance – NCPQ Board")
         st.altair_chart(plot_chart(df_ncpq, "NCPQ CPU Utilization (16 Boards)", 600),
                         use_container_width=True)
         show_abnormal(df_ncpq, "NCPQ")
         st.markdown("<br><br><br>", unsafe_allow_html=True)
-
-        # ✅ เก็บ analyzer object ลง session
-        st.session_state["cpu_analyzer"] = self
-
-        return df_result
-
-
-    def prepare(self) -> None:
-        """เตรียมข้อมูล abnormal โดยไม่ render UI และไม่ใช้ cascading_filter"""
-        # 1) Normalize
-        self.df_cpu = self._normalize_columns(self.df_cpu)
-        self.df_ref = self._normalize_columns(self.df_ref)
-
-        # 2) Check required columns
-        self._check_required()
-        self._check_required_ref()
-
-        # 3) Merge กับ reference
-        df_merged = self._merge_with_ref()
-        if df_merged.empty:
-            self.df_abnormal = pd.DataFrame()
-            self.df_abnormal_by_type = {}
-            return
-
-        # 4) Detect abnormal
-        val = pd.to_numeric(df_merged[self.COL_VAL], errors="coerce")
-        hi  = pd.to_numeric(df_merged[self.COL_MAX], errors="coerce")
-        lo  = pd.to_numeric(df_merged[self.COL_MIN], errors="coerce")
-        ab_mask = (val > hi) | (val < lo)
-
-        df_abn = df_merged.loc[ab_mask, [
-            "Site Name", self.COL_ME, self.COL_MOBJ,
-            self.COL_MAX, self.COL_MIN, self.COL_VAL
-        ]].copy()
-
-        # 5) เก็บผล
-        self.df_abnormal = df_abn
-        self.df_abnormal_by_type = {"All": df_abn} if not df_abn.empty else {}
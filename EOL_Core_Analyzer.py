@@ -1,13 +1,21 @@
 import math
+import numpy as np
 import streamlit as st
 import pandas as pd
               # ✅ เพิ่มบรรทัดนี้
 import plotly.express as px 
+from utils.ref_registry import get_ref
+from utils.rules import Rule, classify, nonblank
+from utils.table_style import render_table
+from utils.analysis import AnalysisResult, HeadlessAnalyzer
+
+CSS_EXCESS = "background-color: #ffe6e6"  # แดงอ่อน (Excess Loss)
+CSS_BREAK = "background-color: #fff8cc"   # เหลืองอ่อน (Fiber Break)
 
 
 
 # region Base Analyzer for Loss
-class LossAnalyzer:
+class LossAnalyzer(HeadlessAnalyzer):
     def __init__(
         self, 
         df_ref: pd.DataFrame | None = None, 
@@ -15,6 +23,9 @@ class LossAnalyzer:
         ref_path: str | None = None,
     ):
         self.df_raw_data = df_raw_data
+        self.df_abnormal = pd.DataFrame()
+        self.df_abnormal_by_type = {}
+        self.df_unmatched = pd.DataFrame()
         # ใช้ df_ref ถ้ามี, ถ้าไม่มีลองโหลดจาก ref_path, ไม่งั้น None
         if df_ref is not None:
             self.df_ref = df_ref
@@ -25,19 +36,17 @@ class LossAnalyzer:
 
     # ---------- loader (cache) ----------
     @staticmethod
-    @st.cache_data(show_spinner=False)
     def _load_ref(path: str) -> pd.DataFrame:
         """
         อ่านไฟล์อ้างอิงจาก path → DataFrame
-        cache ไว้เพื่อไม่ต้องอ่านซ้ำเมื่อมี rerun ของ Streamlit
+        ผ่าน registry: โหลดครั้งเดียวต่อ process (โหลดใหม่เมื่อไฟล์เปลี่ยน)
         """
         try:
-            df = pd.read_excel(path)
-            df.columns = [str(c).strip() for c in df.columns]
-            return df
+            # ใช้แค่ Link Name / EOL(dB) (ดู extract_eol_ref) → ไม่ต้อง parse คอลัมน์อื่น
+            return get_ref(path, usecols=["Link Name", "EOL(dB)"])
         except Exception as e:
-            st.error(f"Cannot load reference file from '{path}': {e}")
-            raise
+            # ไม่แตะ Streamlit ที่นี่ — หน้า UI แสดง error เอง
+            raise ValueError(f"Cannot load reference file from '{path}': {e}") from e
 
     # ------- Utilities -------
     @staticmethod
@@ -48,28 +57,38 @@ class LossAnalyzer:
         except (ValueError, TypeError):
             return False
 
+    @classmethod
+    def castable_mask(cls, s: pd.Series) -> pd.Series:
+        """
+        is_castable_to_float ทั้งคอลัมน์: ค่าที่เป็นตัวเลขตัดสินด้วย to_numeric ทีเดียว
+        ตรวจทีละค่าแบบเดิมเฉพาะค่าที่เหลือ (ว่าง / ข้อความ เช่น Fiber Break ซึ่งมีไม่กี่แถว)
+        """
+        ok = pd.to_numeric(s, errors="coerce").notna()
+        if not ok.all():
+            ok[~ok] = s[~ok].map(cls.is_castable_to_float).astype(bool)
+        return ok
+
     @staticmethod
     def countDay(df_ref: pd.DataFrame):
         days = (len(df_ref.columns) - 11) / 4
         return int(days)
 
     @staticmethod
-    def isDiffError(row):
+    def diff_row_styles(df: pd.DataFrame) -> list:
         """
-        ทำสีทั้งแถว:
-        - error (แดง)    : Loss current - Loss EOL ≥ 2
+        สีทั้งแถว (mask, css) สำหรับ render_table:
+        - error (แดง)    : Loss current - Loss EOL ≥ 2   (ทับ flapping)
         - flapping (เหลือง): Remark ไม่ว่าง
         """
-        status = ""
-        val = pd.to_numeric(row.get("Loss current - Loss EOL"), errors="coerce")
-
-        if pd.notna(val) and val >= 2:
-            status = "error"
-        elif str(row.get("Remark", "") or "").strip() != "":
-            status = "flapping"
-
-        color_style = LossAnalyzer.getColor(status)
-        return [color_style] * len(row)
+        error = Rule("Loss current - Loss EOL", max=2, inclusive=True).mask(df)
+        if "Remark" in df.columns:
+            flapping = df["Remark"].fillna("").astype(str).str.strip() != ""
+        else:
+            flapping = pd.Series(False, index=df.index)
+        return [
+            (flapping, LossAnalyzer.getColor("flapping")),
+            (error, LossAnalyzer.getColor("error")),
+        ]
     
     @staticmethod
     def getColor(status: str) -> str:
@@ -121,6 +140,24 @@ class LossAnalyzer:
 
 # region Analyzer for EOL
 class EOLAnalyzer(LossAnalyzer):
+    # Loss current - Loss EOL ≥ 2 dB → Excess Loss
+    EXCESS_RULE = Rule("Loss current - Loss EOL", max=2, inclusive=True)
+
+    @classmethod
+    def eol_status(cls, df: pd.DataFrame) -> pd.Series:
+        """
+        สถานะต่อแถว (ทั้งคอลัมน์ทีเดียว):
+        - EOL Fiber Break : Remark ไม่ว่าง
+        - EOL Excess Loss : Loss current - Loss EOL ≥ 2
+        - EOL Normal      : นอกนั้น
+        """
+        if "Remark" in df.columns:
+            brk = nonblank(df["Remark"])
+        else:
+            brk = pd.Series(False, index=df.index)
+        exc = cls.EXCESS_RULE.mask(df)
+        return classify(df.index, [("EOL Fiber Break", brk), ("EOL Excess Loss", exc)], "EOL Normal")
+
     def extract_raw_data(self, df_raw_data: pd.DataFrame) -> pd.DataFrame:
         df_raw_data.columns = df_raw_data.columns.str.strip()
         df_atten = pd.DataFrame()
@@ -129,9 +166,7 @@ class EOLAnalyzer(LossAnalyzer):
 
         df_atten["Link Name"] = source_port_col + "_" + sink_port_col
         df_atten["Current Attenuation(dB)"] = df_raw_data["Optical Attenuation (dB)"]
-        df_atten["Remark"] = df_atten["Current Attenuation(dB)"].apply(
-            lambda x: "" if self.is_castable_to_float(x) else "Fiber Break"
-        )
+        df_atten["Remark"] = np.where(self.castable_mask(df_atten["Current Attenuation(dB)"]), "", "Fiber Break")
         return df_atten
 
     def calculate_eol_diff(self, df_eol: pd.DataFrame) -> pd.DataFrame:
@@ -159,11 +194,14 @@ class EOLAnalyzer(LossAnalyzer):
         me_names = [name.split("-")[0] if "-" in name else name for name in link_names]
         return list(sorted(set(me_names)))  # ✅ unique + sorted
     
-    def get_filtered_result(self, df_result: pd.DataFrame, selected_me_name: str) -> pd.DataFrame:
+    @staticmethod
+    def me_mask(df_result: pd.DataFrame, selected_me_name: str) -> np.ndarray:
         if not selected_me_name:
-            return df_result.reset_index(drop=True)
-        mask = df_result["Link Name"].astype(str).str.contains(selected_me_name, na=False)
-        return df_result[mask].reset_index(drop=True)
+            return np.ones(len(df_result), dtype=bool)
+        return df_result["Link Name"].astype(str).str.contains(selected_me_name, na=False).to_numpy(dtype=bool)
+
+    def get_filtered_result(self, df_result: pd.DataFrame, selected_me_name: str) -> pd.DataFrame:
+        return df_result[self.me_mask(df_result, selected_me_name)].reset_index(drop=True)
     
     def get_selected_me_name(self, df_result):
         me_names = self.get_me_names(df_result)
@@ -176,184 +214,162 @@ class EOLAnalyzer(LossAnalyzer):
         )
         return selected_me_name
 
-    def process(self, show_table: bool = True, enable_filter: bool = True):   # ✅ เพิ่ม enable_filter
-        if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
-
-            if enable_filter:
-                selected_me_name = self.get_selected_me_name(df_result)
-                df_filtered = self.get_filtered_result(df_result, selected_me_name)
-            else:
-                df_filtered = df_result
-
-            if "Remark" in df_filtered.columns:
-                df_filtered["Remark"] = df_filtered["Remark"].fillna("")
-
-            # ---------- ตารางหลัก ----------
-            if show_table:
-                st.dataframe(df_filtered.style.apply(self.isDiffError, axis=1), hide_index=True)
-                self.draw_color_legend()
-
-            # ... (ส่วน KPI, Donut, Problem list เหมือนเดิม)
-
-            # ---------- KPI ----------
-            status_list = []
-            for _, row in df_filtered.iterrows():
-                val = pd.to_numeric(row.get("Loss current - Loss EOL"), errors="coerce")
-                remark = str(row.get("Remark", "")).strip()
-
-                if remark != "":
-                    status_list.append("EOL Fiber Break")
-                elif pd.notna(val) and val >= 2:
-                    status_list.append("EOL Excess Loss")
-                else:
-                    status_list.append("EOL Normal")
-
-            df_status = pd.DataFrame({"Status": status_list})
-            summary_counts = df_status["Status"].value_counts()
-
-            normal_cnt = int(summary_counts.get("EOL Normal", 0))
-            excess_cnt = int(summary_counts.get("EOL Excess Loss", 0))
-            break_cnt  = int(summary_counts.get("EOL Fiber Break", 0))
-            total_cnt  = normal_cnt + excess_cnt + break_cnt  
-
-            st.markdown("### EOL Link Status Overview")
-            col1, col2, col3, col4 = st.columns(4)
-            col1.metric("EOL Normal", f"{normal_cnt}")
-            col2.metric("EOL Excess Loss", f"{excess_cnt}")
-            col3.metric("EOL Fiber Break", f"{break_cnt}")
-            col4.metric("EOL Total", f"{total_cnt}")
-
-            # ---------- Donut ----------
-            fig = px.pie(
-                df_status,
-                names="Status",
-                hole=0.5,
-                color="Status",
-                color_discrete_map={
-                    "EOL Normal": "green",
-                    "EOL Excess Loss": "red",
-                    "EOL Fiber Break": "gold"
-                }
-            )
-            fig.update_traces(textinfo="value+label")
-            fig.add_annotation(dict(
-                text=f"Total<br>{total_cnt}",
-                x=0.5, y=0.5,
-                showarrow=False,
-                font=dict(size=18, color="black"),
-                xanchor="center", yanchor="middle"
-            ))
-            st.plotly_chart(fig, use_container_width=True)
-
-            # ---------- Problem Links ----------
-            st.subheader("EOL Excess Loss")
-            df_excess = df_filtered.loc[[s == "EOL Excess Loss" for s in status_list]].reset_index(drop=True)
-            if df_excess.empty:
-                st.success("No EOL Excess Loss links found.")
-            else:
-                def hl_loss(val):
-                    return "background-color: #ffe6e6"  # แดงอ่อน
-
-                st.dataframe(
-                    df_excess[["Link Name", "EOL(dB)", "Current Attenuation(dB)", "Loss current - Loss EOL"]]
-                        .style.applymap(hl_loss, subset=["Loss current - Loss EOL"]),
-                    hide_index=True,
-                    use_container_width=True
-                )
-
-            # ---------------- EOL Fiber Break ----------------
-            st.subheader("EOL Fiber Break")
-            df_break = df_filtered.loc[[s == "EOL Fiber Break" for s in status_list]].reset_index(drop=True)
-            if df_break.empty:
-                st.success("No EOL Fiber Break links found.")
-            else:
-                def hl_remark(val):
-                    if str(val).strip() != "":
-                        return "background-color: #fff8cc"  # เหลืองอ่อน
-                    return ""
-
-                st.dataframe(
-                    df_break[["Link Name", "Remark"]]
-                        .style.applymap(hl_remark, subset=["Remark"]),
-                    hide_index=True,
-                    use_container_width=True
-                )
-            self.abnormal_tables = {
-                "EOL Excess Loss": df_excess,
-                "EOL Fiber Break": df_break,
-            }               
-
-    @property
-    def df_abnormal(self):
-        if hasattr(self, "abnormal_tables"):
-            try:
-                return pd.concat(self.abnormal_tables.values(), ignore_index=True)
-            except ValueError:
-                return pd.DataFrame()
-        return pd.DataFrame()
-
-    @property
-    def df_abnormal_by_type(self):
-        return getattr(self, "abnormal_tables", {})
-
-
-    def prepare(self):
+    def eol_summary(self, df: pd.DataFrame, status: pd.Series | None = None) -> tuple[pd.Series, dict, dict]:
         """
-        เตรียม abnormal_tables (Excess + Fiber Break) 
-        โดยไม่ render UI
+        สถานะต่อแถว + KPI + ตาราง abnormal (Excess / Fiber Break) ของตารางที่ให้มา
+        status: คอลัมน์สถานะ (categorical) ที่คำนวณไว้แล้ว — ส่งมาเพื่อไม่ต้องจัดกลุ่มซ้ำ
         """
-        if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
-            print("[DEBUG][EOL] build_result_df shape:", df_result.shape)
-
-            status_list = []
-            for _, row in df_result.iterrows():
-                val = pd.to_numeric(row.get("Loss current - Loss EOL"), errors="coerce")
-                remark = str(row.get("Remark", "")).strip()
-                if remark != "":
-                    status_list.append("EOL Fiber Break")
-                elif pd.notna(val) and val >= 2:
-                    status_list.append("EOL Excess Loss")
-                else:
-                    status_list.append("EOL Normal")
-
-            df_excess = df_result.loc[[s == "EOL Excess Loss" for s in status_list]].reset_index(drop=True)
-            df_break  = df_result.loc[[s == "EOL Fiber Break" for s in status_list]].reset_index(drop=True)
-
-            self.abnormal_tables = {
-                "EOL Excess Loss": df_excess,
-                "EOL Fiber Break": df_break,
+        status = self.eol_status(df) if status is None else status.set_axis(df.index)
+        counts = status.value_counts()
+        kpis = {
+            "normal": int(counts.get("EOL Normal", 0)),
+            "excess": int(counts.get("EOL Excess Loss", 0)),
+            "break": int(counts.get("EOL Fiber Break", 0)),
+        }
+        kpis["total"] = kpis["normal"] + kpis["excess"] + kpis["break"]
+        tables = {
+            "EOL Excess Loss": df.loc[status == "EOL Excess Loss"].reset_index(drop=True),
+            "EOL Fiber Break": df.loc[status == "EOL Fiber Break"].reset_index(drop=True),
+        }
+        return status, kpis, tables
+
+    def compute(self) -> AnalysisResult:
+        if self.df_ref is None or self.df_raw_data is None:
+            return AnalysisResult("eol")
+
+        df_result = self.build_result_df()
+        df_result["Remark"] = df_result["Remark"].fillna("")
+
+        status, kpis, tables = self.eol_summary(df_result)
+        non_empty = [t for t in tables.values() if not t.empty]
+        return AnalysisResult(
+            "eol",
+            df_result=df_result,
+            masks={
+                "excess": status == "EOL Excess Loss",
+                "break": status == "EOL Fiber Break",
+            },
+            df_abnormal=pd.concat(non_empty, ignore_index=True) if non_empty else pd.DataFrame(),
+            abnormal_by_type=tables,
+            kpis=kpis,
+            frames={"status": status.to_frame("Status")},
+        )
+
+    def render(self, result: AnalysisResult, show_table: bool = True, enable_filter: bool = True):   # ✅ เพิ่ม enable_filter
+        if result.df_result.empty:
+            return
+        df_result = result.df_result
+        status = result.frames["status"]["Status"]
+
+        if enable_filter:
+            keep = self.me_mask(df_result, self.get_selected_me_name(df_result))
+            df_filtered = df_result[keep].reset_index(drop=True)
+            status = status[keep].reset_index(drop=True)
+        else:
+            df_filtered = df_result
+
+        # ---------- ตารางหลัก ----------
+        if show_table:
+            render_table(df_filtered, rows=self.diff_row_styles(df_filtered), hide_index=True)
+            self.draw_color_legend()
+
+        # ---------- KPI ----------
+        # ใช้คอลัมน์สถานะเดียวกับ compute() (KPI / donut / ตาราง abnormal)
+        status, kpis, tables = self.eol_summary(df_filtered, status)
+        total_cnt = kpis["total"]
+
+        st.markdown("### EOL Link Status Overview")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("EOL Normal", f"{kpis['normal']}")
+        col2.metric("EOL Excess Loss", f"{kpis['excess']}")
+        col3.metric("EOL Fiber Break", f"{kpis['break']}")
+        col4.metric("EOL Total", f"{total_cnt}")
+
+        # ---------- Donut ----------
+        df_status = pd.DataFrame({"Status": status.astype(str).to_numpy()})
+        fig = px.pie(
+            df_status,
+            names="Status",
+            hole=0.5,
+            color="Status",
+            color_discrete_map={
+                "EOL Normal": "green",
+                "EOL Excess Loss": "red",
+                "EOL Fiber Break": "gold"
             }
+        )
+        fig.update_traces(textinfo="value+label")
+        fig.add_annotation(dict(
+            text=f"Total<br>{total_cnt}",
+            x=0.5, y=0.5,
+            showarrow=False,
+            font=dict(size=18, color="black"),
+            xanchor="center", yanchor="middle"
+        ))
+        st.plotly_chart(fig, use_container_width=True)
+
+        # ---------- Problem Links ----------
+        st.subheader("EOL Excess Loss")
+        df_excess = tables["EOL Excess Loss"]
+        if df_excess.empty:
+            st.success("No EOL Excess Loss links found.")
+        else:
+            df_show = df_excess[["Link Name", "EOL(dB)", "Current Attenuation(dB)", "Loss current - Loss EOL"]]
+            render_table(
+                df_show,
+                cells={"Loss current - Loss EOL": (np.ones(len(df_show), dtype=bool), CSS_EXCESS)},
+                hide_index=True,
+            )
 
-            print(f"[DEBUG][EOL] Excess={len(df_excess)}, Break={len(df_break)}")
+        # ---------------- EOL Fiber Break ----------------
+        st.subheader("EOL Fiber Break")
+        df_break = tables["EOL Fiber Break"]
+        if df_break.empty:
+            st.success("No EOL Fiber Break links found.")
+        else:
+            df_show = df_break[["Link Name", "Remark"]]
+            render_table(
+                df_show,
+                cells={"Remark": (nonblank(df_show["Remark"]), CSS_BREAK)},
+                hide_index=True,
+            )
 
 
 class CoreAnalyzer(EOLAnalyzer):
+    # Loss between core > 2 dB → Core Loss Excess
+    EXCESS_RULE_CORE = Rule("Loss between core", max=2)
+
+    @staticmethod
+    def pair_loss(df_result: pd.DataFrame) -> np.ndarray:
+        """
+        |forward - reverse| ของแต่ละคู่ (แถว 0-1, 2-3, ...) ปัดทศนิยม 2 ตำแหน่ง แล้วกระจายให้ทั้ง 2 แถวของคู่
+        แถวสุดท้ายที่ไม่มีคู่ (จำนวนแถวคี่) ได้ NaN
+        """
+        loss = df_result["Loss current - Loss EOL"].to_numpy()
+        n_pairs = len(loss) // 2
+        diff = np.round(np.abs(loss[0:2 * n_pairs:2] - loss[1:2 * n_pairs:2]), 2)
+        out = np.repeat(diff, 2)
+        if len(loss) % 2:
+            out = np.append(out, np.array([np.nan], dtype=out.dtype))
+        return out
+
     def calculate_loss_between_core(self, df_result: pd.DataFrame) -> pd.DataFrame:
-        forward_direction = df_result["Loss current - Loss EOL"].iloc[::2].values
-        reverse_direction = df_result["Loss current - Loss EOL"].iloc[1::2].values
-        loss_between_core = [abs(f - r) for f, r in zip(forward_direction, reverse_direction)]
-        loss_between_core = ["--" if pd.isna(value) else round(value, 2) for value in loss_between_core]
+        loss = self.pair_loss(df_result)
+        values = loss.astype(object)
+        values[pd.isna(loss)] = "--"
 
         df_loss_between_core = pd.DataFrame()
         df_loss_between_core["Link Name"] = df_result["Link Name"]
-        df_loss_between_core["Loss between core"] = [x for x in loss_between_core for _ in range(2)]
+        df_loss_between_core["Loss between core"] = values
         return df_loss_between_core
     
-    @staticmethod
-    def getColorCondition(value, threshold=2) -> str:
-        if value == "--":
-            return "flapping"
-        elif value > threshold:
-            return "error"
-        return ""
-
-    def build_loss_table_body(self, link_names, loss_values) -> str:
+    # สีตามสถานะ (Core Fiber Break = flapping, Core Loss Excess = error)
+    STATUS_COLOR = {"Core Fiber Break": "flapping", "Core Loss Excess": "error"}
+
+    def build_loss_table_body(self, link_names, loss_values, statuses) -> str:
         table_body = ""
         for i in range(len(link_names)):
-            status = CoreAnalyzer.getColorCondition(loss_values[i])
-            color  = LossAnalyzer.getColor(status)
+            color  = LossAnalyzer.getColor(self.STATUS_COLOR.get(statuses[i], ""))
             merged_cells = ""
             if i % 2 == 0:
                 formated_value = loss_values[i]
@@ -373,8 +389,8 @@ class CoreAnalyzer(EOLAnalyzer):
             """.strip()
         return table_body
     
-    def build_loss_table(self, link_names, loss_values) -> str:
-        table_body = self.build_loss_table_body(link_names, loss_values)
+    def build_loss_table(self, link_names, loss_values, statuses) -> str:
+        table_body = self.build_loss_table_body(link_names, loss_values, statuses)
         html = f"""
             <div style="max-height: 500px; overflow-y: auto; border: 1px solid #ccc; border-radius: 0.5rem;">
                 <table style="border-collapse: collapse; width: 100%; text-align: left; font-family: 'Source Sans', sans-serif; font-size: 14px;">
@@ -403,205 +419,176 @@ class CoreAnalyzer(EOLAnalyzer):
         )
         return selected_me_name
 
-    def process(self, show_table: bool = True, enable_filter: bool = True):   # ✅ เพิ่ม enable_filter
-        if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
-
-            # ✅ เลือกว่าจะ filter หรือไม่
-            if enable_filter:
-                selected_me_name = self.get_selected_me_name(df_result)
-                df_filtered = self.get_filtered_result(df_result, selected_me_name)
-            else:
-                df_filtered = df_result
-
-            df_loss_between_core = self.calculate_loss_between_core(df_filtered)
-            link_names  = df_loss_between_core["Link Name"].tolist()
-            loss_values = df_loss_between_core["Loss between core"].tolist()
-
-            # ---------- ตารางหลัก ----------
-            if show_table:
-                html = self.build_loss_table(link_names, loss_values)
-                st.markdown(html, unsafe_allow_html=True)
-
-                # Legend
-                st.markdown("""
-                    <div style='display: flex; justify-content: center; align-items: center; gap: 32px; margin: 1rem 0;'>
-                        <div style='display: flex; align-items: center; gap: 8px'>
-                            <div style='background-color: #ff4d4d; width: 24px; height: 24px; border-radius: 4px;'></div>
-                            <div style='color: #ff4d4d; font-size: 24px; font-weight: bold;'>Loss not OK </div>
-                        </div>
-                        <div style='display: flex; align-items: center; gap: 8px'>
-                            <div style='background-color: #d6b346; width: 24px; height: 24px; border-radius: 4px;'></div>
-                            <div style='color: #d6b346; font-size: 24px; font-weight: bold;'>Fiber break occurs</div>
-                        </div>
-                    </div>
-                """, unsafe_allow_html=True)
-
-            # ---------- KPI ----------
-            status_list = []
-            for v in loss_values:
-                if v == "--":
-                    status_list.append("Core Fiber Break")
-                elif pd.notna(v) and v > 2:
-                    status_list.append("Core Loss Excess")
-                else:
-                    status_list.append("Core Normal")
-
-            df_summary = pd.DataFrame({"Status": status_list})
-            summary_counts = df_summary["Status"].value_counts()
-
-            ok_cnt    = int(summary_counts.get("Core Normal", 0))
-            notok_cnt = int(summary_counts.get("Core Loss Excess", 0))
-            fiber_cnt = int(summary_counts.get("Core Fiber Break", 0))
-            total_cnt = ok_cnt + notok_cnt + fiber_cnt  
-
-            st.markdown("### Core Link Status Overview")
-            col1, col2, col3, col4 = st.columns(4)
-            col1.metric("Core Normal", f"{ok_cnt}")
-            col2.metric("Core Loss Excess", f"{notok_cnt}")
-            col3.metric("Core Fiber Break", f"{fiber_cnt}")
-            col4.metric("Core Total", f"{total_cnt}")
-
-            # ---------- Donut ----------
-            fig = px.pie(
-                df_summary, 
-                names="Status", 
-                hole=0.5, 
-                color="Status",
-                color_discrete_map={
-                    "Core Normal": "green",
-                    "Core Loss Excess": "red",
-                    "Core Fiber Break": "gold"
-                }
-            )
-            fig.update_traces(textinfo="value+label")
-            fig.add_annotation(dict(
-                text=f"Total<br>{total_cnt}",
-                x=0.5, y=0.5,
-                showarrow=False,
-                font=dict(size=18, color="black"),
-                xanchor="center", yanchor="middle"
-            ))
-            st.plotly_chart(fig, use_container_width=True)
-
-            
-            # ---------- Problem Links ----------
-            st.markdown("### Problem Links")
-            df_problem = pd.DataFrame({
-                "Link Name": link_names,
-                "Loss between core": loss_values,
-                "Status": status_list
-            })
-
-            # ✅ สไตล์: สลับสีทั้งแถวเป็นคู่ (A→B, B→A)
-            def style_pair(row):
-                pair_index = row.name // 2  # 0,0 | 1,1 | 2,2 ...
-                base = "#ffffff" if (pair_index % 2 == 0) else "#f2f2f2"
-                return [f"background-color: {base}"] * len(row)
-
-            # ✅ ไฮไลต์คอลัมน์ Loss between core
-            def hl_red(val):
-                return "background-color: #ffe6e6"  # แดงอ่อน (Excess)
-
-            def hl_yellow(val):
-                return "background-color: #fff8cc"  # เหลืองอ่อน (Fiber Break)
-
-           
-            # ---------------- Core Loss Excess ----------------
-            st.subheader("Core Loss Excess")
-            df_loss = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Loss Excess"],
-                "Loss between core": [lv for lv, stt in zip(loss_values, status_list) if stt == "Core Loss Excess"]
-            }).reset_index(drop=True)
-
-            if df_loss.empty:
-                st.success("No Core Loss Excess links found.")
-            else:
-                st.dataframe(
-                    df_loss
-                        .style.apply(style_pair, axis=1)          # สลับสีทั้งแถวเป็นคู่
-                        .applymap(hl_red, subset=["Loss between core"]), 
-                    hide_index=True,
-                    use_container_width=True
-                )
-
-            # ---------------- Core Fiber Break ----------------
-            st.subheader("Core Fiber Break")
-            df_break = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Fiber Break"],
-                "Loss between core": [
-                    "Fiber Break" if lv == "--" else lv
-                    for lv, stt in zip(loss_values, status_list) if stt == "Core Fiber Break"
-                ]
-            }).reset_index(drop=True)
-
-            if df_break.empty:
-                st.success("No Core Fiber Break links found.")
-            else:
-                st.dataframe(
-                    df_break
-                        .style.apply(style_pair, axis=1)
-                        .applymap(hl_yellow, subset=["Loss between core"]),
-                    hide_index=True,
-                    use_container_width=True
-                )
-
-            self.abnormal_tables = {
-                "Core Loss Excess": df_loss,
-                "Core Fiber Break": df_break,
-            }
-
-    @property
-    def df_abnormal(self):
-        if hasattr(self, "abnormal_tables"):
-            try:
-                return pd.concat(self.abnormal_tables.values(), ignore_index=True)
-            except ValueError:
-                return pd.DataFrame()
-        return pd.DataFrame()
-
-    @property
-    def df_abnormal_by_type(self):
-        return getattr(self, "abnormal_tables", {})
+    @classmethod
+    def core_status(cls, df_links: pd.DataFrame) -> pd.Series:
+        """
+        สถานะต่อแถว (categorical):
+        - Core Fiber Break : Loss between core = "--" (ฝั่งใดฝั่งหนึ่งไม่มีค่า)
+        - Core Loss Excess : Loss between core > 2
+        - Core Normal      : นอกนั้น
+        """
+        brk = df_links["Loss between core"].eq("--")
+        exc = cls.EXCESS_RULE_CORE.mask(df_links)
+        return classify(df_links.index, [("Core Fiber Break", brk), ("Core Loss Excess", exc)], "Core Normal")
 
-    def prepare(self):
+    def core_summary(self, df: pd.DataFrame, df_links: pd.DataFrame | None = None) -> tuple[pd.DataFrame, dict, dict]:
         """
-        เตรียม abnormal_tables (Loss Excess + Fiber Break) 
-        โดยไม่ render UI
+        Loss between core ต่อคู่ (A→B, B→A) + สถานะ + KPI + ตาราง abnormal
+        คืน (df_links[Link Name, Loss between core, Status], kpis, tables)
+        df_links: ผลเดิม (มี Status แล้ว) — ส่งมาเพื่อไม่ต้องจับคู่/จัดกลุ่มซ้ำ
         """
-        if self.df_ref is not None and self.df_raw_data is not None:
-            df_result = self.build_result_df()
-            print("[DEBUG][Core] build_result_df shape:", df_result.shape)
-
-            df_loss_between_core = self.calculate_loss_between_core(df_result)
-            link_names  = df_loss_between_core["Link Name"].tolist()
-            loss_values = df_loss_between_core["Loss between core"].tolist()
-
-            status_list = []
-            for v in loss_values:
-                if v == "--":
-                    status_list.append("Core Fiber Break")
-                elif pd.notna(v) and v > 2:
-                    status_list.append("Core Loss Excess")
-                else:
-                    status_list.append("Core Normal")
-
-            df_loss = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Loss Excess"],
-                "Loss between core": [lv for lv, stt in zip(loss_values, status_list) if stt == "Core Loss Excess"]
-            }).reset_index(drop=True)
-
-            df_break = pd.DataFrame({
-                "Link Name": [ln for ln, stt in zip(link_names, status_list) if stt == "Core Fiber Break"],
-                "Loss between core": [
-                    "Fiber Break" if lv == "--" else lv
-                    for lv, stt in zip(loss_values, status_list) if stt == "Core Fiber Break"
-                ]
-            }).reset_index(drop=True)
-
-            self.abnormal_tables = {
-                "Core Loss Excess": df_loss,
-                "Core Fiber Break": df_break,
+        if df_links is None:
+            df_links = self.calculate_loss_between_core(df).reset_index(drop=True)
+            df_links["Status"] = self.core_status(df_links)
+        status = df_links["Status"]
+
+        counts = status.value_counts()
+        kpis = {
+            "normal": int(counts.get("Core Normal", 0)),
+            "excess": int(counts.get("Core Loss Excess", 0)),
+            "break": int(counts.get("Core Fiber Break", 0)),
+        }
+        kpis["total"] = kpis["normal"] + kpis["excess"] + kpis["break"]
+
+        exc = (status == "Core Loss Excess").to_numpy()
+        brk = (status == "Core Fiber Break").to_numpy()
+        df_loss = pd.DataFrame({
+            "Link Name": df_links["Link Name"].to_numpy()[exc],
+            # dtype เดียวกับ Loss current - Loss EOL (abs/round ไม่เปลี่ยน dtype)
+            "Loss between core": pd.to_numeric(df_links["Loss between core"].to_numpy()[exc]).astype(
+                df["Loss current - Loss EOL"].dtype
+            ),
+        })
+        df_break = pd.DataFrame({
+            "Link Name": df_links["Link Name"].to_numpy()[brk],
+            "Loss between core": ["Fiber Break"] * int(brk.sum()),
+        })
+
+        return df_links, kpis, {"Core Loss Excess": df_loss, "Core Fiber Break": df_break}
+
+    def compute(self) -> AnalysisResult:
+        if self.df_ref is None or self.df_raw_data is None:
+            return AnalysisResult("core")
+
+        df_result = self.build_result_df()
+        df_links, kpis, tables = self.core_summary(df_result)
+        non_empty = [t for t in tables.values() if not t.empty]
+        return AnalysisResult(
+            "core",
+            df_result=df_result,
+            masks={
+                "excess": df_links["Status"] == "Core Loss Excess",
+                "break": df_links["Status"] == "Core Fiber Break",
+            },
+            df_abnormal=pd.concat(non_empty, ignore_index=True) if non_empty else pd.DataFrame(),
+            abnormal_by_type=tables,
+            kpis=kpis,
+            frames={"links": df_links},
+        )
+
+    def render(self, result: AnalysisResult, show_table: bool = True, enable_filter: bool = True):   # ✅ เพิ่ม enable_filter
+        if result.df_result.empty:
+            return
+        df_result = result.df_result
+
+        df_links = result.frames["links"]
+
+        # ✅ เลือกว่าจะ filter หรือไม่ (คู่ A→B, B→A ถูกจับไว้แล้วใน compute → ตัดแถวตาม filter อย่างเดียว)
+        if enable_filter:
+            keep = self.me_mask(df_result, self.get_selected_me_name(df_result))
+            df_links = df_links[keep].reset_index(drop=True)
+
+        # KPI / donut / ตาราง abnormal ใช้คอลัมน์ Status เดียวกัน
+        df_links, kpis, tables = self.core_summary(df_result, df_links)
+
+        # ---------- ตารางหลัก ----------
+        if show_table:
+            html = self.build_loss_table(
+                df_links["Link Name"].tolist(),
+                df_links["Loss between core"].tolist(),
+                df_links["Status"].tolist(),
+            )
+            st.markdown(html, unsafe_allow_html=True)
+
+            # Legend
+            st.markdown("""
+                <div style='display: flex; justify-content: center; align-items: center; gap: 32px; margin: 1rem 0;'>
+                    <div style='display: flex; align-items: center; gap: 8px'>
+                        <div style='background-color: #ff4d4d; width: 24px; height: 24px; border-radius: 4px;'></div>
+                        <div style='color: #ff4d4d; font-size: 24px; font-weight: bold;'>Loss not OK </div>
+                    </div>
+                    <div style='display: flex; align-items: center; gap: 8px'>
+                        <div style='background-color: #d6b346; width: 24px; height: 24px; border-radius: 4px;'></div>
+                        <div style='color: #d6b346; font-size: 24px; font-weight: bold;'>Fiber break occurs</div>
+                    </div>
+                </div>
+            """, unsafe_allow_html=True)
+
+        # ---------- KPI ----------
+        total_cnt = kpis["total"]
+
+        st.markdown("### Core Link Status Overview")
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Core Normal", f"{kpis['normal']}")
+        col2.metric("Core Loss Excess", f"{kpis['excess']}")
+        col3.metric("Core Fiber Break", f"{kpis['break']}")
+        col4.metric("Core Total", f"{total_cnt}")
+
+        # ---------- Donut ----------
+        fig = px.pie(
+            df_links[["Status"]], 
+            names="Status", 
+            hole=0.5, 
+            color="Status",
+            color_discrete_map={
+                "Core Normal": "green",
+                "Core Loss Excess": "red",
+                "Core Fiber Break": "gold"
             }
+        )
+        fig.update_traces(textinfo="value+label")
+        fig.add_annotation(dict(
+            text=f"Total<br>{total_cnt}",
+            x=0.5, y=0.5,
+            showarrow=False,
+            font=dict(size=18, color="black"),
+            xanchor="center", yanchor="middle"
+        ))
+        st.plotly_chart(fig, use_container_width=True)
+
+        # ---------- Problem Links ----------
+        st.markdown("### Problem Links")
+
+        # ✅ สไตล์: สลับสีทั้งแถวเป็นคู่ (A→B, B→A) + ไฮไลต์คอลัมน์ Loss between core
+        def pair_rows(df: pd.DataFrame) -> list:
+            odd_pair = (np.arange(len(df)) // 2) % 2 == 1  # 0,0 | 1,1 | 2,2 ...
+            return [
+                (~odd_pair, "background-color: #ffffff"),
+                (odd_pair, "background-color: #f2f2f2"),
+            ]
+
+        # ---------------- Core Loss Excess ----------------
+        st.subheader("Core Loss Excess")
+        df_loss = tables["Core Loss Excess"]
+        if df_loss.empty:
+            st.success("No Core Loss Excess links found.")
+        else:
+            render_table(
+                df_loss,
+                rows=pair_rows(df_loss),
+                cells={"Loss between core": (np.ones(len(df_loss), dtype=bool), CSS_EXCESS)},
+                hide_index=True,
+            )
 
-            print(f"[DEBUG][Core] LossExcess={len(df_loss)}, Break={len(df_break)}")
+        # ---------------- Core Fiber Break ----------------
+        st.subheader("Core Fiber Break")
+        df_break = tables["Core Fiber Break"]
+        if df_break.empty:
+            st.success("No Core Fiber Break links found.")
+        else:
+            render_table(
+                df_break,
+                rows=pair_rows(df_break),
+                cells={"Loss between core": (np.ones(len(df_break), dtype=bool), CSS_BREAK)},
+                hide_index=True,
+            )
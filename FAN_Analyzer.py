@@ -1,11 +1,17 @@
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.ref_registry import prepare_ref
+from utils.keyed_join import RefKeyIndex, mapping_key
+from utils.rules import Rule, RuleSet, classify
+from utils.table_style import CSS_BAD, render_table, render_unmatched
+from utils.analysis import AnalysisResult, HeadlessAnalyzer
 import altair as alt
 import re
+from typing import Optional
 
 
-class FAN_Analyzer:
+class FAN_Analyzer(HeadlessAnalyzer):
     """
     วิเคราะห์ FAN:
       - ตรวจคอลัมน์ที่ต้องมี
@@ -14,15 +20,22 @@ class FAN_Analyzer:
       - filter แบบ cascading_filter
       - ไฮไลต์ค่าที่ผิดตามกฎ FCC/FCPP/FCPL/FCPS
       - สรุปสถานะ Warning/Normal
+
+    compute() คำนวณอย่างเดียว (ไม่แตะ Streamlit), render() วาด UI จากผลนั้น
     """
 
-    def __init__(self, df_fan: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "fan"):
+    # ความเร็วพัดลมสูงสุดต่อชนิด (Rps) — เกินถือว่าผิด
+    THRESHOLDS = {"FCC": 120, "FCPP": 250, "FCPL": 120, "FCPS": 230}
+
+    def __init__(self, df_fan: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "fan", ref_index: RefKeyIndex | None = None):
         self.df_fan = df_fan
         self.df_ref = df_ref
+        self.ref_index = ref_index  # index ของ Mapping จาก registry (ถ้าไม่มีจะสร้างจาก df_ref)
         self.ns = ns
 
         self.df_abnormal = pd.DataFrame()   # abnormal table
         self.df_abnormal_by_type = {}       # abnormal table แยกตาม FanType
+        self.df_unmatched = pd.DataFrame()  # แถวในไฟล์ที่ไม่พบใน reference
 
         # ชื่อคอลัมน์หลัก
         self.COL_ME = "ME"
@@ -30,6 +43,12 @@ class FAN_Analyzer:
         self.COL_BEGIN = "Begin Time"
         self.COL_END = "End Time"
         self.COL_VALUE = "Value of Fan Rotate Speed(Rps)"
+
+        # กฎ abnormal: Measure Object มีชื่อชนิดพัดลม และค่าเกิน threshold ของชนิดนั้น
+        self.rules = RuleSet([
+            Rule(self.COL_VALUE, max=th, pattern=ftype, pattern_col=self.COL_MOBJ, name=ftype)
+            for ftype, th in self.THRESHOLDS.items()
+        ])
         self.COL_MAX_TH = "Maximum threshold"
         self.COL_MIN_TH = "Minimum threshold"
 
@@ -63,71 +82,35 @@ class FAN_Analyzer:
             raise ValueError(f"Uploaded file must contain columns: {', '.join(sorted(required_cols))}")
 
     def _merge_with_ref(self) -> pd.DataFrame:
-        self.df_fan["Mapping Format"] = (
-            self.df_fan[self.COL_ME].astype(str).str.strip()
-            + self.df_fan[self.COL_MOBJ].astype(str).str.strip()
-        )
+        self.df_fan["Mapping Format"] = mapping_key(self.df_fan, self.COL_ME, self.COL_MOBJ)
 
-        df_ref_subset = self.df_ref[["Mapping", "Site Name", self.COL_MAX_TH, self.COL_MIN_TH]].copy()
-        df_ref_subset["Mapping"] = df_ref_subset["Mapping"].astype(str).str.strip()
-        df_ref_subset["order"] = range(len(df_ref_subset))
+        self.df_ref = prepare_ref(self.df_ref)  # ถ้ามาจาก registry จะเตรียมไว้แล้ว
+        ref_cols = ["Mapping", "Site Name", self.COL_MAX_TH, self.COL_MIN_TH, "order"]
 
-        df_merged = pd.merge(
-            self.df_fan,
-            df_ref_subset,
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = RefKeyIndex.for_ref(self.df_ref, self.ref_index).join(
+            self.df_fan, "Mapping Format", self.df_ref, ref_cols
         )
         return df_merged
 
-    @staticmethod
-    def _is_not_ok_rule(measure_object: str, value) -> bool:
-        try:
-            v = float(value)
-        except Exception:
-            return False
-
-        mo = str(measure_object)
-        if "FCC" in mo and v > 120:
-            return True
-        if "FCPP" in mo and v > 250:
-            return True
-        if "FCPL" in mo and v > 120:
-            return True
-        if "FCPS" in mo and v > 230:
-            return True
-        return False
-
-    def _style_dataframe(self, df_view: pd.DataFrame):
+    def _render_dataframe(self, df_view: pd.DataFrame) -> pd.Series:
         if self.COL_VALUE in df_view.columns:
             df_view[self.COL_VALUE] = pd.to_numeric(df_view[self.COL_VALUE], errors="coerce")
 
-        highlight_mask = df_view.apply(
-            lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-            axis=1
+        # เทาทั้งแถว + แดงที่ค่าความเร็วพัดลมเมื่อเกิน threshold ของชนิดนั้น
+        highlight_mask = self.rules.mask(df_view)
+        render_table(
+            df_view,
+            row_mask=highlight_mask,
+            cells={self.COL_VALUE: (highlight_mask, CSS_BAD)},
+            fmt={self.COL_VALUE: "{:.2f}"},
         )
-
-        def gray_row(r):
-            return ['background-color:#e6e6e6;color:black' if highlight_mask.iloc[r.name] else '' for _ in r]
-
-        def red_value(_):
-            return ['background-color:#ff4d4d;color:white' if m else '' for m in highlight_mask]
-
-        styled_df = (
-            df_view.style
-            .apply(gray_row, axis=1)
-            .apply(red_value, subset=[self.COL_VALUE] if self.COL_VALUE in df_view.columns else [])
-            .format({self.COL_VALUE: "{:.2f}"})
-        )
-        return styled_df, highlight_mask
+        return highlight_mask
 
     # ---------- Chart ----------
     def _plot_chart(self, df_sub: pd.DataFrame, ftype: str, height: int, th: float):
         df_sub = df_sub.sort_values(by="Avg Fan Speed (Rps)", ascending=False).copy()
-        df_sub["Status"] = df_sub["Avg Fan Speed (Rps)"].apply(
-            lambda x: "Abnormal" if x > th else "Normal"
-        )
+        over = Rule("Avg Fan Speed (Rps)", max=th).mask(df_sub)
+        df_sub["Status"] = classify(df_sub.index, [("Abnormal", over)], "Normal")
 
         chart_bar = alt.Chart(df_sub).mark_bar().encode(
             x=alt.X("Avg Fan Speed (Rps)", title="Fan Speed (Rps)",
@@ -147,25 +130,23 @@ class FAN_Analyzer:
         )
         return chart_bar + chart_text
 
-    # ---------- MAIN ----------
-    def process(self) -> pd.DataFrame:
-        self.df_abnormal = pd.DataFrame()
-        self.df_abnormal_by_type = {}
+    # ---------- Compute (headless) ----------
+    DERIVED_COLS = ["FanType", "Board", "Port"]
 
-        # Normalize
+    def compute(self) -> AnalysisResult:
+        # 1) Normalize
         self.df_fan = self._normalize_columns(self.df_fan)
         self.df_ref = self._normalize_columns(self.df_ref)
 
-        # Required check
+        # 2) Required check
         self._check_required()
 
-        # Merge with reference
+        # 3) Merge with reference
         df_merged = self._merge_with_ref()
         if df_merged.empty:
-            st.info("No matching mapping found between FAN file and reference")
-            return pd.DataFrame()
+            return AnalysisResult("fan", df_unmatched=self.df_unmatched)
 
-        # Build df_result
+        # 4) Build df_result (เรียงตาม order ของ reference)
         df_result = df_merged[[
             self.COL_BEGIN, self.COL_END, "Site Name", self.COL_ME, self.COL_MOBJ,
             self.COL_MAX_TH, self.COL_MIN_TH, self.COL_VALUE, "order"
@@ -173,19 +154,81 @@ class FAN_Analyzer:
 
         df_result = df_result.sort_values("order").drop(columns=["order"]).reset_index(drop=True)
 
-        # Filtering
+        # 5) Add FanType, Board, Port
+        df_result["FanType"] = df_result[self.COL_MOBJ].str.extract(r"(FCC|FCPP|FCPL|FCPS)")
+        df_result["Board"] = df_result[self.COL_MOBJ].apply(self.extract_board)
+        df_result["Port"] = df_result[self.COL_MOBJ].apply(self.extract_port)
+
+        # 6) Detect abnormal (รวมทั้งหมด + แยกตาม FanType)
+        ab_mask = self.rules.mask(df_result)
+        df_abn = df_result.loc[ab_mask].copy()
+        by_type = {
+            ftype: df_abn[df_abn["FanType"] == ftype].copy()
+            for ftype in self.THRESHOLDS
+            if (df_abn["FanType"] == ftype).any()
+        }
+
+        # 7) Average by group (ใช้ทำกราฟ)
+        df_avg = (
+            df_result
+            .groupby(["FanType", self.COL_ME, "Site Name", "Board"], as_index=False)[self.COL_VALUE]
+            .mean()
+            .rename(columns={self.COL_VALUE: "Avg Fan Speed (Rps)"})
+        )
+        df_avg["Site-Obj"] = df_avg["Site Name"].astype(str) + " - " + df_avg["Board"].astype(str)
+
+        return AnalysisResult(
+            "fan",
+            df_result=df_result,
+            masks={"abnormal": ab_mask},
+            df_abnormal=df_abn,
+            abnormal_by_type=by_type,
+            kpis={"rows": len(df_result), "abn_count": int(ab_mask.sum())},
+            frames={"avg": df_avg},
+            df_unmatched=self.df_unmatched,
+        )
+
+    # ---------- Render (Streamlit) ----------
+    def _show_abnormal(self, df_abn: Optional[pd.DataFrame], title: str) -> None:
+        st.markdown(f"#### {title} – Abnormal Rows")
+        if df_abn is None or df_abn.empty:
+            st.info(" No abnormal rows (Normal)")
+            return
+
+        df_abn = df_abn[[
+            "Site Name", self.COL_ME, self.COL_MOBJ,
+            self.COL_MAX_TH, self.COL_MIN_TH, self.COL_VALUE
+        ]].copy()
+        for c in [self.COL_VALUE, self.COL_MAX_TH, self.COL_MIN_TH]:
+            df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce").round(2)
+
+        # highlight Value column
+        render_table(
+            df_abn,
+            cells={self.COL_VALUE: (df_abn[self.COL_VALUE] > 0, CSS_BAD)},
+            fmt={self.COL_VALUE: "{:.2f}"},
+        )
+
+    def render(self, result: AnalysisResult) -> None:
+        render_unmatched(result.df_unmatched, "FAN")
+        if result.df_result.empty:
+            st.info("No matching mapping found between FAN file and reference")
+            return
+
+        # Filtering (ตารางหลักไม่โชว์คอลัมน์ที่ derive เพิ่ม)
+        # กรองบน result.df_result ตัวเดิม (filter cache ตาม identity ของ frame) แล้วค่อยตัดคอลัมน์ derive
         df_filtered, _sel = cascading_filter(
-            df_result,
+            result.df_result,
             cols=["Site Name", self.COL_ME, self.COL_MOBJ],
             ns=self.ns,
             clear_text="Clear FAN Filters"
         )
-        st.caption(f"FAN (showing {len(df_filtered)}/{len(df_result)} rows)")
+        df_filtered = df_filtered.drop(columns=self.DERIVED_COLS)
+        st.caption(f"FAN (showing {len(df_filtered)}/{len(result.df_result)} rows)")
 
         # Style table
-        styled_df, highlight_mask = self._style_dataframe(df_filtered.copy())
         st.markdown("### FAN Performance (Main Table)")
-        st.dataframe(styled_df, use_container_width=True)
+        highlight_mask = self._render_dataframe(df_filtered.copy())
 
         # Status text
         st.markdown(
@@ -197,67 +240,9 @@ class FAN_Analyzer:
         )
         st.markdown("<br><br>", unsafe_allow_html=True)
 
-        # Add FanType, Board, Port
-        df_result["FanType"] = df_result[self.COL_MOBJ].str.extract(r"(FCC|FCPP|FCPL|FCPS)")
-        df_result["Board"] = df_result[self.COL_MOBJ].apply(self.extract_board)
-        df_result["Port"] = df_result[self.COL_MOBJ].apply(self.extract_port)
-
-        # Average by group
-        df_avg = (
-            df_result
-            .groupby(["FanType", self.COL_ME, "Site Name", "Board"], as_index=False)[self.COL_VALUE]
-            .mean()
-            .rename(columns={self.COL_VALUE: "Avg Fan Speed (Rps)"})
-        )
-        df_avg["Site-Obj"] = df_avg["Site Name"].astype(str) + " - " + df_avg["Board"].astype(str)
-
-        # Thresholds
-        thresholds = {"FCC": 120, "FCPP": 250, "FCPL": 120, "FCPS": 230}
-
-        # Abnormal table (per FanType)
-        def show_abnormal_from_main(df_main: pd.DataFrame, title: str):
-            st.markdown(f"#### {title} – Abnormal Rows")
-            ab_mask = df_main.apply(
-                lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-                axis=1
-            )
-
-            if not ab_mask.any():
-                st.info(" No abnormal rows (Normal)")
-                return
-
-            df_abn = df_main.loc[ab_mask, [
-                "Site Name", self.COL_ME, self.COL_MOBJ,
-                self.COL_MAX_TH, self.COL_MIN_TH, self.COL_VALUE
-            ]].copy()
-
-            df_abn[self.COL_VALUE] = pd.to_numeric(df_abn[self.COL_VALUE], errors="coerce").round(2)
-            df_abn[self.COL_MAX_TH] = pd.to_numeric(df_abn[self.COL_MAX_TH], errors="coerce").round(2)
-            df_abn[self.COL_MIN_TH] = pd.to_numeric(df_abn[self.COL_MIN_TH], errors="coerce").round(2)
-
-            # เก็บ abnormal
-            self.df_abnormal = pd.concat([self.df_abnormal, df_abn], ignore_index=True)
-            self.df_abnormal_by_type[ftype] = df_abn.copy()
-
-            st.write("DEBUG FAN_Analyzer df_abnormal_by_type keys:", list(self.df_abnormal_by_type.keys()))
-
-            # highlight Value column
-            def highlight_red(val):
-                try:
-                    v = float(val)
-                    return "background-color: #ff4d4d; color: white" if v > 0 else ""
-                except Exception:
-                    return ""
-
-            styled_abn = (
-                df_abn.style
-                .applymap(highlight_red, subset=[self.COL_VALUE])
-                .format({self.COL_VALUE: "{:.2f}"})
-            )
-            st.dataframe(styled_abn, use_container_width=True)
-
         # Loop per FanType
-        for ftype, th in thresholds.items():
+        df_avg = result.frames["avg"]
+        for ftype, th in self.THRESHOLDS.items():
             df_sub = df_avg[df_avg["FanType"] == ftype].copy()
             if df_sub.empty:
                 continue
@@ -280,63 +265,5 @@ class FAN_Analyzer:
                                 use_container_width=True)
 
             # abnormal table
-            show_abnormal_from_main(df_result[df_result[self.COL_MOBJ].str.contains(ftype)], ftype)
+            self._show_abnormal(result.abnormal_by_type.get(ftype), ftype)
             st.markdown("<br><br><br><br>", unsafe_allow_html=True)
-
-        st.write("DEBUG df_abnormal", self.df_abnormal)
-        return df_result
-    
-    def prepare(self) -> pd.DataFrame:
-        """
-        เตรียมข้อมูล FAN สำหรับ Summary (ไม่ render UI)
-        return df_result ที่ merge แล้ว พร้อม abnormal เก็บใน self
-        """
-        # 1) Normalize
-        self.df_fan = self._normalize_columns(self.df_fan)
-        self.df_ref = self._normalize_columns(self.df_ref)
-
-        # 2) Required check
-        self._check_required()
-
-        # 3) Merge with reference
-        df_merged = self._merge_with_ref()
-        if df_merged.empty:
-            return pd.DataFrame()
-
-        # 4) Build df_result
-        df_result = df_merged[[
-            self.COL_BEGIN, self.COL_END, "Site Name", self.COL_ME, self.COL_MOBJ,
-            self.COL_MAX_TH, self.COL_MIN_TH, self.COL_VALUE, "order"
-        ]].copy()
-
-        df_result = df_result.sort_values("order").drop(columns=["order"]).reset_index(drop=True)
-
-        # 5) Add FanType, Board, Port
-        df_result["FanType"] = df_result[self.COL_MOBJ].str.extract(r"(FCC|FCPP|FCPL|FCPS)")
-        df_result["Board"] = df_result[self.COL_MOBJ].apply(self.extract_board)
-        df_result["Port"] = df_result[self.COL_MOBJ].apply(self.extract_port)
-
-        # 6) Detect abnormal (รวมทั้งหมด)
-        ab_mask_all = df_result.apply(
-            lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-            axis=1
-        )
-
-        self.df_abnormal = df_result.loc[ab_mask_all].copy()
-
-        # 7) Detect abnormal แยกตาม FanType
-        self.df_abnormal_by_type = {}
-        thresholds = {"FCC": 120, "FCPP": 250, "FCPL": 120, "FCPS": 230}
-        for ftype, th in thresholds.items():
-            df_sub = df_result[df_result["FanType"] == ftype].copy()
-            if df_sub.empty:
-                continue
-
-            ab_mask = df_sub.apply(
-                lambda r: self._is_not_ok_rule(r[self.COL_MOBJ], r[self.COL_VALUE]),
-                axis=1
-            )
-            if ab_mask.any():
-                self.df_abnormal_by_type[ftype] = df_sub.loc[ab_mask].copy()
-
-        return df_result
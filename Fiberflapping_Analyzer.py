@@ -4,17 +4,21 @@ import pandas as pd
 import streamlit as st
 import plotly.express as px
 from utils.filters import cascading_filter
+from utils.table_style import CSS_BAD, render_table
+from utils.interval_join import AlarmIntervalIndex
+from utils.analysis import AnalysisResult, HeadlessAnalyzer
 
 # หมายเหตุ: ต้องมีฟังก์ชัน cascading_filter(df, cols, ns, labels=None, clear_text="...") อยู่ภายนอกให้เรียกใช้งานได้
 
 
-class FiberflappingAnalyzer:
+class FiberflappingAnalyzer(HeadlessAnalyzer):
     """
     จัดระเบียบ logic สำหรับ Fiber Flapping:
       - เตรียม/normalize ข้อมูล OSC Optical และ FM
       - กรองรายการที่ Max-Min(dB) > threshold
-      - หาแถวที่ 'ไม่เจอ alarm match'
+      - หาแถวที่ 'ไม่เจอ alarm match' (= abnormal)
       - เรนเดอร์ตาราง highlight + KPI รายวัน + กราฟรวม 7 วัน
+      - compute() คำนวณอย่างเดียว (ไม่แตะ Streamlit), render() วาด UI จากผลนั้น
 
     การใช้งาน:
         analyzer = FiberflappingAnalyzer(df_optical, df_fm, threshold=2.0)
@@ -26,6 +30,9 @@ class FiberflappingAnalyzer:
         self.df_fm_raw = df_fm
         self.threshold = threshold
         self.daily_tables = None  # NEW: เก็บผลตารางรายวันสำหรับ export/report
+        self.df_abnormal = pd.DataFrame()
+        self.df_abnormal_by_type = {}
+        self.df_unmatched = pd.DataFrame()
 
      
 
@@ -75,26 +82,27 @@ class FiberflappingAnalyzer:
         หาแถวใน df_filtered ที่ 'ไม่เจอ' alarm match:
           - Link column ใน FM ต้อง contains ทั้ง ME และ Target ME
           - และช่วงเวลา overlap: Occurrence <= End และ Clear >= Begin
+        จับคู่ทั้งก้อนผ่าน AlarmIntervalIndex (ไม่วน regex ทั้งตาราง FM ต่อแถว)
         """
-        result_rows = []
-        for _, row in df_filtered.iterrows():
-            me = re.escape(str(row.get("ME", "")))
-            target_me = re.escape(str(row.get("Target ME", "")))
-            begin_t = row.get("Begin Time", pd.NaT)
-            end_t = row.get("End Time", pd.NaT)
-
-            # เงื่อนไขเวลา (ถ้า NaT จะไม่ match)
-            matched = df_fm_norm[
-                df_fm_norm[link_col].astype(str).str.contains(me, na=False)
-                & df_fm_norm[link_col].astype(str).str.contains(target_me, na=False)
-                & (df_fm_norm["Occurrence Time"] <= end_t)
-                & (df_fm_norm["Clear Time"] >= begin_t)
-            ]
-
-            if matched.empty:
-                result_rows.append(row)
-
-        return pd.DataFrame(result_rows)
+        if df_filtered.empty:
+            return pd.DataFrame()
+
+        def _text(col: str) -> pd.Series:
+            if col not in df_filtered.columns:
+                return pd.Series("", index=df_filtered.index)
+            return df_filtered[col].map(str)
+
+        def _time(col: str) -> pd.Series:
+            if col not in df_filtered.columns:
+                return pd.Series(pd.NaT, index=df_filtered.index)
+            return df_filtered[col]
+
+        matched = AlarmIntervalIndex(df_fm_norm, link_col).overlaps(
+            _text("ME"), _text("Target ME"), _time("Begin Time"), _time("End Time")
+        )
+        if matched.all():
+            return pd.DataFrame()
+        return df_filtered[~matched]
 
     # -------------------- View Preparation --------------------
     @staticmethod
@@ -121,7 +129,7 @@ class FiberflappingAnalyzer:
         return df_view
 
     # -------------------- Rendering --------------------
-    def render(self, df_nomatch: pd.DataFrame) -> None:
+    def render_nomatch(self, df_nomatch: pd.DataFrame) -> None:
         st.markdown("### OSC Power Flapping (No Alarm Match)")
 
         if df_nomatch.empty:
@@ -143,22 +151,16 @@ class FiberflappingAnalyzer:
 
         # Highlight เฉพาะคอลัมน์ "Max - Min (dB)" > threshold
         if "Max - Min (dB)" in df_view.columns:
-            styled_df = (
-                df_view.style
-                .apply(
-                    lambda _:
-                        ['background-color:#ff4d4d; color:white' if (v > self.threshold) else ''
-                         for v in df_view["Max - Min (dB)"]],
-                    subset=["Max - Min (dB)"]
-                )
-                .format({
+            render_table(
+                df_view,
+                cells={"Max - Min (dB)": (df_view["Max - Min (dB)"] > self.threshold, CSS_BAD)},
+                fmt={
                     "Max Value of Input Optical Power(dBm)": "{:.2f}",
                     "Min Value of Input Optical Power(dBm)": "{:.2f}",
                     "Input Optical Power(dBm)": "{:.2f}",
                     "Max - Min (dB)": "{:.2f}",
-                })
+                },
             )
-            st.write(styled_df)
             
         else:
             st.dataframe(df_view, use_container_width=True)
@@ -222,22 +224,16 @@ class FiberflappingAnalyzer:
 
                 # ✅ ทำ highlight คอลัมน์ Max - Min (dB)
                 if "Max - Min (dB)" in sel.columns:
-                    styled_sel = (
-                        sel.style
-                        .apply(
-                            lambda _:
-                                ['background-color:#ff4d4d; color:white' if (v > self.threshold) else ''
-                                for v in sel["Max - Min (dB)"]],
-                            subset=["Max - Min (dB)"]
-                        )
-                        .format({
+                    render_table(
+                        sel,
+                        cells={"Max - Min (dB)": (sel["Max - Min (dB)"] > self.threshold, CSS_BAD)},
+                        fmt={
                             "Max Value of Input Optical Power(dBm)": "{:.2f}",
                             "Min Value of Input Optical Power(dBm)": "{:.2f}",
                             "Input Optical Power(dBm)": "{:.2f}",
                             "Max - Min (dB)": "{:.2f}",
-                        })
+                        },
                     )
-                    st.write(styled_sel)
                 else:
                     st.dataframe(sel, use_container_width=True)
                     
@@ -291,8 +287,8 @@ class FiberflappingAnalyzer:
         self.daily_tables = tables
         return tables
 
-    # -------------------- Orchestration --------------------
-    def process(self) -> None:
+    # -------------------- Compute (headless) --------------------
+    def compute(self) -> AnalysisResult:
         # 1) เตรียมข้อมูล
         df_optical_norm = self.normalize_optical()
         df_fm_norm, link_col = self.normalize_fm()
@@ -300,13 +296,21 @@ class FiberflappingAnalyzer:
         # 2) กรองตาม threshold
         df_filtered = self.filter_optical_by_threshold(df_optical_norm)
 
-        # 3) หา no-match
+        # 3) หา no-match (flapping ที่ไม่มี alarm รองรับ = abnormal)
         df_nomatch = self.find_nomatch(df_filtered, df_fm_norm, link_col)
 
+        return AnalysisResult(
+            "fiber",
+            df_result=df_optical_norm,
+            df_abnormal=df_nomatch,
+            abnormal_by_type=self.build_daily_tables(df_nomatch),
+            kpis={"flapping": len(df_nomatch), "sites": int(df_nomatch["ME"].nunique()) if "ME" in df_nomatch else 0},
+        )
+
+    # -------------------- Orchestration --------------------
+    def render(self, result: AnalysisResult) -> None:
         # 4) ตารางหลัก
-        self.render(df_nomatch)
+        self.render_nomatch(result.df_abnormal)
 
         # 5) Weekly Summary KPI + กราฟท้ายสุด
-        self.render_weekly_summary(df_nomatch)
-
-    
+        self.render_weekly_summary(result.df_abnormal)
@@ -1,12 +1,19 @@
 # line_analyzer.py
-import re
+import numpy as np
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.ref_registry import prepare_ref
+from utils.keyed_join import RefKeyIndex, mapping_key
+from utils.rules import Rule, RuleSet
+from utils.table_style import CSS_BAD, CSS_PRESET, render_table, render_unmatched
+from utils.analysis import AnalysisResult, HeadlessAnalyzer
+from utils.log_source import LogSource
+from utils.wason_log import get_log_index
 import plotly.express as px
 import plotly.graph_objects as go
 
-class Line_Analyzer:
+class Line_Analyzer(HeadlessAnalyzer):
     """
     ย้าย logic เดิมมารวมในคลาสเดียว:
       - อ่าน/จัดคอลัมน์
@@ -15,6 +22,7 @@ class Line_Analyzer:
       - เรียงตาม order
       - Cascading filter
       - ไฮไลต์สี และสรุปสถานะ + Visuals
+      - compute() คำนวณอย่างเดียว (ไม่แตะ Streamlit), render() วาด UI จากผลนั้น
 
     NOTE:
     - พึ่งพา cascading_filter(ns=...) ที่มีอยู่ในโปรเจกต์เดิม
@@ -23,8 +31,11 @@ class Line_Analyzer:
 
     # ---------- พาร์เซพรีเซ็ตจาก WASON Log ----------
     @staticmethod
-    def get_preset_map(log_text: str) -> dict:
-        lines = log_text.splitlines()
+    def get_preset_map(log_text: str | LogSource) -> dict:
+        # index (และ pmap) cache ตาม hash ของ log → rerun หน้าเดิมไม่ parse ซ้ำ
+        index = get_log_index(log_text)
+        if "line_pmap" in index.derived:
+            return dict(index.derived["line_pmap"])
         ipmap = {
             "30.10.90.6": "HYI-4",
             "30.10.10.6": "Jasmine",
@@ -34,39 +45,19 @@ class Line_Analyzer:
             "30.10.110.6": "PKT",
         }
         pmap = {}
-        i = 0
-        while i < len(lines):
-            line = lines[i]
-            m = re.search(r"\[CALL\s+\d+\]\s+\[([\d.]+)\s+[\d.]+\s+(\d+)\]", line)
-            if m:
-                ip = m.group(1).strip()
-                cid = m.group(2).strip().lstrip("0")
-                site = ipmap.get(ip, "Unknown")
-                key = f"{cid} ({site})"
-                j = i + 1
-                while j < len(lines):
-                    if "[CALL" in lines[j]:
-                        break
-                    if "[PreRout]:" in lines[j]:
-                        k = j + 1
-                        while k < len(lines):
-                            if "[CALL" in lines[k]:
-                                break
-                            m2 = re.search(r"--(\d+)--WORK--\(USED\)--\(SUCCESS\)", lines[k])
-                            if m2:
-                                preset = m2.group(1).strip()
-                                pmap[cid] = preset
-                                pmap.setdefault(key, preset)
-                                break
-                            k += 1
-                        break
-                    j += 1
-            i += 1
-        return pmap
-
-    def __init__(self, df_line: pd.DataFrame, df_ref: pd.DataFrame, pmap: dict | None = None, ns: str = "line"):
+        for ip, cid, preset in index.call_presets:
+            pmap[cid] = preset
+            pmap.setdefault(f"{cid} ({ipmap.get(ip, 'Unknown')})", preset)
+        index.derived["line_pmap"] = pmap
+        return dict(pmap)
+
+    def __init__(
+        self, df_line: pd.DataFrame, df_ref: pd.DataFrame, pmap: dict | None = None, ns: str = "line",
+        ref_index: RefKeyIndex | None = None,
+    ):
         self.df_line = df_line
         self.df_ref  = df_ref
+        self.ref_index = ref_index  # index ของ Mapping จาก registry (ถ้าไม่มีจะสร้างจาก df_ref)
         self.pmap    = pmap or {}
         self.ns      = ns  # namespace ใช้ร่วมกับ cascading_filter
 
@@ -78,10 +69,30 @@ class Line_Analyzer:
         self.col_min_out  = "Minimum threshold(out)"
         self.col_max_out  = "Maximum threshold(out)"
 
+        # ---------- กฎ abnormal ----------
+        col_ber = "Instant BER After FEC"
+        rule_ber        = Rule(col_ber, max="Threshold", name="BER")                      # BER เกิน Threshold
+        rule_ber_no_thr = Rule(col_ber, max=0, min=0, only_if_na="Threshold", name="BER")  # ไม่มี Threshold → BER ต้องเป็น 0
+        rule_in  = Rule(self.col_in,  max=self.col_max_in,  min=self.col_min_in,  both_bounds=True, name="Input")
+        rule_out = Rule(self.col_out, max=self.col_max_out, min=self.col_min_out, both_bounds=True, name="Output")
+
+        self.power_rules = RuleSet([rule_in, rule_out])                                  # LB2R / L4S
+        self.rules       = RuleSet([rule_ber, rule_in, rule_out])                        # abnormal ราย row
+        self.line_rules  = RuleSet([rule_ber, rule_ber_no_thr, rule_in, rule_out])       # สถานะราย "เส้น"
+        self.view_rules  = RuleSet([Rule(col_ber, max=0, name="BER"), rule_in, rule_out])  # ไฮไลต์ตารางดิบ
+
+
+        # คอลัมน์ตารางหลัก (ตามของเดิม)
+        self.main_cols = [
+            "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC",
+            self.col_max_out, self.col_min_out, self.col_out,
+            self.col_max_in, self.col_min_in, self.col_in, "Route"
+        ]
 
         # ---------- NEW: containers for Summary ----------
         self.df_abnormal = pd.DataFrame()
         self.df_abnormal_by_type = {}
+        self.df_unmatched = pd.DataFrame()  # แถวในไฟล์ที่ไม่พบใน reference
 
     # ---------- Utilities ----------
     @staticmethod
@@ -104,15 +115,11 @@ class Line_Analyzer:
             raise ValueError(f"Line cards file must contain columns: {', '.join(sorted(required_cols))}")
 
     def _merge_with_ref(self) -> pd.DataFrame:
-        # เพิ่มลำดับ (ไว้เรียงภายหลัง)
-        self.df_ref["order"] = range(len(self.df_ref))
+        # strip Mapping + เพิ่มลำดับ (ไว้เรียงภายหลัง) — ถ้ามาจาก registry จะเตรียมไว้แล้ว
+        self.df_ref = prepare_ref(self.df_ref)
 
         # สร้าง key แม็พ
-        self.df_line["Mapping Format"] = (
-            self.df_line["ME"].astype(str).str.strip()
-            + self.df_line["Measure Object"].astype(str).str.strip()
-        )
-        self.df_ref["Mapping"] = self.df_ref["Mapping"].astype(str).str.strip()
+        self.df_line["Mapping Format"] = mapping_key(self.df_line)
 
         # เลือกคอลัมน์จาก ref ที่ใช้จริง
         cols_ref = [
@@ -120,12 +127,8 @@ class Line_Analyzer:
             self.col_max_out, self.col_min_out, self.col_max_in, self.col_min_in,
             "Route", "order"
         ]
-        df_merged = pd.merge(
-            self.df_line,
-            self.df_ref[cols_ref],
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = RefKeyIndex.for_ref(self.df_ref, self.ref_index).join(
+            self.df_line, "Mapping Format", self.df_ref, cols_ref
         )
         return df_merged
 
@@ -137,28 +140,7 @@ class Line_Analyzer:
         )
         return df
 
-    @staticmethod
-    def _row_has_issue(r: pd.Series,
-                       col_ber: str,
-                       col_out: str, col_max_out: str, col_min_out: str,
-                       col_in: str,  col_max_in: str,  col_min_in: str) -> bool:
-        def _num(x):
-            try:
-                return float(x)
-            except Exception:
-                return float("nan")
-
-        ber = _num(r.get(col_ber))
-        vout, hi_out, lo_out = _num(r.get(col_out)), _num(r.get(col_max_out)), _num(r.get(col_min_out))
-        vin,  hi_in,  lo_in  = _num(r.get(col_in)),  _num(r.get(col_max_in)),  _num(r.get(col_min_in))
-
-        return (
-            (pd.notna(ber) and ber > 0) or
-            (pd.notna(vout) and pd.notna(hi_out) and pd.notna(lo_out) and (vout > hi_out or vout < lo_out)) or
-            (pd.notna(vin)  and pd.notna(hi_in)  and pd.notna(lo_in)  and (vin  > hi_in  or vin  < lo_in))
-        )
-
-    def _style_dataframe(self, df_view: pd.DataFrame) -> pd.io.formats.style.Styler:
+    def _render_dataframe(self, df_view: pd.DataFrame) -> None:
         col_ber = "Instant BER After FEC"
 
         # ✅ บังคับคอลัมน์ตัวเลขทั้งหมดให้เป็น float (กัน error format 'E')
@@ -168,71 +150,31 @@ class Line_Analyzer:
             if c in df_view.columns:
                 df_view[c] = pd.to_numeric(df_view[c], errors="coerce")
 
-        def _has_issue_row(r):
-            return self._row_has_issue(
-                r,
-                col_ber,
-                self.col_out, self.col_max_out, self.col_min_out,
-                self.col_in,  self.col_max_in,  self.col_min_in
-            )
-
-        styled = (
-            df_view.style
-            # 🌑 ไฮไลต์ gray ถ้ามีปัญหา
-            .apply(lambda r: [
-                'background-color:#e6e6e6; color:black' if _has_issue_row(r) else ''
-                for _ in r
-            ], axis=1)
-
-            # 🔴 ไฮไลต์ BER abnormal
-            .apply(lambda _: [
-                'background-color:#ff4d4d; color:white'
-                if (pd.notna(v) and v > 0) else ''
-                for v in df_view[col_ber]
-            ], subset=[col_ber] if col_ber in df_view.columns else [])
-
-            # 🔴 ไฮไลต์ Output abnormal
-            .apply(lambda _: [
-                'background-color:#ff4d4d; color:white'
-                if (pd.notna(v) and pd.notna(hi) and pd.notna(lo) and (v > hi or v < lo)) else ''
-                for v, hi, lo in zip(
-                    df_view.get(self.col_out, []),
-                    df_view.get(self.col_max_out, []),
-                    df_view.get(self.col_min_out, []),
-                )
-            ], subset=[self.col_out] if self.col_out in df_view.columns else [])
-
-            # 🔴 ไฮไลต์ Input abnormal
-            .apply(lambda _: [
-                'background-color:#ff4d4d; color:white'
-                if (pd.notna(v) and pd.notna(hi) and pd.notna(lo) and (v > hi or v < lo)) else ''
-                for v, hi, lo in zip(
-                    df_view.get(self.col_in, []),
-                    df_view.get(self.col_max_in, []),
-                    df_view.get(self.col_min_in, []),
-                )
-            ], subset=[self.col_in] if self.col_in in df_view.columns else [])
-
-            # 🔵 ไฮไลต์ Route ที่เป็น Preset
-            .apply(lambda _: [
-                'background-color:lightblue; color:black'
-                if str(x).startswith("Preset") else ''
-                for x in df_view.get("Route", [])
-            ], subset=["Route"] if "Route" in df_view.columns else [])
-
-            # ✅ กำหนดรูปแบบการแสดงผล
-            .format({
-                self.col_out: "{:.4f}", 
+        # เทาทั้งแถวเมื่อมีปัญหา, แดงเฉพาะค่าที่ผิด, ฟ้าถ้า Route เป็น Preset
+        masks = self.view_rules.masks(df_view)
+        cells = {
+            col_ber:      (masks["BER"], CSS_BAD),
+            self.col_out: (masks["Output"], CSS_BAD),
+            self.col_in:  (masks["Input"], CSS_BAD),
+        }
+        if "Route" in df_view.columns:
+            cells["Route"] = (df_view["Route"].astype(str).str.startswith("Preset"), CSS_PRESET)
+
+        render_table(
+            df_view,
+            row_mask=self.view_rules.mask(df_view),
+            cells=cells,
+            fmt={
+                self.col_out: "{:.4f}",
                 self.col_in: "{:.4f}",
-                self.col_max_out: "{:.4f}", 
+                self.col_max_out: "{:.4f}",
                 self.col_min_out: "{:.4f}",
-                self.col_max_in: "{:.4f}",  
+                self.col_max_in: "{:.4f}",
                 self.col_min_in: "{:.4f}",
-                "Instant BER After FEC": "{:.2E}",   # 👈 ใช้ .2E ปลอดภัยชัวร์
-                "Threshold": "{:.2E}",               # 👈
-            })
+                col_ber: "{:.2E}",       # 👈 ใช้ .2E ปลอดภัยชัวร์
+                "Threshold": "{:.2E}",   # 👈
+            },
         )
-        return styled
 
 
 
@@ -240,60 +182,128 @@ class Line_Analyzer:
     def _collapse_by_line(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         รวมหลายแถวที่เป็นเส้นเดียวกัน (Site+ME+Call ID) ให้เหลือ 1 แถวตรรกะ
-        - BER/Threshold: ดึงค่าจากแถว BER ถ้ามี
+        - BER/Threshold/Input/Output: ค่าแรกที่ไม่ว่างของกลุ่ม
         - Power: รวมแบบ conservative range (min ใช้ค่ามากสุดของ mins, max ใช้ค่าน้อยสุดของ maxes)
         - Route: ถ้ามี 'Preset ...' ในกลุ่ม ให้เลือกอันนั้น มิฉะนั้นใช้ค่าแรก
+        - Measure Object: แถวแรกที่มีค่า power ถ้ามี มิฉะนั้นแถวแรก
+        ทำด้วย groupby ครั้งเดียว: แปลงตัวเลขทั้งคอลัมน์ก่อน, Route/Measure Object เลือกด้วยอันดับ
+        (ตำแหน่งแถว + n ถ้าไม่ใช่แถวที่ต้องการ → min ของกลุ่ม = แถวที่ต้องการแถวแรก)
         """
         key_cols = ["Site Name", "ME", "Call ID"]
         if not set(key_cols).issubset(df.columns):
             return df.copy()
 
-        def _num(s):
-            return pd.to_numeric(s, errors="coerce")
-
-        rows = []
-        for (site, me, cid), g in df.groupby(key_cols, dropna=False):
-            g = g.copy()
-            routes = g.get("Route", pd.Series([], dtype=object)).astype(str).tolist()
-            route = next((r for r in routes if r.startswith("Preset")), routes[0] if routes else None)
-
-            power_cols = [self.col_in, self.col_out, self.col_min_in, self.col_max_in, self.col_min_out, self.col_max_out]
-            has_power = g[power_cols].notna().any(axis=1) if set(power_cols).issubset(g.columns) else pd.Series(False, index=g.index)
-            mo = (g.loc[has_power, "Measure Object"].iloc[0]
-                  if "Measure Object" in g.columns and has_power.any()
-                  else (g["Measure Object"].iloc[0] if "Measure Object" in g.columns and len(g) else None))
-
-            ber = _num(g.get("Instant BER After FEC", pd.Series(dtype=float))).dropna()
-            thr = _num(g.get("Threshold", pd.Series(dtype=float))).dropna()
-            ber_val = ber.iloc[0] if len(ber) else float("nan")
-            thr_val = thr.iloc[0] if len(thr) else float("nan")
-
-            vin_vals    = _num(g.get(self.col_in, pd.Series(dtype=float))).dropna()
-            vout_vals   = _num(g.get(self.col_out, pd.Series(dtype=float))).dropna()
-            min_in_vals = _num(g.get(self.col_min_in, pd.Series(dtype=float))).dropna()
-            max_in_vals = _num(g.get(self.col_max_in, pd.Series(dtype=float))).dropna()
-            min_out_vals= _num(g.get(self.col_min_out, pd.Series(dtype=float))).dropna()
-            max_out_vals= _num(g.get(self.col_max_out, pd.Series(dtype=float))).dropna()
-
-            vin   = vin_vals.iloc[0] if len(vin_vals) else float("nan")
-            vout  = vout_vals.iloc[0] if len(vout_vals) else float("nan")
-            min_in  = min_in_vals.max()  if len(min_in_vals) else float("nan")  # narrowest lower bound
-            max_in  = max_in_vals.min()  if len(max_in_vals) else float("nan")  # narrowest upper bound
-            min_out = min_out_vals.max() if len(min_out_vals) else float("nan")
-            max_out = max_out_vals.min() if len(max_out_vals) else float("nan")
-
-            rows.append({
-                "Site Name": site, "ME": me, "Call ID": str(cid),
-                "Measure Object": mo, "Route": route,
-                "Threshold": thr_val, "Instant BER After FEC": ber_val,
-                self.col_max_out: max_out, self.col_min_out: min_out, self.col_out: vout,
-                self.col_max_in:  max_in,  self.col_min_in:  min_in,  self.col_in:  vin,
-            })
-
-        return pd.DataFrame(rows)
-
-    # ---------- MAIN PIPELINE ----------
-    def process(self) -> None:
+        n = len(df)
+        pos = np.arange(n)
+        power_cols = [self.col_in, self.col_out, self.col_min_in, self.col_max_in, self.col_min_out, self.col_max_out]
+        work = df[key_cols].reset_index(drop=True)
+        for c in ["Threshold", "Instant BER After FEC"] + power_cols:
+            work[c] = pd.to_numeric(df[c], errors="coerce").to_numpy() if c in df.columns else np.nan
+
+        routes = df["Route"].astype(str).reset_index(drop=True) if "Route" in df.columns else None
+        if routes is not None:
+            work["_route"] = np.where(routes.str.startswith("Preset", na=False), pos, pos + n)
+        if "Measure Object" in df.columns:
+            if set(power_cols).issubset(df.columns):
+                has_power = df[power_cols].notna().any(axis=1).to_numpy()
+            else:
+                has_power = np.zeros(n, dtype=bool)
+            work["_mo"] = np.where(has_power, pos, pos + n)
+
+        picks = {c: (c, "min") for c in ("_route", "_mo") if c in work.columns}
+        out = work.groupby(key_cols, dropna=False).agg(
+            **picks,
+            **{
+                "Threshold": ("Threshold", "first"),
+                "Instant BER After FEC": ("Instant BER After FEC", "first"),
+                self.col_max_out: (self.col_max_out, "min"),   # narrowest upper bound
+                self.col_min_out: (self.col_min_out, "max"),   # narrowest lower bound
+                self.col_out: (self.col_out, "first"),
+                self.col_max_in: (self.col_max_in, "min"),
+                self.col_min_in: (self.col_min_in, "max"),
+                self.col_in: (self.col_in, "first"),
+            },
+        ).reset_index()
+
+        out["Call ID"] = out["Call ID"].map(str)
+        out.insert(3, "Measure Object",
+                   df["Measure Object"].iloc[out.pop("_mo") % n].to_numpy() if "_mo" in out.columns else None)
+        out.insert(4, "Route", routes.iloc[out.pop("_route") % n].to_numpy() if routes is not None else None)
+        return out
+
+    # ---------- Compute (headless) ----------
+    def _line_kpis(self, df_lines: pd.DataFrame) -> dict:
+        """KPI ระดับ "เส้น": BER / Input / Output / Preset Usage + ตัวนับของ BER Donut"""
+        total = len(df_lines)
+
+        # --- BER ---
+        ber = pd.to_numeric(df_lines["Instant BER After FEC"].astype(str), errors="coerce").astype(float)
+        thr = pd.to_numeric(df_lines["Threshold"].astype(str), errors="coerce").astype(float)
+        ok_ber = (
+            ((thr > 0) & (ber <= thr)) |
+            ((thr == 0) & (ber == 0))
+        )
+
+        # --- BER Donut: นับเฉพาะเส้นที่วัด BER จริง ---
+        measured = ber.notna() | thr.notna()
+        ok_measured = (((thr.notna()) & (ber.notna()) & (ber <= thr)) |
+                       ((thr.isna()) & (ber.notna()) & (ber == 0))) & measured
+
+        # --- Input / Output ---
+        vin = pd.to_numeric(df_lines.get(self.col_in), errors="coerce")
+        min_in = pd.to_numeric(df_lines.get(self.col_min_in), errors="coerce")
+        max_in = pd.to_numeric(df_lines.get(self.col_max_in), errors="coerce")
+        ok_in = (vin >= min_in) & (vin <= max_in)
+
+        vout = pd.to_numeric(df_lines.get(self.col_out), errors="coerce")
+        min_out = pd.to_numeric(df_lines.get(self.col_min_out), errors="coerce")
+        max_out = pd.to_numeric(df_lines.get(self.col_max_out), errors="coerce")
+        ok_out = (vout >= min_out) & (vout <= max_out)
+
+        # --- Preset Usage ---
+        if "Route" in df_lines.columns:
+            mask_preset = df_lines["Route"].astype(str).str.startswith("Preset")
+        else:
+            mask_preset = pd.Series(False, index=df_lines.index)
+        p_fail_ber = ber > thr
+        p_fail_in = (vin < min_in) | (vin > max_in)
+        p_fail_out = (vout < min_out) | (vout > max_out)
+
+        ber_measured = int(measured.sum())
+        ber_measured_ok = int(ok_measured.sum())
+        return {
+            "lines": total,
+            "ber_ok": int(ok_ber.sum()), "ber_fail": total - int(ok_ber.sum()),
+            "in_ok": int(ok_in.sum()), "in_fail": total - int(ok_in.sum()),
+            "out_ok": int(ok_out.sum()), "out_fail": total - int(ok_out.sum()),
+            "preset_used": int(mask_preset.sum()),
+            "preset_fail": int((mask_preset & (p_fail_ber | p_fail_in | p_fail_out)).sum()),
+            "ber_measured_ok": ber_measured_ok,
+            "ber_measured_fail": max(0, ber_measured - ber_measured_ok),
+            "failed_lines": int(self.line_rules.mask(df_lines).sum()),
+        }
+
+    def _abnormal_by_type(self, df_result: pd.DataFrame) -> dict:
+        """abnormal แยกกลุ่ม BER / LB2R / L4S / Preset (ใช้ใน Summary/PDF)"""
+        # BER abnormal (Instant BER After FEC > Threshold)
+        mask_ber = self.rules.masks(df_result)["BER"]
+        df_ber = df_result.loc[mask_ber, ["Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC"]].copy()
+
+        # LB2R / L4S abnormal (power out of range)
+        mobj = df_result["Measure Object"].astype(str)
+        power_bad = self.power_rules.mask(df_result)
+        df_lb2r = df_result.loc[mobj.str.contains("LB2R", na=False) & power_bad, self.main_cols].copy()
+        df_l4s = df_result.loc[mobj.str.contains("L4S", na=False) & power_bad, self.main_cols].copy()
+
+        # Preset (Route startswith 'Preset')
+        df_preset = df_result.loc[
+            df_result["Route"].astype(str).str.startswith("Preset"),
+            ["Site Name", "ME", "Call ID", "Measure Object", "Route"]
+        ].copy()
+
+        return {"BER": df_ber, "LB2R": df_lb2r, "L4S": df_l4s, "Preset": df_preset}
+
+    def compute(self) -> AnalysisResult:
         # 1) Normalize columns
         self.df_line = self._normalize_columns(self.df_line)
         self.df_ref  = self._normalize_columns(self.df_ref)
@@ -304,24 +314,42 @@ class Line_Analyzer:
         # 3) Merge กับ reference
         df_merged = self._merge_with_ref()
         if df_merged.empty:
-            st.warning("No matching mapping found between Line file and reference")
-            return
+            return AnalysisResult("line", df_unmatched=self.df_unmatched)
 
-        # 4) เลือกคอลัมน์ที่จะแสดง (ตามของเดิม)
-        self.main_cols = [
-            "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC",
-            self.col_max_out, self.col_min_out, self.col_out,
-            self.col_max_in, self.col_min_in, self.col_in, "Route", "order"
-        ]
-        df_result = df_merged[self.main_cols]
-
-        # 5) ใส่ Preset จาก pmap
-        df_result = self._apply_preset_route(df_result)
+        # 4) เลือกคอลัมน์ + ใส่ Preset จาก pmap
+        df_result = self._apply_preset_route(df_merged[self.main_cols + ["order"]])
 
-        # 6) เรียงตาม order แล้วทิ้งคอลัมน์ช่วย
+        # 5) เรียงตาม order แล้วทิ้งคอลัมน์ช่วย
         df_result = df_result.sort_values("order").drop(columns=["order"]).reset_index(drop=True)
 
-        # 7) FILTER แบบ cascading
+        # 6) abnormal ราย row + แยกกลุ่ม
+        by_type = self._abnormal_by_type(df_result)
+        non_empty = [df for df in by_type.values() if not df.empty]
+        df_abn = pd.concat(non_empty, ignore_index=True) if non_empty else pd.DataFrame()
+
+        # 7) ระดับ "เส้น" สำหรับ KPI
+        df_lines = self._collapse_by_line(df_result)
+
+        return AnalysisResult(
+            "line",
+            df_result=df_result,
+            masks={"abnormal": self.rules.mask(df_result), **self.rules.masks(df_result)},
+            df_abnormal=df_abn,
+            abnormal_by_type=by_type,
+            kpis=self._line_kpis(df_lines),
+            frames={"lines": df_lines},
+            df_unmatched=self.df_unmatched,
+        )
+
+    # ---------- Render (Streamlit) ----------
+    def render(self, result: AnalysisResult) -> None:
+        render_unmatched(result.df_unmatched, "Line")
+        if result.df_result.empty:
+            st.warning("No matching mapping found between Line file and reference")
+            return
+        df_result = result.df_result
+
+        # 1) FILTER แบบ cascading
         df_filtered, _sel = cascading_filter(
             df_result,
             cols=["Site Name", "ME", "Measure Object", "Call ID", "Route"],
@@ -330,132 +358,48 @@ class Line_Analyzer:
         )
         st.caption(f"Line Performance (showing {len(df_filtered)}/{len(df_result)} rows)")
 
+        # 2) แสดงผลตาราง + ไฮไลต์ (ตารางดิบเพื่อการตรวจละเอียด)
+        st.markdown("### Line Performance")
+        self._render_dataframe(df_filtered.copy())
 
-        # 8) สไตล์/ไฮไลต์ (ตารางดิบเพื่อการตรวจละเอียด)
-        styled = self._style_dataframe(df_filtered.copy())
+        # 3) รวมระดับ "เส้น" ของส่วนที่ filter แล้ว (ไม่ filter = ใช้ผลจาก compute)
+        if len(df_filtered) == len(df_result):
+            df_lines, kpis = result.frames["lines"], result.kpis
+        else:
+            df_lines = self._collapse_by_line(df_filtered.copy())
+            kpis = self._line_kpis(df_lines)
 
-        # 9) แสดงผลตาราง
-        st.markdown("### Line Performance")
-        st.dataframe(styled, use_container_width=True)
-
-        # 10) รวมระดับ "เส้น" เพื่อใช้คำนวณ/กราฟให้ถูกต้อง
-        df_lines = self._collapse_by_line(df_filtered.copy())
-
-        # 11) สรุปสถานะหัวเรื่องจากระดับ "เส้น"
-        def _line_fail(row: pd.Series) -> bool:
-            ber = pd.to_numeric(pd.Series([row.get("Instant BER After FEC")]))[0]
-            thr = pd.to_numeric(pd.Series([row.get("Threshold")]))[0]
-            vin = pd.to_numeric(pd.Series([row.get(self.col_in)]))[0]
-            vout= pd.to_numeric(pd.Series([row.get(self.col_out)]))[0]
-            min_in  = pd.to_numeric(pd.Series([row.get(self.col_min_in)]))[0]
-            max_in  = pd.to_numeric(pd.Series([row.get(self.col_max_in)]))[0]
-            min_out = pd.to_numeric(pd.Series([row.get(self.col_min_out)]))[0]
-            max_out = pd.to_numeric(pd.Series([row.get(self.col_max_out)]))[0]
-
-            fail_ber  = (pd.notna(thr) and pd.notna(ber) and ber > thr) or (pd.isna(thr) and pd.notna(ber) and ber != 0)
-            fail_in   = (pd.notna(vin) and pd.notna(min_in) and pd.notna(max_in) and not (min_in <= vin <= max_in))
-            fail_out  = (pd.notna(vout) and pd.notna(min_out) and pd.notna(max_out) and not (min_out <= vout <= max_out))
-            return bool(fail_ber or fail_in or fail_out)
-
-        failed_lines = df_lines.apply(_line_fail, axis=1)
+        # 4) สรุปสถานะหัวเรื่องจากระดับ "เส้น"
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>Line Performance {}</div>".format(
-                "red" if failed_lines.any() else "green",
-                "Warning" if failed_lines.any() else "Normal"
+                "red" if kpis["failed_lines"] else "green",
+                "Warning" if kpis["failed_lines"] else "Normal"
             ),
             unsafe_allow_html=True
         )
 
         # ---------- VISUALS ----------
-        self._render_summary_kpi(df_lines)                 # Summary KPI
-        self._render_ber_donut(df_lines)                   # BER Donut
+        self._render_summary_kpi(kpis)                     # Summary KPI
+        self._render_ber_donut(df_lines, kpis)             # BER Donut
         self._render_line_charts(df_lines)                 # Line Chart
         self._render_preset_kpi_and_drilldown(df_lines)    # Preset KPI + Drill-down
 
-        # ---------- VISUALS (KPI, Donut, Line Chart, Preset) ----------
-    def _render_summary_kpi(self, df_view: pd.DataFrame) -> None:
+    # ---------- VISUALS (KPI, Donut, Line Chart, Preset) ----------
+    def _render_summary_kpi(self, kpis: dict) -> None:
         """Summary KPI: BER / Input / Output / Preset Usage (ระดับเส้น)"""
         st.markdown("### Summary KPI")
-
-        # --- BER ---
-        ber = pd.to_numeric(df_view["Instant BER After FEC"].astype(str), errors="coerce").astype(float)
-        thr = pd.to_numeric(df_view["Threshold"].astype(str), errors="coerce").astype(float)
-
-        ok = (
-            ((thr > 0) & (ber <= thr)) |
-            ((thr == 0) & (ber == 0))
-        )
-        ok_ber_cnt = int(ok.sum())
-        total_ber = len(df_view)
-        fail_ber_cnt = total_ber - ok_ber_cnt
-
-        # --- Input ---
-        vin = pd.to_numeric(df_view.get(self.col_in), errors="coerce")
-        min_in = pd.to_numeric(df_view.get(self.col_min_in), errors="coerce")
-        max_in = pd.to_numeric(df_view.get(self.col_max_in), errors="coerce")
-
-        total_in = len(df_view)
-        ok_in = (vin >= min_in) & (vin <= max_in)
-        ok_in_cnt = int(ok_in.sum())
-        fail_in_cnt = total_in - ok_in_cnt
-
-        # --- Output ---
-        vout = pd.to_numeric(df_view.get(self.col_out), errors="coerce")
-        min_out = pd.to_numeric(df_view.get(self.col_min_out), errors="coerce")
-        max_out = pd.to_numeric(df_view.get(self.col_max_out), errors="coerce")
-
-        total_out = len(df_view)
-        ok_out = (vout >= min_out) & (vout <= max_out)
-        ok_out_cnt = int(ok_out.sum())
-        fail_out_cnt = total_out - ok_out_cnt
-
-        # --- Preset Usage ---
-        if "Route" in df_view.columns:
-            mask_preset = df_view["Route"].astype(str).str.startswith("Preset")
-        else:
-            mask_preset = pd.Series(False, index=df_view.index)
-
-        preset_rows = df_view[mask_preset]
-        preset_used = int(mask_preset.sum())
-        preset_fail = 0
-
-        if not preset_rows.empty:
-            p_ber = pd.to_numeric(preset_rows.get("Instant BER After FEC"), errors="coerce")
-            p_thr = pd.to_numeric(preset_rows.get("Threshold"), errors="coerce")
-            p_vin = pd.to_numeric(preset_rows.get(self.col_in), errors="coerce")
-            p_min_in = pd.to_numeric(preset_rows.get(self.col_min_in), errors="coerce")
-            p_max_in = pd.to_numeric(preset_rows.get(self.col_max_in), errors="coerce")
-            p_vout = pd.to_numeric(preset_rows.get(self.col_out), errors="coerce")
-            p_min_out = pd.to_numeric(preset_rows.get(self.col_min_out), errors="coerce")
-            p_max_out = pd.to_numeric(preset_rows.get(self.col_max_out), errors="coerce")
-
-            p_fail_ber = (p_ber > p_thr)
-            p_fail_in = (p_vin < p_min_in) | (p_vin > p_max_in)
-            p_fail_out = (p_vout < p_min_out) | (p_vout > p_max_out)
-
-            preset_fail = int((p_fail_ber | p_fail_in | p_fail_out).sum())
-
-        # ---------- Show KPI ----------
         cols = st.columns(4)
-        cols[0].metric("BER OK", f"{ok_ber_cnt}", f"{fail_ber_cnt} Fail")
-        cols[1].metric("Input OK", f"{ok_in_cnt}", f"{fail_in_cnt} Fail")
-        cols[2].metric("Output OK", f"{ok_out_cnt}", f"{fail_out_cnt} Fail")
-        cols[3].metric("Preset Usage", f"{preset_used}", f"{preset_fail} Fail")
+        cols[0].metric("BER OK", f"{kpis['ber_ok']}", f"{kpis['ber_fail']} Fail")
+        cols[1].metric("Input OK", f"{kpis['in_ok']}", f"{kpis['in_fail']} Fail")
+        cols[2].metric("Output OK", f"{kpis['out_ok']}", f"{kpis['out_fail']} Fail")
+        cols[3].metric("Preset Usage", f"{kpis['preset_used']}", f"{kpis['preset_fail']} Fail")
 
 
-    def _render_ber_donut(self, df_view: pd.DataFrame) -> None:
+    def _render_ber_donut(self, df_view: pd.DataFrame, kpis: dict) -> None:
         """แสดง BER Donut (OK vs Fail) — นับระดับเส้นที่วัด BER จริงเท่านั้น"""
         if "Instant BER After FEC" not in df_view.columns:
             return
-
-        ber = pd.to_numeric(df_view["Instant BER After FEC"].astype(str), errors="coerce")
-        thr = pd.to_numeric(df_view["Threshold"].astype(str), errors="coerce")
-        measured = ber.notna() | thr.notna()
-        ok = (((thr.notna()) & (ber.notna()) & (ber <= thr)) |
-            ((thr.isna()) & (ber.notna()) & (ber == 0))) & measured
-        ok_cnt = int(ok.sum())
-        total = int(measured.sum())
-        fail_cnt = max(0, total - ok_cnt)
+        ok_cnt, fail_cnt = kpis["ber_measured_ok"], kpis["ber_measured_fail"]
 
         # ----- Donut Chart -----
         fig = px.pie(
@@ -480,61 +424,21 @@ class Line_Analyzer:
             "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC"
         ]]
 
-        # ---------- NEW: Save to state ----------
-
-        
         if not fail_rows.empty:
             st.markdown("**Problem Call IDs (BER above threshold)**")
 
-            def highlight_line_row(row):
-                styles = [""] * len(row)
-                col_map = {c: i for i, c in enumerate(fail_rows.columns)}
-
-                # ✅ BER check
-                try:
-                    ber = float(row["Instant BER After FEC"])
-                    thr = float(row["Threshold"])
-                    if pd.notna(ber) and pd.notna(thr) and ber > thr:
-                        styles[col_map["Instant BER After FEC"]] = "background-color:#ff4d4d; color:white"
-                except:
-                    pass
-
-                # ✅ Input check
-                if "Input Optical Power(dBm)" in row:
-                    try:
-                        v = float(row["Input Optical Power(dBm)"])
-                        lo = float(row["Minimum threshold(in)"])
-                        hi = float(row["Maximum threshold(in)"])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map["Input Optical Power(dBm)"]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                # ✅ Output check
-                if "Output Optical Power (dBm)" in row:
-                    try:
-                        v = float(row["Output Optical Power (dBm)"])
-                        lo = float(row["Minimum threshold(out)"])
-                        hi = float(row["Maximum threshold(out)"])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map["Output Optical Power (dBm)"]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                return styles
-
-           
             fail_rows = fail_rows.reset_index(drop=True)
 
-            styled = (
-                fail_rows.style
-                .apply(highlight_line_row, axis=1)
-                .format({
+            # ✅ แดงเฉพาะ BER ที่เกิน Threshold
+            render_table(
+                fail_rows,
+                cells={"Instant BER After FEC": (self.rules.masks(fail_rows)["BER"], CSS_BAD)},
+                fmt={
                     "Threshold": "{:.2E}",
                     "Instant BER After FEC": "{:.2E}"
-                }, na_rep="-")
+                },
+                na_rep="-",
             )
-            st.dataframe(styled, use_container_width=True)
 
 
 
@@ -653,41 +557,20 @@ class Line_Analyzer:
             if not df_problems.empty:
                 st.markdown(f"**⚠️ Problem Lines for {board_name}:**")
 
-                def highlight_line_row(row):
-                    styles = [""] * len(row)
-                    col_map = {c: i for i, c in enumerate(df_problems.columns)}
-
-                    # ✅ Input check
-                    try:
-                        v = float(row[self.col_in])
-                        lo = float(row[self.col_min_in])
-                        hi = float(row[self.col_max_in])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map[self.col_in]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                    # ✅ Output check
-                    try:
-                        v = float(row[self.col_out])
-                        lo = float(row[self.col_min_out])
-                        hi = float(row[self.col_max_out])
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            styles[col_map[self.col_out]] = "background-color:#ff4d4d; color:white"
-                    except:
-                        pass
-
-                    return styles
-
-                styled = (
-                    df_problems.style
-                    .apply(highlight_line_row, axis=1)
-                    .format({
+                # ✅ แดงเฉพาะ Input / Output ที่อยู่นอกช่วง threshold
+                masks = self.power_rules.masks(df_problems)
+                render_table(
+                    df_problems,
+                    cells={
+                        self.col_in:  (masks["Input"], CSS_BAD),
+                        self.col_out: (masks["Output"], CSS_BAD),
+                    },
+                    fmt={
                         "Threshold": "{:.2E}",
                         "Instant BER After FEC": "{:.2E}"
-                    }, na_rep="-")
+                    },
+                    na_rep="-",
                 )
-                st.dataframe(styled, use_container_width=True)
 
 
             else:
@@ -724,15 +607,8 @@ class Line_Analyzer:
         choice = st.selectbox("Select L4S Site(s) to Display", list(options.keys()))
         df_selected = options[choice].copy()
 
-        # ✅ กำหนดคอลัมน์ตามตารางหลัก
-        main_cols = [
-            "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC",
-            self.col_max_out, self.col_min_out, self.col_out,
-            self.col_max_in, self.col_min_in, self.col_in, "Route"
-        ]
-
         # ✅ เรียงคอลัมน์ subset ให้ตรงกับตารางหลัก
-        df_selected = df_selected[[c for c in main_cols if c in df_selected.columns]]
+        df_selected = df_selected[[c for c in self.main_cols if c in df_selected.columns]]
 
         if not df_selected.empty:
             _plot_board(df_selected, choice)
@@ -772,99 +648,3 @@ class Line_Analyzer:
 
                         df_show = sub[[c for c in preset_cols if c in sub.columns]]
                         st.dataframe(df_show.reset_index(drop=True), use_container_width=True)
-
-    # ---------- NEW: PREPARE (Summary/PDF) ----------
-    def prepare(self) -> None:
-        """เตรียม abnormal ทั้งหมดสำหรับ Summary/PDF (ไม่ render UI)"""
-        # 1) Normalize
-        self.df_line = self._normalize_columns(self.df_line)
-        self.df_ref  = self._normalize_columns(self.df_ref)
-
-        # 2) Check required
-        self._check_required()
-
-        # 3) Merge
-        df_merged = self._merge_with_ref()
-        if df_merged.empty:
-            # reset containers
-            self.df_abnormal = pd.DataFrame()
-            self.df_abnormal_by_type = {}
-            # save to session_state #4
-            st.session_state["line_analyzer"] = self
-            st.session_state["line_status"]   = "No data"
-            st.session_state["line_abn_count"] = 0
-            return
-
-        # 4) Build result & apply preset
-        df_result = df_merged[[
-            "Site Name", "ME", "Call ID", "Measure Object", "Route",
-            "Threshold", "Instant BER After FEC",
-            self.col_max_out, self.col_min_out, self.col_out,
-            self.col_max_in, self.col_min_in, self.col_in
-        ]].reset_index(drop=True)
-        df_result = self._apply_preset_route(df_result)
-
-        # 5) Detect abnormal groups
-
-        # 5.1 BER abnormal (Instant BER After FEC > Threshold)
-        ber_val = pd.to_numeric(df_result["Instant BER After FEC"], errors="coerce")
-        thr_val = pd.to_numeric(df_result["Threshold"], errors="coerce")
-        mask_ber = (pd.notna(ber_val) & pd.notna(thr_val) & (ber_val > thr_val))
-        df_ber = df_result.loc[mask_ber, ["Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC"]].copy()
-
-        # 5.2 LB2R abnormal (power out of range)
-        df_lb2r = df_result[df_result["Measure Object"].astype(str).str.contains("LB2R", na=False)].copy()
-        vin = pd.to_numeric(df_lb2r[self.col_in], errors="coerce")
-        vout = pd.to_numeric(df_lb2r[self.col_out], errors="coerce")
-        min_in = pd.to_numeric(df_lb2r[self.col_min_in], errors="coerce")
-        max_in = pd.to_numeric(df_lb2r[self.col_max_in], errors="coerce")
-        min_out = pd.to_numeric(df_lb2r[self.col_min_out], errors="coerce")
-        max_out = pd.to_numeric(df_lb2r[self.col_max_out], errors="coerce")
-        mask_lb2r = (
-            (vin.notna() & min_in.notna() & max_in.notna() & ((vin < min_in) | (vin > max_in))) |
-            (vout.notna() & min_out.notna() & max_out.notna() & ((vout < min_out) | (vout > max_out)))
-        )
-        df_lb2r = df_lb2r.loc[mask_lb2r, [
-            "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC",
-            self.col_max_out, self.col_min_out, self.col_out,
-            self.col_max_in, self.col_min_in, self.col_in, "Route"
-        ]].copy()
-
-        # 5.3 L4S abnormal (power out of range)
-        df_l4s = df_result[df_result["Measure Object"].astype(str).str.contains("L4S", na=False)].copy()
-        vin = pd.to_numeric(df_l4s[self.col_in], errors="coerce")
-        vout = pd.to_numeric(df_l4s[self.col_out], errors="coerce")
-        min_in = pd.to_numeric(df_l4s[self.col_min_in], errors="coerce")
-        max_in = pd.to_numeric(df_l4s[self.col_max_in], errors="coerce")
-        min_out = pd.to_numeric(df_l4s[self.col_min_out], errors="coerce")
-        max_out = pd.to_numeric(df_l4s[self.col_max_out], errors="coerce")
-        mask_l4s = (
-            (vin.notna() & min_in.notna() & max_in.notna() & ((vin < min_in) | (vin > max_in))) |
-            (vout.notna() & min_out.notna() & max_out.notna() & ((vout < min_out) | (vout > max_out)))
-        )
-        df_l4s = df_l4s.loc[mask_l4s, [
-            "Site Name", "ME", "Call ID", "Measure Object", "Threshold", "Instant BER After FEC",
-            self.col_max_out, self.col_min_out, self.col_out,
-            self.col_max_in, self.col_min_in, self.col_in, "Route"
-        ]].copy()
-
-        # 5.4 Preset abnormal (Route startswith 'Preset')
-        df_preset = df_result[df_result["Route"].astype(str).str.startswith("Preset")].copy()
-        df_preset = df_preset[["Site Name", "ME", "Call ID", "Measure Object", "Route"]].copy()
-
-        # 6) Save results to properties 
-        self.df_abnormal_by_type = {
-            "BER": df_ber,
-            "LB2R": df_lb2r,
-            "L4S": df_l4s,
-            "Preset": df_preset
-        } #2
-        self.df_abnormal = pd.concat(
-            [df for df in self.df_abnormal_by_type.values() if not df.empty],
-            ignore_index=True
-        ) if any(not df.empty for df in self.df_abnormal_by_type.values()) else pd.DataFrame()
-
-        # 7) Save to session_state 
-        st.session_state["line_analyzer"] = self
-        st.session_state["line_status"]   = "Abnormal" if not self.df_abnormal.empty else "Normal"
-        st.session_state["line_abn_count"] = len(self.df_abnormal)
@@ -1,8 +1,13 @@
 import pandas as pd
 import streamlit as st
 from utils.filters import cascading_filter
+from utils.ref_registry import prepare_ref
+from utils.keyed_join import RefKeyIndex, mapping_key
+from utils.rules import Rule, RuleSet, classify
+from utils.table_style import CSS_BAD, render_table, render_unmatched
+from utils.analysis import AnalysisResult, HeadlessAnalyzer
 
-class MSU_Analyzer:
+class MSU_Analyzer(HeadlessAnalyzer):
     """
     วิเคราะห์ MSU:
       - ตรวจคอลัมน์ที่ต้องมี
@@ -12,11 +17,14 @@ class MSU_Analyzer:
       - ไฮไลต์สีแดงถ้า Laser Bias Current > Threshold
       - สรุปสถานะ Warning/Normal
       - Visualization: Bar Chart
+
+    compute() คำนวณอย่างเดียว (ไม่แตะ Streamlit), render() วาด UI จากผลนั้น
     """
 
-    def __init__(self, df_msu: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "msu"):
+    def __init__(self, df_msu: pd.DataFrame, df_ref: pd.DataFrame, ns: str = "msu", ref_index: RefKeyIndex | None = None):
         self.df_msu = df_msu
         self.df_ref = df_ref
+        self.ref_index = ref_index  # index ของ Mapping จาก registry (ถ้าไม่มีจะสร้างจาก df_ref)
         self.ns     = ns
 
         # column name mapping
@@ -25,9 +33,13 @@ class MSU_Analyzer:
         self.COL_LASER = "Laser Bias Current(mA)"
         self.COL_TH    = "Maximum threshold"
 
+        # กฎ abnormal: Laser Bias Current เกิน Maximum threshold ของ reference
+        self.rules = RuleSet([Rule(self.COL_LASER, max=self.COL_TH)])
+
         # abnormal data containers
         self.df_abnormal = pd.DataFrame()
         self.df_abnormal_by_type = {}
+        self.df_unmatched = pd.DataFrame()  # แถวในไฟล์ที่ไม่พบใน reference
 
     # ---------- Utilities ----------
     @staticmethod
@@ -53,52 +65,32 @@ class MSU_Analyzer:
             raise ValueError(f"Reference file must contain columns: {', '.join(sorted(required_ref_cols))}")
 
     def _merge_with_ref(self) -> pd.DataFrame:
-        self.df_msu["Mapping Format"] = (
-            self.df_msu[self.COL_ME].astype(str).str.strip()
-            + self.df_msu[self.COL_MOBJ].astype(str).str.strip()
-        )
-        self.df_ref["Mapping"] = self.df_ref["Mapping"].astype(str).str.strip()
-        self.df_ref["order"]   = range(len(self.df_ref))
+        self.df_msu["Mapping Format"] = mapping_key(self.df_msu, self.COL_ME, self.COL_MOBJ)
+        self.df_ref = prepare_ref(self.df_ref)  # ถ้ามาจาก registry จะเตรียมไว้แล้ว
 
-        df_merged = pd.merge(
-            self.df_msu,
-            self.df_ref[["Site Name", "Mapping", self.COL_TH, "order"]],
-            left_on="Mapping Format",
-            right_on="Mapping",
-            how="inner"
+        df_merged, self.df_unmatched = RefKeyIndex.for_ref(self.df_ref, self.ref_index).join(
+            self.df_msu, "Mapping Format", self.df_ref, ["Site Name", "Mapping", self.COL_TH, "order"]
         )
         return df_merged
 
-    def _style_dataframe(self, df_view: pd.DataFrame) -> pd.io.formats.style.Styler:
+    def _render_dataframe(self, df_view: pd.DataFrame) -> None:
         # แปลงเป็น numeric
         for c in [self.COL_LASER, self.COL_TH]:
             if c in df_view.columns:
                 df_view[c] = pd.to_numeric(df_view[c], errors="coerce")
 
         # ✅ ไฮไลต์คอลัมน์ Laser ถ้าเกิน threshold
-        def red_value(_):
-            return [
-                "background-color:#ff4d4d;color:white"
-                if (pd.notna(v) and pd.notna(th) and v > th)
-                else ""
-                for v, th in zip(
-                    df_view.get(self.COL_LASER, pd.Series(index=df_view.index)),
-                    df_view.get(self.COL_TH, pd.Series(index=df_view.index)),
-                )
-            ]
-
-        styled = (
-            df_view.style
-            .apply(red_value, subset=[self.COL_LASER] if self.COL_LASER in df_view.columns else [])
-            .format({
+        render_table(
+            df_view,
+            cells={self.COL_LASER: (self.rules.mask(df_view), CSS_BAD)},
+            fmt={
                 self.COL_LASER: "{:.2f}",
                 self.COL_TH: "{:.2f}",
-            })
+            },
         )
-        return styled
 
-    # ---------- MAIN ----------
-    def process(self) -> None:
+    # ---------- Compute (headless) ----------
+    def compute(self) -> AnalysisResult:
         # 1) Normalize
         self.df_msu = self._normalize_columns(self.df_msu)
         self.df_ref = self._normalize_columns(self.df_ref)
@@ -110,12 +102,9 @@ class MSU_Analyzer:
         # 3) Merge
         df_merged = self._merge_with_ref()
         if df_merged.empty:
-            st.warning("No matching mapping found between MSU file and reference")
-            self.df_abnormal = pd.DataFrame()
-            self.df_abnormal_by_type = {}
-            return
+            return AnalysisResult("msu", df_unmatched=self.df_unmatched)
 
-        # 4) Pick columns
+        # 4) Pick columns (เรียงตาม order ของ reference)
         df_result = (
             df_merged[["Site Name", self.COL_ME, self.COL_MOBJ, self.COL_TH, self.COL_LASER, "order"]]
             .sort_values("order")
@@ -123,7 +112,42 @@ class MSU_Analyzer:
             .reset_index(drop=True)
         )
 
-        # 5) Cascading filter
+        # 5) Abnormal
+        ab_mask = self.rules.mask(df_result)
+        df_abn = df_result.loc[ab_mask, [
+            "Site Name", self.COL_ME, self.COL_MOBJ,
+            self.COL_TH, self.COL_LASER
+        ]].copy()
+
+        # 6) ข้อมูลกราฟรายบอร์ด
+        df_board = df_result.copy()
+        df_board["Board"] = df_board["Site Name"].astype(str) + " | " + df_board[self.COL_MOBJ].astype(str)
+        df_board["Status"] = classify(df_board.index, [("Abnormal", ab_mask)], "Normal")
+
+        return AnalysisResult(
+            "msu",
+            df_result=df_result,
+            masks={"abnormal": ab_mask},
+            df_abnormal=df_abn,
+            abnormal_by_type={"MSU": df_abn} if not df_abn.empty else {},
+            kpis={
+                "total_ports": len(df_result),
+                "active_ports": int((df_result[self.COL_LASER] > 0).sum()),
+                "abn_count": int(ab_mask.sum()),
+            },
+            frames={"board": df_board},
+            df_unmatched=self.df_unmatched,
+        )
+
+    # ---------- Render (Streamlit) ----------
+    def render(self, result: AnalysisResult) -> None:
+        render_unmatched(result.df_unmatched, "MSU")
+        if result.df_result.empty:
+            st.warning("No matching mapping found between MSU file and reference")
+            return
+        df_result = result.df_result
+
+        # 1) Cascading filter
         df_filtered, _sel = cascading_filter(
             df_result,
             cols=["Site Name", self.COL_ME, self.COL_MOBJ],
@@ -132,13 +156,12 @@ class MSU_Analyzer:
         )
         st.caption(f"MSU (showing {len(df_filtered)}/{len(df_result)} rows)")
 
-        # 6) Main table (ใช้ Styler + format 2 ตำแหน่ง)
-        styled_main = self._style_dataframe(df_filtered.copy())
+        # 2) Main table (ใช้ Styler + format 2 ตำแหน่ง)
         st.markdown("### MSU Performance")
-        st.write(styled_main)
+        self._render_dataframe(df_filtered.copy())
 
-        # 7) Summary banner
-        failed_rows = df_filtered[self.COL_LASER] > df_filtered[self.COL_TH]
+        # 3) Summary banner
+        failed_rows = self.rules.mask(df_filtered)
         st.markdown(
             "<div style='text-align:center; font-size:32px; font-weight:bold; color:{};'>MSU Performance {}</div>".format(
                 "red" if failed_rows.any() else "green",
@@ -147,14 +170,9 @@ class MSU_Analyzer:
             unsafe_allow_html=True
         )
 
-        # 8) Visualization ------------------
+        # 4) Visualization ------------------
         import plotly.express as px
-        df_board = df_result.copy()
-        df_board["Board"] = df_board["Site Name"].astype(str) + " | " + df_board[self.COL_MOBJ].astype(str)
-
-        df_board["Status"] = df_board.apply(
-            lambda r: "Normal" if r[self.COL_LASER] <= r[self.COL_TH] else "Abnormal", axis=1
-        )
+        df_board = result.frames["board"]
 
         view_option = st.radio(
             "View Option:",
@@ -165,16 +183,13 @@ class MSU_Analyzer:
         if view_option == "Active Only (Laser > 0)":
             df_board = df_board[df_board[self.COL_LASER] > 0]
 
-        total_ports    = len(df_result)
-        active_ports   = (df_result[self.COL_LASER] > 0).sum()
-        abnormal_ports = (df_result[self.COL_LASER] > df_result[self.COL_TH]).sum()
-
+        kpis = result.kpis
         st.markdown(
             f"""
             <div style="text-align:center; font-size:18px; font-weight:bold;">
-                Total Ports: {total_ports} |
-                Active: {active_ports} |
-                Abnormal: {abnormal_ports}
+                Total Ports: {kpis["total_ports"]} |
+                Active: {kpis["active_ports"]} |
+                Abnormal: {kpis["abn_count"]}
             </div>
             """,
             unsafe_allow_html=True
@@ -204,81 +219,22 @@ class MSU_Analyzer:
         )
         st.plotly_chart(fig_bar, use_container_width=True)
 
-        # 9) Abnormal Table ------------------
-        ab_mask = df_result[self.COL_LASER] > df_result[self.COL_TH]
-        df_abn = df_result.loc[ab_mask, [
-            "Site Name", self.COL_ME, self.COL_MOBJ,
-            self.COL_TH, self.COL_LASER
-        ]].copy()
-
-        if not df_abn.empty:
-            # ✅ round 2 decimal (ไม่มีหน่วย)
+        # 5) Abnormal Table ------------------
+        if not result.df_abnormal.empty:
+            # ✅ round 2 decimal (ไม่มีหน่วย) เฉพาะตอนแสดงผล
+            df_abn = result.df_abnormal.copy()
             df_abn[self.COL_TH]    = pd.to_numeric(df_abn[self.COL_TH], errors="coerce").round(2)
             df_abn[self.COL_LASER] = pd.to_numeric(df_abn[self.COL_LASER], errors="coerce").round(2)
 
             # ✅ Highlight Laser Bias Current(mA)
-            def highlight_red(val):
-                try:
-                    return "background-color: #ff4d4d; color: white" if float(val) > 0 else ""
-                except:
-                    return ""
-
-            styled_abn = (
-                df_abn.style
-                .applymap(highlight_red, subset=[self.COL_LASER])
-                .format({
+            st.markdown("#### MSU – Abnormal Rows")
+            render_table(
+                df_abn,
+                cells={self.COL_LASER: (df_abn[self.COL_LASER] > 0, CSS_BAD)},
+                fmt={
                     self.COL_LASER: "{:.2f}",
                     self.COL_TH: "{:.2f}",
-                })
+                },
             )
-
-            st.markdown("#### MSU – Abnormal Rows")
-            st.dataframe(styled_abn, use_container_width=True)
         else:
             st.info("✅ No abnormal rows (Normal)")
-
-        # 10) เก็บ abnormal ลง property (ใช้ใน summary/PDF)
-        self.df_abnormal = df_abn
-        self.df_abnormal_by_type = {"MSU": df_abn} if not df_abn.empty else {}
-
- 
-
-    # ---------- PREPARE ----------
-    def prepare(self) -> None:
-        """เตรียมข้อมูล abnormal โดยไม่ render UI"""
-        # 1) Normalize
-        self.df_msu = self._normalize_columns(self.df_msu)
-        self.df_ref = self._normalize_columns(self.df_ref)
-
-        # 2) Check required
-        self._check_required()
-        self._check_required_ref()
-
-        # 3) Merge
-        df_merged = self._merge_with_ref()
-        if df_merged.empty:
-            self.df_abnormal = pd.DataFrame()
-            self.df_abnormal_by_type = {}
-            st.session_state["msu_analyzer"] = self
-            st.session_state["msu_status"]   = "No data"
-            st.session_state["msu_abn_count"] = 0
-            return
-
-        # 4) Detect abnormal
-        val = pd.to_numeric(df_merged[self.COL_LASER], errors="coerce")
-        th  = pd.to_numeric(df_merged[self.COL_TH], errors="coerce")
-        ab_mask = val > th
-
-        df_abn = df_merged.loc[ab_mask, [
-            "Site Name", self.COL_ME, self.COL_MOBJ,
-            self.COL_TH, self.COL_LASER
-        ]].copy()
-
-        # 5) เก็บผล
-        self.df_abnormal = df_abn
-        self.df_abnormal_by_type = {"MSU": df_abn} if not df_abn.empty else {}
-
-        # ✅ เก็บเข้า session_state
-        st.session_state["msu_analyzer"] = self
-        st.session_state["msu_status"]   = "Abnormal" if not df_abn.empty else "Normal"
-        st.session_state["msu_abn_count"] = len(df_abn)
@@ -1,53 +1,47 @@
 # preset_analyzer.py
 from __future__ import annotations
 from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional, Tuple, Callable
+from typing import List, Dict, Any, Optional, Sequence, Tuple, Callable
 import re
 import io
 import pandas as pd
 import streamlit as st
 
+from utils.log_source import LogSource
+from utils.wason_log import CALL_HEADER_RE, get_log_index
+
 # =========================
 # 1) แกน Preset (Regex + Parser + Evaluator)
 # =========================
-# Match: [WASON][CALL 8] [30.10.90.6 30.10.10.6 85] COPPER
-CALL_HEADER_RE = re.compile(r"\[WASON\]\[CALL\s+(\d+)\]\s+\[([^\]]+)\]")
-
-# Any Conn line that contains WR
-CONN_HAS_WR_RE = re.compile(r"\[WASON\]\s*\[Conn\s+\d+\].*\bWR\b", re.IGNORECASE)
-
-# Specifically "WR NO_ALARM"
-CONN_WR_NOALARM_RE = re.compile(
-    r"\[WASON\]\s*\[Conn\s+\d+\][^\n]*\bWR\s+NO_ALARM\b", re.IGNORECASE
-)
-
-# A preroute line like: --2--WORK--(USED)--(SUCCESS)-- (robust to trailing text)
-PREROUT_USED_RE = re.compile(
-    r"\[WASON\]--\s*(\d+)\s*--\s*WORK\s*--\s*\(USED\)\s*--\s*\((\w+)\).*",
+# Match: [WASON][CALL 8] [30.10.90.6 30.10.10.6 85] COPPER → CALL_HEADER_RE (utils/wason_log.py)
+
+# ทุกบรรทัดถูกจัดชนิดด้วย pattern เดียว (alternation) แทนการ scan 3 รอบ:
+#   conn: [WASON][Conn N] ...        → ดู WR / WR NO_ALARM ในส่วนที่เหลือของบรรทัด
+#   used: [WASON]--N--WORK--(USED)--(RESULT)   (preroute ที่ถูกใช้)
+PRESET_LINE_RE = re.compile(
+    r"\[WASON\](?:\s*(?P<conn>\[Conn\s+\d+\])"
+    r"|--\s*(?P<index>\d+)\s*--\s*WORK\s*--\s*\(USED\)\s*--\s*\((?P<result>\w+)\))",
     re.IGNORECASE,
 )
+WR_RE = re.compile(r"\bWR\b", re.IGNORECASE)
+WR_NOALARM_RE = re.compile(r"\bWR\s+NO_ALARM\b", re.IGNORECASE)
 
 @dataclass
 class CallBlock:
     call_id: int
     ip: str
-    lines: List[str] = field(default_factory=list)
-
-def parse_calls(text: str) -> List[CallBlock]:
-    calls: List[CallBlock] = []
-    cur: Optional[CallBlock] = None
-    for raw in text.splitlines():
-        line = raw.rstrip("\n")
-        m = CALL_HEADER_RE.search(line)
-        if m:
-            if cur is not None:
-                calls.append(cur)
-            cur = CallBlock(call_id=int(m.group(1)), ip=m.group(2), lines=[])
-        if cur is not None:
-            cur.lines.append(line)
-    if cur is not None:
-        calls.append(cur)
-    return calls
+    lines: Sequence[str] = field(default_factory=list)  # LineRange (ไม่คัดลอกบรรทัด) หรือ list
+
+def parse_calls(text: str | LogSource) -> List[CallBlock]:
+    # block = ตั้งแต่หัว [WASON][CALL ...] จนถึงหัวถัดไป (ใช้ index ร่วมกับ Line/APO)
+    return [
+        CallBlock(call_id=call_id, ip=ip, lines=lines)
+        for call_id, ip, lines in get_log_index(text).iter_call_blocks()
+    ]
+
+def raw_text(lines: Optional[Sequence[str]]) -> str:
+    """ข้อความของ call (สร้างเฉพาะตอนแสดง/export)"""
+    return "\n".join(lines) if lines is not None else ""
 
 def evaluate_preset_status(cb: CallBlock) -> Dict[str, Any]:
     """
@@ -55,19 +49,37 @@ def evaluate_preset_status(cb: CallBlock) -> Dict[str, Any]:
     - ต้องมี WR (Conn ที่มี WR)
     - ต้องมี 'WR NO_ALARM'
     - ใน PreRout ต้องมี 'WORK (USED) (SUCCESS)' จำนวน 1 บรรทัดพอดี
+
+    อ่านแต่ละบรรทัดครั้งเดียว; เจอ WR NO_ALARM แล้วเลิกตรวจ Conn (เหลือนับ USED อย่างเดียว)
+    ไม่ join ข้อความทั้ง call (ช่วงบรรทัดอยู่ใน cb.lines)
+    ในบรรทัดเดียวกัน Conn / USED อยู่ลำดับไหนก็ได้: WR ดูหลัง Conn ตัวแรก, USED นับตัวแรก (1 บรรทัด = 1 USED row)
     """
-    has_wr = any(CONN_HAS_WR_RE.search(ln) for ln in cb.lines)
+    has_wr = wr_no_alarm = False
+    used_rows = []
+    search, finditer = PRESET_LINE_RE.search, PRESET_LINE_RE.finditer
+    for first in filter(None, map(search, cb.lines)):  # วน (ระดับ C) เฉพาะบรรทัดที่ match
+        ln = first.string
+        conn_seen = False
+        used = None
+        for m in finditer(ln, first.start()):
+            if m.group("conn"):
+                if not conn_seen:
+                    conn_seen = True
+                    if not wr_no_alarm:
+                        tail = ln[m.end():]
+                        if WR_RE.search(tail):
+                            has_wr = True
+                            wr_no_alarm = bool(WR_NOALARM_RE.search(tail))
+            elif used is None:
+                used = m
+            if conn_seen and used is not None:
+                break
+        if used is not None:
+            used_rows.append({"index": int(used.group("index")), "result": used.group("result").upper(), "raw": ln})
+
     if not has_wr:
         return {"has_wr": False}
 
-    wr_no_alarm = any(CONN_WR_NOALARM_RE.search(ln) for ln in cb.lines)
-
-    used_rows = []
-    for ln in cb.lines:
-        m = PREROUT_USED_RE.search(ln)
-        if m:
-            used_rows.append({"index": int(m.group(1)), "result": m.group(2).upper(), "raw": ln})
-
     verdict = "FAIL"
     Restore = ""
     pr_index: Optional[int] = None
@@ -90,7 +102,6 @@ def evaluate_preset_status(cb: CallBlock) -> Dict[str, Any]:
         "Restore": Restore,
         "pr_index": pr_index,
         "used_rows": used_rows,
-        "raw": "\n".join(cb.lines),
     }
 
 # =========================
@@ -99,8 +110,8 @@ def evaluate_preset_status(cb: CallBlock) -> Dict[str, Any]:
 class PresetStatusAnalyzer:
     def __init__(
         self,
-        raw_text: str,
-        parse_fn: Callable[[str], List[CallBlock]] = parse_calls,
+        raw_text: str | LogSource,
+        parse_fn: Callable[[str | LogSource], List[CallBlock]] = parse_calls,
         eval_fn: Callable[[CallBlock], Dict[str, Any]] = evaluate_preset_status,
     ):
         self.raw_text = raw_text
@@ -127,13 +138,13 @@ class PresetStatusAnalyzer:
                     "Preroute": res.get("pr_index"),
                     "Verdict": res.get("verdict"),
                     "Status": res.get("Restore"),
-                    "Raw": res.get("raw"),
+                    "Lines": cb.lines,  # ช่วงบรรทัดของ call (join เป็นข้อความเฉพาะตอนแสดง)
                 })
         return self.rows
 
     def to_dataframe(self) -> Tuple[pd.DataFrame, Dict[str, int]]:
         if not self.rows:
-            self.df = pd.DataFrame(columns=["Call", "IP", "Preroute", "Verdict", "Restore", "Raw"])
+            self.df = pd.DataFrame(columns=["Call", "IP", "Preroute", "Verdict", "Restore", "Lines"])
             self.summary = {"total": 0, "passes": 0, "fails": 0}
             return self.df, self.summary
 
@@ -154,7 +165,10 @@ class PresetStatusAnalyzer:
     def export_csv_bytes(df: pd.DataFrame, drop_raw: bool = True) -> bytes:
         if df is None:
             return b""
-        out_df = df.drop(columns=["Raw"]) if drop_raw and "Raw" in df.columns else df
+        if drop_raw:
+            out_df = df.drop(columns=["Lines"], errors="ignore")
+        else:
+            out_df = df.assign(Lines=[raw_text(v) for v in df["Lines"]]) if "Lines" in df.columns else df
         buf = io.StringIO()
         out_df.to_csv(buf, index=False)
         return buf.getvalue().encode("utf-8")
@@ -209,7 +223,7 @@ def render_preset_ui(df: pd.DataFrame, summary: Dict[str, int], only_abnormal_ke
 
     # Table
     view = PresetStatusAnalyzer.view_only(df, st.session_state[only_abnormal_key])
-    st.dataframe(view.drop(columns=["Raw", "Verdict"], errors="ignore"), use_container_width=True, hide_index=True)
+    st.dataframe(view.drop(columns=["Lines", "Verdict"], errors="ignore"), use_container_width=True, hide_index=True)
 
     # Per-call cards
     for _, r in view.iterrows():
@@ -238,4 +252,4 @@ def render_preset_ui(df: pd.DataFrame, summary: Dict[str, int], only_abnormal_ke
                     st.markdown(pr_html, unsafe_allow_html=True)
 
             with st.expander("Show raw log"):
-                st.code(str(r.get("Raw")), language="text")
+                st.code(raw_text(r.get("Lines")), language="text")
@@ -1,13 +1,18 @@
 import os
 import uuid
+import time
+import hashlib
 from datetime import datetime, date
 import pytz
 import streamlit as st
 from streamlit_calendar import calendar
 import io, zipfile
+import threading
+from functools import partial
 import pandas as pd
 from sqlalchemy import text # ใช้สำหรับ DML ใน PostgreSQL
 import requests # 🆕 Import requests แทน supabase-py
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # ====== IMPORT ANALYZERS ======
 from CPU_Analyzer import CPU_Analyzer
@@ -19,11 +24,14 @@ from Fiberflapping_Analyzer import FiberflappingAnalyzer
 from EOL_Core_Analyzer import EOLAnalyzer, CoreAnalyzer
 
 from table1 import SummaryTableReport
+from utils.artifact_cache import ArtifactCache
+from utils.zip_ingest import ingest_zips, make_parse_pool
+from utils.ref_registry import get_ref, get_ref_index
+from utils.analysis import fingerprint, run_cached
 
 
 # ====== CONFIG ======
 st.set_page_config(layout="wide")
-pd.set_option("styler.render.max_elements", 1_200_000)
 
 # UPLOAD_DIR และ DB_FILE เดิมถูกยกเลิกการใช้งานแล้ว
 UPLOAD_DIR = "uploads"
@@ -124,22 +132,52 @@ def list_files_by_date(upload_date: str):
     return list(df[['id', 'orig_filename', 'stored_path']].itertuples(index=False, name=None))
 
 
-@st.cache_data(ttl=600)
-def get_file_bytes_from_storage(storage_path: str):
-    """ดึงไฟล์ bytes จาก Supabase Storage ด้วย Requests"""
+# ไฟล์ที่ดาวน์โหลดจะ stream ลงดิสก์ (ไม่ถือทั้งไฟล์ไว้ใน RAM / st.cache_data)
+# และใช้ซ้ำได้ภายใน DOWNLOAD_TTL วินาที (เท่ากับ ttl ของ cache เดิม)
+DOWNLOAD_DIR = os.path.join(".cache", "downloads")
+DOWNLOAD_TTL = 600
+
+
+def _purge_old_downloads(now: float) -> None:
+    for e in os.scandir(DOWNLOAD_DIR):
+        try:
+            if e.is_file() and now - e.stat().st_mtime > DOWNLOAD_TTL:
+                os.remove(e.path)
+        except OSError:
+            pass
+
+
+def download_file_from_storage(storage_path: str):
+    """ดึงไฟล์จาก Supabase Storage ด้วย Requests แบบ streaming → คืน path ไฟล์บนดิสก์"""
     if STORAGE_API_URL is None:
         return None
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    local_path = os.path.join(DOWNLOAD_DIR, hashlib.sha1(storage_path.encode("utf-8")).hexdigest() + ".zip")
+    now = time.time()
+    if os.path.exists(local_path) and now - os.path.getmtime(local_path) <= DOWNLOAD_TTL:
+        return local_path
+    _purge_old_downloads(now)
+
+    tmp_path = f"{local_path}.{uuid.uuid4().hex}.part"
     try:
-        # 🆕 GET request เพื่อดาวน์โหลดไฟล์
-        response = requests.get(
+        # 🆕 GET request เพื่อดาวน์โหลดไฟล์ (stream ทีละ chunk)
+        with requests.get(
             f"{STORAGE_API_URL}/{storage_path}", 
-            headers={"Authorization": f"Bearer {SUPABASE_KEY}"} # ใช้ Headers สำหรับ Auth เท่านั้น
-        )
-        response.raise_for_status()
-        return io.BytesIO(response.content)
-    except requests.exceptions.RequestException as e:
+            headers={"Authorization": f"Bearer {SUPABASE_KEY}"}, # ใช้ Headers สำหรับ Auth เท่านั้น
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        os.replace(tmp_path, local_path)
+        return local_path
+    except (requests.exceptions.RequestException, OSError) as e:
         st.error(f"Error downloading file from Storage: {e}")
         return None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def delete_file(file_id: int):
@@ -194,64 +232,31 @@ def clear_all_uploaded_data():
         del st.session_state[key]
     st.session_state["zip_loaded"] = False
     
-# ====== ZIP PARSER (คงเดิม) ======
-KW = {
-    "cpu": ("cpu",), "fan": ("fan",), "msu": ("msu",),
-    "client": ("client", "client board"), "line": ("line","line board"),
-    "wason": ("wason","log"), "osc": ("osc","osc optical"),
-    "fm": ("fm","alarm","fault management"),
-    "atten": ("optical attenuation report", "optical_attenuation_report", "optical attenuation"),
-    "preset": ("mobaxterm", "moba xterm", "moba"),
-}
-
-LOADERS = {
-    ".xlsx": pd.read_excel,
-    ".xls": pd.read_excel,
-    ".txt": lambda f: f.read().decode("utf-8", errors="ignore"),
-}
-
-def _ext(name: str) -> str:
-    name = name.lower()
-    return next((e for e in LOADERS if name.endswith(e)), "")
-
-def _kind(name):
-    n = name.lower()
-    hits = [k for k, kws in KW.items() if any(s in n for s in kws)]
-    if "wason" in hits: return "wason"
-    if "preset" in hits: return "preset"
-    if "line" in hits and (n.endswith(".xlsx") or n.endswith(".xls") or n.endswith(".xlsm")): return "line"
-    for k in ("fan","cpu","msu","client","osc","fm","atten"):
-        if k in hits: return k
-    return hits[0] if hits else None
-
-
-def find_in_zip(zip_file):
-    found = {k: None for k in KW}
-    def walk(zf):
-        for name in zf.namelist():
-            if all(found.values()): return
-            if name.endswith("/"): continue
-            lname = name.lower()
-            if lname.endswith(".zip"):
-                try:
-                    walk(zipfile.ZipFile(io.BytesIO(zf.read(name))))
-                except: pass
-                continue
-            ext = _ext(lname)
-            kind = _kind(lname)
-            if not ext or not kind or found[kind]: continue
-            try:
-                with zf.open(name) as f:
-                    df = LOADERS[ext](f)
-                found[kind] = (df, name) 
-            except: continue
-    try:
-        walk(zipfile.ZipFile(zip_file))
-    except Exception as e:
-        st.error(f"Error reading ZIP file: {e}")
-        return {}
-        
-    return found
+# ====== ZIP PARSER ======
+# KW / LOADERS / find_in_zip ย้ายไปอยู่ utils/zip_ingest.py (ให้ worker process import ได้)
+@st.cache_resource
+def get_artifact_cache() -> ArtifactCache:
+    """cache ผล parse ไฟล์ในZIP (Parquet บนดิสก์) ใช้ร่วมกันทั้ง process"""
+    return ArtifactCache()
+
+
+@st.cache_resource
+def _parse_pool():
+    return make_parse_pool()
+
+
+def get_parse_pool():
+    """process pool สำหรับ parse XLSX (สร้างครั้งเดียว ใช้ร่วมทุก session; พังแล้วสร้างใหม่)"""
+    pool = _parse_pool()
+    if getattr(pool, "_broken", False):
+        _parse_pool.clear()
+        pool = _parse_pool()
+    return pool
+
+
+def _attach_script_ctx(ctx):
+    # ให้ thread ดาวน์โหลดเรียก st.cache_data / st.error ได้เหมือนอยู่ใน script thread
+    add_script_run_ctx(threading.current_thread(), ctx)
 
 
 def safe_copy(obj):
@@ -339,28 +344,44 @@ if menu == "หน้าแรก":
                 st.warning("Please select at least one file to analyze")
             else:
                 clear_all_uploaded_data()
-                total = 0
-                
-                with st.spinner("Downloading files and running analysis..."):
-                    for fid, fname, fpath in selected_files_meta:
-                        # ⚠️ ดาวน์โหลดไฟล์จาก Storage (fpath = storage_path)
-                        zip_bytes = get_file_bytes_from_storage(fpath)
-                        if zip_bytes is None:
-                            continue # ข้ามถ้าดาวน์โหลดไม่ได้
-
-                        res = find_in_zip(zip_bytes) # ⬅️ ทำ Analysis จาก Bytes ที่โหลดมา
-
-                        for kind, pack in res.items():
-                            if not pack: continue
-                            df, zname = pack
-                            if kind == "wason":
-                                st.session_state["wason_log"] = df 
-                                st.session_state["wason_file"] = zname
-                            else:
-                                st.session_state[f"{kind}_data"] = df 
-                                st.session_state[f"{kind}_file"] = zname
-                        
-                        total += 1
+
+                # ⬇️ ดาวน์โหลด (stream ลงดิสก์) ด้วย thread pool ซ้อนกับ parse ด้วย process pool
+                names = [fname for _fid, fname, _fpath in selected_files_meta]
+                progress = st.progress(0.0, text="Downloading files and running analysis...")
+                status_box = st.empty()
+                file_status = {i: "queued" for i in range(len(names))}
+                done = set()
+
+                def _on_progress(i, status):
+                    file_status[i] = status
+                    if status != "downloaded":
+                        done.add(i)
+                    progress.progress(len(done) / len(names), text=f"{len(done)}/{len(names)} file(s) done")
+                    status_box.markdown("\n".join(f"- `{names[j]}` — {file_status[j]}" for j in range(len(names))))
+
+                res, errors = ingest_zips(
+                    [fpath for _fid, _fname, fpath in selected_files_meta],
+                    fetch_fn=download_file_from_storage,
+                    parse_pool=get_parse_pool(),
+                    cache=get_artifact_cache(),
+                    thread_initializer=partial(_attach_script_ctx, get_script_run_ctx()),
+                    on_progress=_on_progress,
+                )
+
+                for fname, err in zip(names, errors):
+                    if err and err != "download failed":
+                        st.error(f"Error reading ZIP file '{fname}': {err}")
+
+                # ผลรวมต่อ kind (ไฟล์ที่เลือกทีหลังทับไฟล์ก่อนหน้า)
+                for kind, (df, zname) in res.items():
+                    if kind == "wason":
+                        st.session_state["wason_log"] = df 
+                        st.session_state["wason_file"] = zname
+                    else:
+                        st.session_state[f"{kind}_data"] = df 
+                        st.session_state[f"{kind}_file"] = zname
+
+                total = sum(1 for err in errors if err is None)
 
                 st.session_state["zip_loaded"] = True
                 st.success(f"✅ Analysis finished. Processed {total} file(s).")
@@ -371,14 +392,17 @@ if menu == "หน้าแรก":
 elif menu == "CPU":
     if st.session_state.get("cpu_data") is not None:
         try:
-            df_ref = pd.read_excel("data/CPU.xlsx")
-            analyzer = CPU_Analyzer(
-                df_cpu=safe_copy(st.session_state.get("cpu_data")),
-                df_ref=df_ref.copy(),
-                ns="cpu"
+            # compute ใหม่เฉพาะเมื่อข้อมูล / reference เปลี่ยน (rerun จาก filter → render อย่างเดียว)
+            run_cached(
+                "cpu",
+                fingerprint(inputs=(st.session_state.get("cpu_data"),), refs=("data/CPU.xlsx",), params=("cpu",)),
+                lambda: CPU_Analyzer(
+                    df_cpu=safe_copy(st.session_state.get("cpu_data")),
+                    df_ref=get_ref("data/CPU.xlsx"),
+                    ref_index=get_ref_index("data/CPU.xlsx"),
+                    ns="cpu"
+                ),
             )
-            analyzer.process()
-            st.session_state["cpu_analyzer"] = analyzer 
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
     else:
@@ -388,14 +412,16 @@ elif menu == "CPU":
 elif menu == "FAN":
     if st.session_state.get("fan_data") is not None:
         try:
-            df_ref = pd.read_excel("data/FAN.xlsx")
-            analyzer = FAN_Analyzer(
-                df_fan=safe_copy(st.session_state.get("fan_data")),
-                df_ref=df_ref.copy(),
-                ns="fan"
+            run_cached(
+                "fan",
+                fingerprint(inputs=(st.session_state.get("fan_data"),), refs=("data/FAN.xlsx",), params=("fan",)),
+                lambda: FAN_Analyzer(
+                    df_fan=safe_copy(st.session_state.get("fan_data")),
+                    df_ref=get_ref("data/FAN.xlsx"),
+                    ref_index=get_ref_index("data/FAN.xlsx"),
+                    ns="fan"
+                ),
             )
-            analyzer.process()
-            st.session_state["fan_analyzer"] = analyzer
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
     else:
@@ -405,14 +431,16 @@ elif menu == "FAN":
 elif menu == "MSU":
     if st.session_state.get("msu_data") is not None:
         try:
-            df_ref = pd.read_excel("data/MSU.xlsx")
-            analyzer = MSU_Analyzer(
-                df_msu=safe_copy(st.session_state.get("msu_data")),
-                df_ref=df_ref.copy(),
-                ns="msu"
+            run_cached(
+                "msu",
+                fingerprint(inputs=(st.session_state.get("msu_data"),), refs=("data/MSU.xlsx",), params=("msu",)),
+                lambda: MSU_Analyzer(
+                    df_msu=safe_copy(st.session_state.get("msu_data")),
+                    df_ref=get_ref("data/MSU.xlsx"),
+                    ref_index=get_ref_index("data/MSU.xlsx"),
+                    ns="msu"
+                ),
             )
-            analyzer.process()
-            st.session_state["msu_analyzer"] = analyzer
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
     else:
@@ -429,14 +457,18 @@ elif menu == "Line board":
 
     if df_line is not None:
         try:
-            df_ref = pd.read_excel("data/Line.xlsx")
-            analyzer = Line_Analyzer(
-                df_line=df_line.copy(), 
-                df_ref=df_ref.copy(),
-                pmap=pmap,
-                ns="line",
+            # pmap มาจาก WASON log → ใช้ log เป็น input แทน dict (สร้างใหม่ทุก rerun)
+            run_cached(
+                "line",
+                fingerprint(inputs=(df_line, log_txt), refs=("data/Line.xlsx",), params=("line",)),
+                lambda: Line_Analyzer(
+                    df_line=df_line.copy(), 
+                    df_ref=get_ref("data/Line.xlsx"),
+                    ref_index=get_ref_index("data/Line.xlsx"),
+                    pmap=pmap,
+                    ns="line",
+                ),
             )
-            analyzer.process()
             st.caption(
                 f"Using LINE file: {st.session_state.get('line_file')}"
                 f"{'(with WASON log)' if log_txt else '(no WASON log)'}"
@@ -451,13 +483,14 @@ elif menu == "Client board":
     st.markdown("### Client Board")
     if st.session_state.get("client_data") is not None:
         try:
-            df_ref = pd.read_excel("data/Client.xlsx")
-            analyzer = Client_Analyzer(
-                df_client=st.session_state.client_data.copy(),
-                ref_path="data/Client.xlsx"
+            run_cached(
+                "client",
+                fingerprint(inputs=(st.session_state.client_data,), refs=("data/Client.xlsx",)),
+                lambda: Client_Analyzer(
+                    df_client=st.session_state.client_data.copy(),
+                    ref_path="data/Client.xlsx"
+                ),
             )
-            analyzer.process()
-            st.session_state["client_analyzer"] = analyzer
             st.caption(f"Using CLIENT file: {st.session_state.get('client_file')}")
         except Exception as e:
             st.error(f"An error occurred during processing: {e}")
@@ -472,12 +505,15 @@ elif menu == "Fiber Flapping":
 
     if (df_osc is not None) and (df_fm is not None):
         try:
-            analyzer = FiberflappingAnalyzer(
-                df_optical=df_osc.copy(),
-                df_fm=df_fm.copy(),
-                threshold=2.0, 
+            run_cached(
+                "fiber",
+                fingerprint(inputs=(df_osc, df_fm), params=(2.0,)),
+                lambda: FiberflappingAnalyzer(
+                    df_optical=df_osc.copy(),
+                    df_fm=df_fm.copy(),
+                    threshold=2.0, 
+                ),
             )
-            analyzer.process()
             st.caption(
                 f"Using OSC: {st.session_state.get('osc_file')} | "
                 f"FM: {st.session_state.get('fm_file')}"
@@ -493,13 +529,15 @@ elif menu == "Loss between EOL":
     df_raw = st.session_state.get("atten_data") 
     if df_raw is not None:
         try:
-            analyzer = EOLAnalyzer(
-                df_ref=None,
-                df_raw_data=df_raw.copy(),
-                ref_path="data/EOL.xlsx",
+            run_cached(
+                "eol",
+                fingerprint(inputs=(df_raw,), refs=("data/EOL.xlsx",)),
+                lambda: EOLAnalyzer(
+                    df_ref=None,
+                    df_raw_data=df_raw.copy(),
+                    ref_path="data/EOL.xlsx",
+                ),
             )
-            analyzer.process() 
-            st.session_state["eol_analyzer"] = analyzer
             st.caption(f"Using RAW file: {st.session_state.get('atten_file')}")
         except Exception as e:
             st.error(f"An error occurred during EOL analysis: {e}")
@@ -512,13 +550,15 @@ elif menu == "Loss between Core":
     df_raw = st.session_state.get("atten_data")
     if df_raw is not None:
         try:
-            analyzer = CoreAnalyzer(
-                df_ref=None,
-                df_raw_data=df_raw.copy(),
-                ref_path="data/EOL.xlsx",
+            run_cached(
+                "core",
+                fingerprint(inputs=(df_raw,), refs=("data/EOL.xlsx",)),
+                lambda: CoreAnalyzer(
+                    df_ref=None,
+                    df_raw_data=df_raw.copy(),
+                    ref_path="data/EOL.xlsx",
+                ),
             )
-            analyzer.process() 
-            st.session_state["core_analyzer"] = analyzer
             st.caption(f"Using RAW file: {st.session_state.get('atten_file')}")
         except Exception as e:
             st.error(f"An error occurred during Core analysis: {e}")
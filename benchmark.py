@@ -0,0 +1,422 @@
+# benchmark.py
+# วัดความเร็วส่วนที่หนักของ pipeline ด้วยข้อมูลตัวอย่างใน uploads/
+#   python benchmark.py            → รันทุกชุด
+#   python benchmark.py xlsx       → เฉพาะชุดที่ระบุ
+import io
+import sys
+import glob
+import time
+import random
+import re
+import zipfile
+import warnings
+
+from utils.xlsx_reader import available_engines, read_xlsx, read_header
+from utils.zip_ingest import _ext
+
+warnings.simplefilter("ignore")  # openpyxl: "Workbook contains no default style"
+
+UPLOADS_GLOB = "uploads/**/*.zip"
+
+
+def _timeit(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _xlsx_members():
+    """(ชื่อ, bytes) ของไฟล์ Excel ทุกไฟล์ใน ZIP ตัวอย่าง (ไม่นับไฟล์ซ้ำชื่อ)"""
+    seen = set()
+    for path in sorted(glob.glob(UPLOADS_GLOB, recursive=True)):
+        try:
+            with zipfile.ZipFile(path) as zf:
+                for name in zf.namelist():
+                    if _ext(name.lower()) in (".xlsx", ".xls") and name not in seen:
+                        seen.add(name)
+                        yield name, zf.read(name)
+        except zipfile.BadZipFile:
+            continue
+
+
+# ---------- XLSX readers ----------
+def bench_xlsx():
+    engines = available_engines()
+    members = list(_xlsx_members())
+    print(f"\n== XLSX readers ({len(members)} files, engines: {', '.join(engines)}) ==")
+    print(f"{'file':<45}{'rows':>7}" + "".join(f"{e + ' full':>16}{e + ' head':>16}" for e in engines))
+
+    totals = {e: [0.0, 0.0] for e in engines}
+    for name, data in members:
+        rows = len(read_xlsx(io.BytesIO(data), engine=engines[-1]))
+        line = f"{name.split('/')[-1][:44]:<45}{rows:>7}"
+        for e in engines:
+            full = _timeit(lambda: read_xlsx(io.BytesIO(data), engine=e))
+            head = _timeit(lambda: read_header(io.BytesIO(data), engine=e))
+            totals[e][0] += full
+            totals[e][1] += head
+            line += f"{full * 1000:>13.1f} ms{head * 1000:>13.1f} ms"
+        print(line)
+    print(f"{'TOTAL':<52}" + "".join(f"{t[0] * 1000:>13.1f} ms{t[1] * 1000:>13.1f} ms" for t in totals.values()))
+
+
+# ---------- APO remnant ----------
+APO_SITES = ("30.10.90.6", "30.10.10.6", "30.10.30.6", "30.10.50.6", "30.10.70.6", "30.10.110.6")
+
+
+def synthetic_apo_log(n_conns: int, mismatch: float = 0.05, seed: int = 0) -> str:
+    """
+    log จำลองรูปแบบเดียวกับ MobaXterm: SetupApo (WASON Conn) + show all och-inst (APOPLUS) ต่อไซต์
+    n_conns = จำนวน Conn รวมทุกไซต์; mismatch = สัดส่วน Conn ที่ conn no ใน APOP ไม่ตรง (→ orphan)
+    """
+    rnd = random.Random(seed)
+    per_site = max(1, n_conns // len(APO_SITES))
+    out = []
+    for ip in APO_SITES:
+        peer = APO_SITES[(APO_SITES.index(ip) + 1) % len(APO_SITES)]
+        conns = [(call_id, rnd.randint(1, 2000)) for call_id in range(1, per_site + 1)]
+        out.append('ZXPOTN(diag-shell-MPU-33/65/0)#    exec diag_c("cc-cmd setcallcv SetupApo")')
+        for call_id, conn_no in conns:
+            out.append(f"[WASON]    Conn [{ip} {peer} {call_id} {conn_no}] APO state 1(0-Disable, 1-Enable)")
+        out.append("[WASON]ushell command finished")
+
+        top = f"20.10.{ip.split('.')[2]}.254"
+        out.append("[APOPLUS] === show all och-inst ===")
+        out.append(f"[APOPLUS]TopNeIp : {top}, WasonSiteId : 0x1e0a5a06, InstNum : {len(conns)}")
+        for k, (call_id, conn_no) in enumerate(conns):
+            if rnd.random() < mismatch:
+                conn_no += 1
+            out.append(
+                f"[APOPLUS]{k}      0x1e0a5a06      0x1e0a0a06      0x{call_id:08x}      0x{conn_no:08x}"
+                "      0x00000001      0x00000001      HEAD_DETECT_WAITING"
+            )
+        out.append("[APOPLUS]ushell command finished")
+    return "\n".join(out)
+
+
+_APO_CONN_RE = re.compile(r"Conn\s*\[\s*([\d\.]+)\s+([\d\.]+)\s+(\d+)\s+(\d+)\s*\]")
+
+
+def _apo_analyze_quadratic(apo):
+    """
+    ตัวเทียบ: analyze() แบบเดิม (parse Conn ซ้ำจาก wason_lines, score scheme แยกรอบ,
+    orphan APOP วนหา WASON ทุก call) ใช้ตรวจว่าผลตรงกับแบบ dict ต่อไซต์ — คืน rendered
+    """
+    valid_states = {"HEAD_DETECT_WAITING", "HEAD_ERROR_DETECTING"}
+    rendered = []
+    for wip, bucket in apo.per_site.items():
+        site_name = bucket.name
+        wason_snippet = "\n".join(bucket.wason_lines)
+        apop_snippet = "\n".join(bucket.apop_lines)
+
+        apop_by_traffic = {}
+        for t, c, state, ln_ap in bucket.apop_rows:
+            if state in valid_states:
+                apop_by_traffic.setdefault(t, {})[c] = ln_ap
+
+        wason_calls = []
+        for ln_w in bucket.wason_lines:
+            if not re.search(r"^\[WASON\]\s*Conn\s*\[", ln_w):
+                continue
+            m = _APO_CONN_RE.search(ln_w)
+            if m and m.group(1) == wip:
+                wason_calls.append((int(m.group(3)), f"0x{int(m.group(4)):08x}", ln_w))
+
+        if not wason_calls:
+            rendered.append((wip, (site_name, wason_snippet, apop_snippet, set(), set()), False, site_name))
+            continue
+
+        def score_scheme(scheme):
+            return sum(apo._traffic_hex_from(call_id, scheme) in apop_by_traffic for call_id, _c, _l in wason_calls)
+
+        score_shifted = score_scheme("shifted")
+        score_direct = score_scheme("direct")
+        if score_shifted == score_direct:
+            scheme = "shifted" if any(t.endswith("000000") for t in apop_by_traffic) else "direct"
+        else:
+            scheme = "shifted" if score_shifted > score_direct else "direct"
+
+        to_red_apop, to_red_wason, seen_apop_keys = set(), set(), set()
+        for call_id, c_hex, ln_wason in wason_calls:
+            t_hex = apo._traffic_hex_from(call_id, scheme)
+            apop_conns = apop_by_traffic.get(t_hex, {})
+            if c_hex in apop_conns:
+                seen_apop_keys.add((t_hex, c_hex))
+            else:
+                to_red_wason.add(ln_wason)
+                to_red_apop.update(apop_conns.values())
+
+        for t_hex, conns in apop_by_traffic.items():
+            for c_hex, ap_ln in conns.items():
+                if (t_hex, c_hex) not in seen_apop_keys:
+                    to_red_apop.add(ap_ln)
+                    for call_id, _c, ln_w in wason_calls:
+                        if apo._traffic_hex_from(call_id, scheme) == t_hex:
+                            to_red_wason.add(ln_w)
+
+        has_mismatch = bool(to_red_apop or to_red_wason)
+        rendered.append((wip, (site_name, wason_snippet, apop_snippet, to_red_wason, to_red_apop), has_mismatch, site_name))
+    return rendered
+
+
+def bench_apo(sizes=(1_000, 10_000, 100_000), mismatch: float = 0.3, compare_max: int = 10_000):
+    from APO_Analyzer import ApoRemnantAnalyzer
+
+    print(f"\n== APO remnant (synthetic SetupApo / och-inst, {mismatch:.0%} mismatch) ==")
+    print(f"{'conns':>9}{'parse':>14}{'loop':>14}{'dict':>14}{'same':>7}{'mismatch sites':>16}")
+    for n in sizes:
+        text = synthetic_apo_log(n, mismatch=mismatch)
+        apo = ApoRemnantAnalyzer(text)
+        parse = _timeit(lambda: (apo.per_site.clear(), apo.parse()), repeat=1)
+        analyze = _timeit(apo.analyze, repeat=1)
+        loop, same = "-", "-"
+        if n <= compare_max:  # วิธีเดิมเป็น O(orphan × call) ต่อไซต์: วัดรอบเดียวเฉพาะขนาดที่รอได้
+            t0 = time.perf_counter()
+            expected = _apo_analyze_quadratic(apo)
+            loop = f"{(time.perf_counter() - t0) * 1000:.1f} ms"
+            assert expected == apo.rendered, f"APO analyze result differs from the loop version at {n} conns"
+            same = "yes"
+        bad = sum(1 for r in apo.rendered if r[2])
+        print(f"{n:>9,}{parse * 1000:>11.1f} ms{loop:>14}{analyze * 1000:>11.1f} ms{same:>7}{bad:>16}")
+
+
+# ---------- Preset status ----------
+PRESET_FRAGMENTS = (
+    "[WASON][Conn 1] WR NO_ALARM", "[wason] [conn 22] x wr no_alarm", "[WASON][Conn 3] WR ALARM", "[WASON][Conn 3] WRX",
+    "[WASON]--2--WORK--(USED)--(SUCCESS)--", "[WASON]-- 4 -- work -- (used) -- (failed)", "[WASON]--5--WORK--(IDLE)--(SUCCESS)",
+    "junk [WASON][Conn 9] foo WR bar [WASON]--7--WORK--(USED)--(SUCCESS)",
+    "[WASON]--2--WORK--(USED)--(SUCCESS)-- [WASON][Conn 3] WR NO_ALARM",  # USED ก่อน Conn ในบรรทัดเดียวกัน
+    "[WASON]--3--WORK--(USED)--(FAILED) [WASON][Conn 4] WR ALARM [WASON][Conn 5] WR NO_ALARM",
+    "[WASON]--1--WORK--(USED)--(SUCCESS) [WASON]--2--WORK--(USED)--(X)",
+    "[WASON][Conn 1]WR", "plain", "[PreRout]:", "[WASON][Conn 1] prefixWR NO_ALARM", "[WASON][Conn 1] WR  NO_ALARM",
+)
+
+
+def _evaluate_preset_regex(lines):
+    """ตัวเทียบ: evaluator แบบเดิม (regex แยก 3 ตัว scan ทุกบรรทัด 3 รอบ) — คืนเฉพาะส่วนที่เทียบกับแบบใหม่"""
+    conn_wr = re.compile(r"\[WASON\]\s*\[Conn\s+\d+\].*\bWR\b", re.IGNORECASE)
+    conn_noalarm = re.compile(r"\[WASON\]\s*\[Conn\s+\d+\][^\n]*\bWR\s+NO_ALARM\b", re.IGNORECASE)
+    used_re = re.compile(r"\[WASON\]--\s*(\d+)\s*--\s*WORK\s*--\s*\(USED\)\s*--\s*\((\w+)\).*", re.IGNORECASE)
+
+    if not any(conn_wr.search(ln) for ln in lines):
+        return {"has_wr": False}
+    wr_no_alarm = any(conn_noalarm.search(ln) for ln in lines)
+    used_rows = []
+    for ln in lines:
+        m = used_re.search(ln)
+        if m:
+            used_rows.append({"index": int(m.group(1)), "result": m.group(2).upper(), "raw": ln})
+
+    verdict, pr_index = "FAIL", None
+    if not wr_no_alarm:
+        restore = "WR found but not WR NO_ALARM"
+    elif len(used_rows) != 1:
+        restore = f"Found {len(used_rows)} USED rows (expected 1)"
+    elif used_rows[0]["result"] != "SUCCESS":
+        restore = "USED row is not SUCCESS"
+    else:
+        verdict, pr_index, restore = "PASS", used_rows[0]["index"], "Normal"
+    return {"has_wr": True, "wr_no_alarm": wr_no_alarm, "verdict": verdict, "Restore": restore,
+            "pr_index": pr_index, "used_rows": used_rows}
+
+
+def bench_preset(n_blocks: int = 20_000, seed: int = 3):
+    from Preset_Analyzer import CallBlock, evaluate_preset_status
+
+    print("\n== Preset status evaluator (random call blocks) ==")
+    rnd = random.Random(seed)
+    blocks = [[rnd.choice(PRESET_FRAGMENTS) for _ in range(rnd.randint(0, 8))] for _ in range(n_blocks)]
+    for lines in blocks:
+        expected = _evaluate_preset_regex(lines)
+        got = evaluate_preset_status(CallBlock(1, "ip", lines))
+        assert got == expected, (lines, expected, got)
+    loop = _timeit(lambda: [_evaluate_preset_regex(lines) for lines in blocks])
+    single = _timeit(lambda: [evaluate_preset_status(CallBlock(1, "ip", lines)) for lines in blocks])
+    print(f"{n_blocks:,} blocks  3-regex {loop * 1000:.1f} ms  single-pass {single * 1000:.1f} ms  same yes")
+
+
+# ---------- Line collapse-by-line ----------
+def synthetic_line_frame(n_calls: int, rows_per_call: int = 4, seed: int = 0):
+    """แถว Line board จำลอง: หลายแถวต่อเส้น (Site+ME+Call ID), ค่าว่าง/ข้อความปน, Route บางเส้นเป็น Preset"""
+    import numpy as np
+    import pandas as pd
+    from Line_Analyzer import Line_Analyzer
+
+    rng = np.random.default_rng(seed)
+    n = n_calls * rows_per_call
+    call = rng.integers(0, n_calls, n)
+
+    def col(lo, hi):
+        v = rng.uniform(lo, hi, n).round(3).astype(object)
+        v[rng.random(n) < 0.3] = np.nan
+        v[rng.random(n) < 0.01] = "-"
+        return v
+
+    la = Line_Analyzer.__new__(Line_Analyzer)
+    la.col_out, la.col_in = "Output Optical Power (dBm)", "Input Optical Power(dBm)"
+    la.col_max_out, la.col_min_out = "Maximum threshold(out)", "Minimum threshold(out)"
+    la.col_max_in, la.col_min_in = "Maximum threshold(in)", "Minimum threshold(in)"
+    df = pd.DataFrame({
+        "Site Name": [f"Site{c % 50}" for c in call],
+        "ME": [f"ME{c % 7}" for c in call],
+        "Call ID": call.astype(str),
+        "Measure Object": rng.choice(["LB2R-1-1", "L4S-2-1", "OCH-3"], n),
+        "Route": np.where(rng.random(n) < 0.05, "Preset 2", "Work"),
+        "Threshold": col(0, 1e-3),
+        "Instant BER After FEC": col(0, 1e-3),
+        la.col_max_out: col(1, 5), la.col_min_out: col(-10, -5), la.col_out: col(-10, 5),
+        la.col_max_in: col(1, 5), la.col_min_in: col(-20, -10), la.col_in: col(-20, 5),
+    })
+    return la, df
+
+
+def _collapse_by_line_loop(la, df):
+    """ตัวเทียบ: วิธีเดิม (วน groupby ทีละกลุ่มใน Python) ใช้ตรวจว่าผลตรงกับแบบ groupby-aggregate"""
+    import pandas as pd
+
+    def _num(s):
+        return pd.to_numeric(s, errors="coerce")
+
+    def _first(s):
+        s = _num(s).dropna()
+        return s.iloc[0] if len(s) else float("nan")
+
+    power_cols = [la.col_in, la.col_out, la.col_min_in, la.col_max_in, la.col_min_out, la.col_max_out]
+    rows = []
+    for (site, me, cid), g in df.groupby(["Site Name", "ME", "Call ID"], dropna=False):
+        routes = g["Route"].astype(str).tolist()
+        has_power = g[power_cols].notna().any(axis=1)
+        rows.append({
+            "Site Name": site, "ME": me, "Call ID": str(cid),
+            "Measure Object": g.loc[has_power, "Measure Object"].iloc[0] if has_power.any() else g["Measure Object"].iloc[0],
+            "Route": next((r for r in routes if r.startswith("Preset")), routes[0]),
+            "Threshold": _first(g["Threshold"]), "Instant BER After FEC": _first(g["Instant BER After FEC"]),
+            la.col_max_out: _num(g[la.col_max_out]).min(), la.col_min_out: _num(g[la.col_min_out]).max(),
+            la.col_out: _first(g[la.col_out]),
+            la.col_max_in: _num(g[la.col_max_in]).min(), la.col_min_in: _num(g[la.col_min_in]).max(),
+            la.col_in: _first(g[la.col_in]),
+        })
+    return pd.DataFrame(rows)
+
+
+def bench_line(sizes=(1_000, 10_000)):
+    import pandas as pd
+
+    print("\n== Line collapse-by-line (synthetic, 4 rows/line) ==")
+    print(f"{'lines':>9}{'loop':>14}{'groupby':>14}{'same':>7}")
+    for n in sizes:
+        la, df = synthetic_line_frame(n)
+        t0 = time.perf_counter()
+        expected = _collapse_by_line_loop(la, df)  # วิธีเดิมช้ามาก: วัดรอบเดียว
+        loop = time.perf_counter() - t0
+        vec = _timeit(lambda: la._collapse_by_line(df))
+        try:
+            pd.testing.assert_frame_equal(expected, la._collapse_by_line(df))
+            same = "yes"
+        except AssertionError:
+            same = "NO"
+        print(f"{n:>9,}{loop * 1000:>11.1f} ms{vec * 1000:>11.1f} ms{same:>7}")
+
+
+# ---------- reference keyed join ----------
+def synthetic_ref_join(n_raw: int, n_ref: int, dup: int = 0, seed: int = 0):
+    """(ไฟล์ดิบ, reference) จำลอง: key ดิบบางส่วนไม่มีใน reference, dup = จำนวน Mapping ที่ซ้ำใน reference"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    mapping = [f"ME{i % 97}BOARD-{i}" for i in range(n_ref)]
+    mapping[:dup] = mapping[n_ref - dup:] if dup else []
+    df_ref = pd.DataFrame({
+        "Mapping": mapping,
+        "Site Name": [f"Site{i % 50}" for i in range(n_ref)],
+        "Maximum threshold": rng.uniform(50, 90, n_ref),
+        "order": range(n_ref),
+    })
+    keys = rng.integers(0, int(n_ref * 1.1), n_raw)  # ~10% ไม่พบใน reference
+    df_raw = pd.DataFrame({
+        "Mapping Format": [f"ME{k % 97}BOARD-{k}" for k in keys],
+        "Site Name": "raw",
+        "CPU utilization ratio": rng.uniform(0, 100, n_raw),
+    })
+    return df_raw, df_ref
+
+
+def bench_join(sizes=(10_000, 100_000)):
+    import pandas as pd
+    from utils.keyed_join import RefKeyIndex
+
+    print("\n== Reference keyed join (synthetic, ~10% unmatched) ==")
+    print(f"{'rows':>9}{'ref dup':>9}{'merge':>14}{'index join':>14}{'same':>7}")
+    cols = ["Mapping", "Site Name", "Maximum threshold", "order"]
+    for n in sizes:
+        for dup in (0, 3):  # dup > 0: key ซ้ำใน reference → ต้อง fallback เป็น pd.merge
+            df_raw, df_ref = synthetic_ref_join(n, n // 4, dup)
+            expected = pd.merge(df_raw, df_ref[cols], left_on="Mapping Format", right_on="Mapping", how="inner")
+            merge = _timeit(lambda: pd.merge(df_raw, df_ref[cols], left_on="Mapping Format", right_on="Mapping", how="inner"))
+            idx = RefKeyIndex(df_ref["Mapping"])
+            joined, unmatched = idx.join(df_raw, "Mapping Format", df_ref, cols)
+            pd.testing.assert_frame_equal(joined, expected)
+            assert len(joined.drop_duplicates("Mapping Format")) + len(unmatched.drop_duplicates("Mapping Format")) \
+                == df_raw["Mapping Format"].nunique(), "unmatched rows do not complement the matched keys"
+            assert not unmatched["Mapping Format"].isin(df_ref["Mapping"]).any()
+            join = _timeit(lambda: idx.join(df_raw, "Mapping Format", df_ref, cols))
+            print(f"{n:>9,}{dup:>9}{merge * 1000:>11.1f} ms{join * 1000:>11.1f} ms{'yes':>7}")
+
+
+def synthetic_client_abnormal(n_rows: int, seed: int = 0):
+    """ตาราง abnormal ของ Client จำลอง (index ไม่ต่อเนื่องเหมือน abnormal_by_type จริง)"""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    lo = rng.uniform(-20, -10, n_rows)
+    hi = lo + 15
+    return pd.DataFrame({
+        "Site Name": [f"Site{i % 300}" for i in range(n_rows)],
+        "ME": [f"ME{i % 500}" for i in range(n_rows)],
+        "Measure Object": [f"C2Kx1[1-{i % 40}]-OTU" for i in range(n_rows)],
+        "Maximum threshold(out)": hi, "Minimum threshold(out)": lo,
+        "Output Optical Power (dBm)": rng.uniform(-25, 10, n_rows),
+        "Maximum threshold(in)": hi, "Minimum threshold(in)": lo,
+        "Input Optical Power(dBm)": rng.uniform(-25, 10, n_rows),
+    }, index=rng.permutation(n_rows * 2)[:n_rows])
+
+
+def bench_report(sizes=(1_000, 4_000, 16_000)):
+    import report
+
+    print("\n== PDF report (Client abnormal rows, synthetic) ==")
+    print(f"{'rows':>9}{'build':>12}{'ms/row':>9}{'tables cached':>15}{'MB':>7}")
+    for n in sizes:
+        all_abnormal = {"Client": {"C2K": synthetic_client_abnormal(n)}}
+        report._table_cache.clear()
+        t0 = time.perf_counter()
+        pdf = report.generate_report(all_abnormal)  # รอบแรก: เตรียมตาราง + layout
+        build = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        report.generate_report(all_abnormal)  # รอบถัดไป: ตารางจาก cache, layout ใหม่ (เวลาบนหน้าแรกใหม่)
+        warm = time.perf_counter() - t0
+        print(f"{n:>9,}{build:>10.2f} s{build / n * 1000:>9.2f}{warm:>13.2f} s{len(pdf) / 1e6:>7.1f}")
+
+
+BENCHES = {
+    "xlsx": bench_xlsx,
+    "apo": bench_apo,
+    "line": bench_line,
+    "preset": bench_preset,
+    "join": bench_join,
+    "report": bench_report,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHES)
+    for n in names:
+        if n not in BENCHES:
+            print(f"❌ unknown benchmark '{n}' (มี: {', '.join(BENCHES)})")
+            continue
+        BENCHES[n]()
@@ -1,20 +1,237 @@
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
 )
 from reportlab.lib import colors
 from reportlab.lib.colors import HexColor
+from reportlab.pdfbase.pdfmetrics import stringWidth
 
+import hashlib
 import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime
-import pandas as pd
+from typing import List, Optional
 
+import numpy as np
+import pandas as pd
 
-def generate_report(all_abnormal: dict):
+from utils.rules import Rule, RuleSet
+
+
+# ===== คอลัมน์ + คอลัมน์ที่ไฮไลต์ต่อ section =====
+SECTION_ORDER = ["CPU", "FAN", "MSU", "Client"]  # CPU มาก่อน FAN
+SECTION_COLUMNS = {
+    "CPU": [
+        "Site Name", "ME", "Measure Object",
+        "Maximum threshold", "Minimum threshold",
+        "CPU utilization ratio"
+    ],
+    "FAN": [
+        "Site Name", "ME", "Measure Object",
+        "Maximum threshold", "Minimum threshold",
+        "Value of Fan Rotate Speed(Rps)"
+    ],
+    "MSU": [
+        "Site Name", "ME", "Measure Object",
+        "Maximum threshold", "Laser Bias Current(mA)"
+    ],
+    "Client": [
+        "Site Name", "ME", "Measure Object",
+        "Maximum threshold(out)", "Minimum threshold(out)", "Output Optical Power (dBm)",
+        "Maximum threshold(in)", "Minimum threshold(in)", "Input Optical Power(dBm)"
+    ],
+}
+# ไฮไลต์ทั้งคอลัมน์ (ทุกแถวเป็น abnormal อยู่แล้ว)
+SECTION_VALUE_COL = {
+    "CPU": "CPU utilization ratio",
+    "FAN": "Value of Fan Rotate Speed(Rps)",
+    "MSU": "Laser Bias Current(mA)",
+}
+# Client: ไฮไลต์เฉพาะ cell ที่อยู่นอกช่วง [min, max] (ต้องมีทั้งสองค่า)
+CLIENT_CELL_RULES = RuleSet([
+    Rule("Output Optical Power (dBm)", max="Maximum threshold(out)", min="Minimum threshold(out)", both_bounds=True),
+    Rule("Input Optical Power(dBm)", max="Maximum threshold(in)", min="Minimum threshold(in)", both_bounds=True),
+])
+
+LIGHT_RED = HexColor("#FF9999")
+TEXT_BLACK = colors.black
+BASE_TABLE_STYLE = [
+    ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("FONTSIZE", (0, 0), (-1, -1), 8),
+    ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
+    ("GRID", (0, 0), (-1, -1), 0.25, colors.black),
+]
+
+# ===== ตารางใหญ่ =====
+# แบ่งตารางเป็นก้อนละ ~1 หน้า (A4 แนวนอน, font 8): reportlab split ตารางใหญ่ทีละหน้าโดยจัด layout
+# + style ของแถวที่เหลือทั้งหมดใหม่ทุกครั้ง (เวลาโตแบบกำลังสอง) — ก้อนเล็กทำให้เวลาโตตามจำนวนแถว
+ROWS_PER_BLOCK = 24
+CELL_FONT, HEADER_FONT, FONT_SIZE = "Helvetica", "Helvetica-Bold", 8
+CELL_PADDING = 12  # LEFTPADDING + RIGHTPADDING ค่าเริ่มต้นของ TableStyle
+# จำกัดจำนวนแถวที่แสดงในแต่ละตาราง (ที่เหลือไปอยู่ Appendix ท้าย report), 0 = แสดงทุกแถว
+REPORT_MAX_DETAIL_ROWS = int(os.environ.get("REPORT_MAX_DETAIL_ROWS", 0))
+OVERFLOW_TOP_SITES = 10
+
+
+@dataclass
+class TableSpec:
+    """
+    ข้อมูลของตาราง abnormal หนึ่งชุด (ยังไม่เป็น flowable)
+      - header / rows: ข้อความในตาราง
+      - col_highlight: คอลัมน์ที่ไฮไลต์ทั้งคอลัมน์ (CPU/FAN/MSU — ทุกแถวเป็น abnormal)
+      - cells:         bool [แถว, คอลัมน์] ของ cell ที่ไฮไลต์ (Client) หรือ None
+      - sites:         Site Name ต่อแถว (ใช้สรุปแถวที่เกิน cap) หรือ None
+      - col_widths:    ความกว้างคอลัมน์จากทั้งตาราง (ทุกก้อนกว้างเท่ากัน)
     """
-    สร้าง PDF Report รวม FAN + CPU + MSU
+    header: List[str]
+    rows: List[List[str]]
+    col_widths: List[float] = field(default_factory=list)
+    col_highlight: List[int] = field(default_factory=list)
+    cells: Optional[np.ndarray] = None
+    sites: Optional[pd.Series] = None
+
+
+# ---------- cache: ตาราง abnormal เดิม = ข้อมูลตาราง/ไฮไลต์เดิม ----------
+# เก็บระดับ process (download callback รันนอก script thread จึงไม่ใช้ st.session_state)
+# ตารางเก็บเป็น TableSpec ไม่ใช่ Table: flowable ของ reportlab ถูกแก้ระหว่าง layout/split
+# ไม่ cache ตัว PDF: หน้าแรกมีเวลาที่สร้าง (Generated on) ต้องเป็นเวลาที่กดดาวน์โหลดจริง
+_TABLE_CACHE_MAX = 64
+_table_cache: "OrderedDict[str, Optional[TableSpec]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_get(cache: OrderedDict, key: str):
+    with _cache_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return True, cache[key]
+    return False, None
+
+
+def _cache_put(cache: OrderedDict, key: str, value, max_size: int) -> None:
+    with _cache_lock:
+        cache[key] = value
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """hash ของเนื้อตาราง (ชื่อคอลัมน์ + dtype + ค่า ไม่รวม index)"""
+    h = hashlib.sha1(repr((list(df.columns), [str(t) for t in df.dtypes])).encode("utf-8"))
+    try:
+        values = pd.util.hash_pandas_object(df, index=False)
+    except TypeError:  # object ที่ hash ไม่ได้ (list ฯลฯ) → เทียบแบบ str
+        values = pd.util.hash_pandas_object(df.astype(str), index=False)
+    h.update(values.to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _table_spec(section_name: str, df: pd.DataFrame) -> Optional[TableSpec]:
+    """TableSpec ของตาราง abnormal หนึ่งชุด — None ถ้าไม่มีคอลัมน์ที่แสดงได้"""
+    key = f"{section_name}:{frame_hash(df)}"
+    hit, spec = _cache_get(_table_cache, key)
+    if hit:
+        return spec
+
+    # ===== Filter columns =====
+    cols_to_show = SECTION_COLUMNS.get(section_name)
+    df_show = df[[c for c in cols_to_show if c in df.columns]] if cols_to_show else df
+
+    spec = None
+    if not df_show.empty:
+        df_str = df_show.astype(str)
+        spec = TableSpec(
+            header=list(df_show.columns),
+            rows=df_str.values.tolist(),
+            col_widths=[_col_width(c, df_str.iloc[:, j]) for j, c in enumerate(df_show.columns)],
+            sites=df_str["Site Name"] if "Site Name" in df_str.columns else None,
+        )
+
+        # ===== Highlight logic =====
+        value_col = SECTION_VALUE_COL.get(section_name)
+        if value_col is not None:
+            col_idx = cols_to_show.index(value_col)
+            if col_idx < len(df_show.columns):
+                spec.col_highlight.append(col_idx)
+
+        elif section_name == "Client":
+            # cell ที่ผิดกฎทั้งตารางคำนวณทีเดียว (ตามตำแหน่งแถว)
+            spec.cells = CLIENT_CELL_RULES.cell_masks(df_show).to_numpy()
+
+    _cache_put(_table_cache, key, spec, _TABLE_CACHE_MAX)
+    return spec
+
+
+def _col_width(header: str, values: pd.Series) -> float:
+    """กว้างเท่ากับที่ reportlab คำนวณเอง (ข้อความยาวสุด + padding) แต่วัดเฉพาะค่าที่ไม่ซ้ำ"""
+    w = stringWidth(str(header), HEADER_FONT, FONT_SIZE)
+    for v in values.unique():
+        w = max(w, max(stringWidth(line, CELL_FONT, FONT_SIZE) for line in v.split("\n")))
+    return w + CELL_PADDING
+
+
+def _highlight(style_cmds: list, col: int, row0: int, row1: int) -> None:
+    style_cmds.append(("BACKGROUND", (col, row0), (col, row1), LIGHT_RED))
+    style_cmds.append(("TEXTCOLOR", (col, row0), (col, row1), TEXT_BLACK))
+
+
+def _cell_runs(style_cmds: list, cells: np.ndarray) -> None:
+    """
+    ไฮไลต์จาก mask ของก้อน: คอลัมน์ที่ผิดทุกแถว → คำสั่งเดียวทั้งคอลัมน์,
+    ไม่งั้นรวมแถวที่ติดกันเป็นช่วงเดียว (แถวใน Table = ตำแหน่ง + 1 เพราะมี header)
+    """
+    for cidx in np.flatnonzero(cells.any(axis=0)):
+        col = cells[:, cidx]
+        if col.all():
+            _highlight(style_cmds, int(cidx), 1, -1)
+            continue
+        edges = np.diff(np.concatenate(([0], col.view(np.int8), [0])))
+        for start, stop in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+            _highlight(style_cmds, int(cidx), int(start) + 1, int(stop))
+
+
+def _table_blocks(spec: TableSpec, start: int = 0, stop: Optional[int] = None) -> list:
+    """Table ก้อนละ ROWS_PER_BLOCK แถว (มี header ทุกก้อน) ของแถว [start, stop)"""
+    stop = len(spec.rows) if stop is None else stop
+    blocks = []
+    for lo in range(start, stop, ROWS_PER_BLOCK):
+        hi = min(lo + ROWS_PER_BLOCK, stop)
+        style_cmds = list(BASE_TABLE_STYLE)
+        for col_idx in spec.col_highlight:
+            _highlight(style_cmds, col_idx, 1, -1)
+        if spec.cells is not None:
+            _cell_runs(style_cmds, spec.cells[lo:hi])
+        table = Table([spec.header] + spec.rows[lo:hi], colWidths=spec.col_widths, repeatRows=1)
+        table.setStyle(TableStyle(style_cmds))
+        blocks.append(table)
+    return blocks
+
+
+def _overflow_summary(spec: TableSpec, cap: int) -> str:
+    n = len(spec.rows)
+    text = f"Showing first {cap} of {n} abnormal rows — remaining {n - cap} rows are listed in the Appendix."
+    if spec.sites is not None:
+        top = spec.sites.value_counts().head(OVERFLOW_TOP_SITES)
+        text += "<br/>Abnormal rows by site: " + ", ".join(f"{site} ({cnt})" for site, cnt in top.items())
+        if len(top) < spec.sites.nunique():
+            text += ", …"
+    return text
+
+
+def generate_report(all_abnormal: dict, max_detail_rows: Optional[int] = None):
     """
+    สร้าง PDF Report รวม CPU + FAN + MSU + Client
+    สร้าง PDF ใหม่ทุกครั้ง (เวลาที่สร้างบนหน้าแรกเป็นปัจจุบัน) แต่ตารางที่ไม่เปลี่ยนใช้ข้อมูล/ไฮไลต์เดิมจาก cache
+    max_detail_rows: แสดงไม่เกินกี่แถวต่อตาราง (ที่เหลือไป Appendix), None = REPORT_MAX_DETAIL_ROWS
+    """
+    cap = REPORT_MAX_DETAIL_ROWS if max_detail_rows is None else max_detail_rows
 
     # ===== Buffer & Document =====
     buffer = io.BytesIO()
@@ -37,6 +254,7 @@ def generate_report(all_abnormal: dict):
     )
 
     elements = []
+    overflow = []  # (ชื่อ, spec) ของตารางที่เกิน cap → Appendix
 
     # ===== Title & Date =====
     elements.append(Paragraph("3BB Network Inspection Report", title_center))
@@ -46,11 +264,7 @@ def generate_report(all_abnormal: dict):
     elements.append(Spacer(1, 24))
 
     # ===== Sections (CPU มาก่อน FAN) =====
-    section_order = ["CPU", "FAN", "MSU", "Client"]
-    light_red = HexColor("#FF9999")
-    text_black = colors.black
-
-    for section_name in section_order:
+    for section_name in SECTION_ORDER:
         abn_dict = all_abnormal.get(section_name, {})
 
         elements.append(Paragraph(f"{section_name} Performance", section_title_left))
@@ -68,117 +282,29 @@ def generate_report(all_abnormal: dict):
             elements.append(Paragraph(f"{subtype} – Abnormal Rows", section_title_left))
             elements.append(Spacer(1, 6))
 
-            df_show = df.copy()
-
-            # ===== Filter columns =====
-            if section_name == "FAN":
-                cols_to_show = [
-                    "Site Name", "ME", "Measure Object",
-                    "Maximum threshold", "Minimum threshold",
-                    "Value of Fan Rotate Speed(Rps)"
-                ]
-                df_show = df_show[[c for c in cols_to_show if c in df_show.columns]]
-
-            elif section_name == "CPU":
-                cols_to_show = [
-                    "Site Name", "ME", "Measure Object",
-                    "Maximum threshold", "Minimum threshold",
-                    "CPU utilization ratio"
-                ]
-                df_show = df_show[[c for c in cols_to_show if c in df_show.columns]]
-
-            elif section_name == "MSU":
-                cols_to_show = [
-                    "Site Name", "ME", "Measure Object",
-                    "Maximum threshold", "Laser Bias Current(mA)"
-                ]
-                df_show = df_show[[c for c in cols_to_show if c in df_show.columns]]
-
-            elif section_name == "Client":
-                cols_to_show = [
-                    "Site Name", "ME", "Measure Object",
-                    "Maximum threshold(out)", "Minimum threshold(out)", "Output Optical Power (dBm)",
-                    "Maximum threshold(in)", "Minimum threshold(in)", "Input Optical Power(dBm)"
-                ]
-                df_show = df_show[[c for c in cols_to_show if c in df_show.columns]]
-
-
-            # ===== Build table_data =====
-            if df_show.empty:
+            spec = _table_spec(section_name, df)
+            if spec is None:
                 elements.append(Paragraph("⚠️ Data exists but no valid columns to display.", normal_left))
                 elements.append(Spacer(1, 12))
                 continue
 
-            table_data = [list(df_show.columns)] + df_show.astype(str).values.tolist()
-            table = Table(table_data, repeatRows=1)
-
-            style_cmds = [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.grey),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                ("ALIGN", (0, 0), (-1, -1), "CENTER"),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, -1), 8),
-                ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
-                ("GRID", (0, 0), (-1, -1), 0.25, colors.black),
-            ]
-
-            # ===== Highlight logic =====
-            if section_name == "CPU" and "CPU utilization ratio" in cols_to_show:
-                col_idx = cols_to_show.index("CPU utilization ratio")
-                if col_idx < len(df_show.columns):
-                    style_cmds.append(("BACKGROUND", (col_idx, 1), (col_idx, -1), light_red))
-                    style_cmds.append(("TEXTCOLOR", (col_idx, 1), (col_idx, -1), text_black))
-
-            elif section_name == "FAN" and "Value of Fan Rotate Speed(Rps)" in cols_to_show:
-                col_idx = cols_to_show.index("Value of Fan Rotate Speed(Rps)")
-                if col_idx < len(df_show.columns):
-                    style_cmds.append(("BACKGROUND", (col_idx, 1), (col_idx, -1), light_red))
-                    style_cmds.append(("TEXTCOLOR", (col_idx, 1), (col_idx, -1), text_black))
-
-            elif section_name == "MSU" and "Laser Bias Current(mA)" in cols_to_show:
-                col_idx = cols_to_show.index("Laser Bias Current(mA)")
-                if col_idx < len(df_show.columns):
-                    style_cmds.append(("BACKGROUND", (col_idx, 1), (col_idx, -1), light_red))
-                    style_cmds.append(("TEXTCOLOR", (col_idx, 1), (col_idx, -1), text_black))
-
-          
-          
-            elif section_name == "Client":
-                nrows = len(df_show) + 1   # header + data
-                ncols = len(df_show.columns)
-                col_map = {c: i for i, c in enumerate(df_show.columns)}  # ✅ สร้าง map คอลัมน์จริง
-
-                for ridx, row in df_show.iterrows():
-                    # Output check
-                    try:
-                        v = float(row.get("Output Optical Power (dBm)", float("nan")))
-                        lo = float(row.get("Minimum threshold(out)", float("nan")))
-                        hi = float(row.get("Maximum threshold(out)", float("nan")))
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            cidx = col_map.get("Output Optical Power (dBm)")
-                            if cidx is not None and 0 <= cidx < ncols and 0 <= ridx+1 < nrows:
-                                style_cmds.append(("BACKGROUND", (cidx, ridx+1), (cidx, ridx+1), light_red))
-                                style_cmds.append(("TEXTCOLOR", (cidx, ridx+1), (cidx, ridx+1), text_black))
-                    except:
-                        pass
-
-                    # Input check
-                    try:
-                        v = float(row.get("Input Optical Power(dBm)", float("nan")))
-                        lo = float(row.get("Minimum threshold(in)", float("nan")))
-                        hi = float(row.get("Maximum threshold(in)", float("nan")))
-                        if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                            cidx = col_map.get("Input Optical Power(dBm)")
-                            if cidx is not None and 0 <= cidx < ncols and 0 <= ridx+1 < nrows:
-                                style_cmds.append(("BACKGROUND", (cidx, ridx+1), (cidx, ridx+1), light_red))
-                                style_cmds.append(("TEXTCOLOR", (cidx, ridx+1), (cidx, ridx+1), text_black))
-                    except:
-                        pass
-
-
-            # ===== Apply style & append =====
-            table.setStyle(TableStyle(style_cmds))
-            elements.append(table)
+            # ===== Table (แบ่งก้อน) + สรุปแถวที่เกิน cap =====
+            if cap and len(spec.rows) > cap:
+                elements.extend(_table_blocks(spec, 0, cap))
+                elements.append(Paragraph(_overflow_summary(spec, cap), normal_left))
+                overflow.append((f"{section_name} {subtype}", spec))
+            else:
+                elements.extend(_table_blocks(spec))
+            elements.append(Spacer(1, 18))
+
+    # ===== Appendix: แถวที่เกิน cap =====
+    if overflow:
+        elements.append(PageBreak())
+        elements.append(Paragraph("Appendix – Overflow Rows", title_center))
+        for name, spec in overflow:
+            elements.append(Paragraph(f"{name} – rows {cap + 1}–{len(spec.rows)}", section_title_left))
+            elements.append(Spacer(1, 6))
+            elements.extend(_table_blocks(spec, cap))
             elements.append(Spacer(1, 18))
 
     # ===== Build Document =====
@@ -1,7 +1,14 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import streamlit as st
 import pandas as pd
-from typing import Optional
+from typing import Callable, Dict, Optional, Tuple
 from report import generate_report
+from utils.ref_registry import get_ref, get_ref_index
+from utils.rules import Rule, RuleSet
+from utils.table_style import CSS_BAD_SOFT, render_table
+from utils.analysis import Fingerprint, fingerprint, publish
+from utils.export_bundle import FORMATS, bundle_bytes
 
 
 from FAN_Analyzer import FAN_Analyzer
@@ -13,72 +20,143 @@ from Fiberflapping_Analyzer import FiberflappingAnalyzer
 from EOL_Core_Analyzer import EOLAnalyzer, CoreAnalyzer
 
 # ==============================
-# Helper: auto-create analyzer
+# Helper: auto-create analyzer (headless prepare พร้อมกันทุกตัว)
 # ==============================
-def _ensure_analyzer(key: str, analyzer_cls, ref_file: str, ns: str):
+# ฟังก์ชันสร้าง analyzer รันใน worker thread → ห้ามแตะ st.* (ข้อมูลจาก session ถูกดึงมาให้ก่อนใน script thread)
+def _line_analyzer(d: dict) -> Line_Analyzer:
+    # preset map เหมือนหน้า Line board (parse จาก WASON log ที่ index ไว้แล้ว)
+    pmap = Line_Analyzer.get_preset_map(d["wason_log"]) if d.get("wason_log") else {}
+    return Line_Analyzer(
+        df_line=d["line_data"].copy(), df_ref=get_ref("data/Line.xlsx"), pmap=pmap, ns="line_summary",
+        ref_index=get_ref_index("data/Line.xlsx"),
+    )
+
+
+# key → (session keys ที่ต้องมี, session keys เสริม, reference, ฟังก์ชันสร้าง analyzer จาก dict ของข้อมูล)
+# ลำดับ session keys + reference ตรงกับ fingerprint ของหน้า analyzer ใน app9 → ใช้ผลของกันและกันได้
+ANALYZER_SPECS = {
+    "cpu": (("cpu_data",), (), ("data/CPU.xlsx",), lambda d: CPU_Analyzer(
+        df_cpu=d["cpu_data"].copy(), df_ref=get_ref("data/CPU.xlsx"), ns="cpu_summary",
+        ref_index=get_ref_index("data/CPU.xlsx"))),
+    "fan": (("fan_data",), (), ("data/FAN.xlsx",), lambda d: FAN_Analyzer(
+        df_fan=d["fan_data"].copy(), df_ref=get_ref("data/FAN.xlsx"), ns="fan_summary",
+        ref_index=get_ref_index("data/FAN.xlsx"))),
+    "msu": (("msu_data",), (), ("data/MSU.xlsx",), lambda d: MSU_Analyzer(
+        df_msu=d["msu_data"].copy(), df_ref=get_ref("data/MSU.xlsx"), ns="msu_summary",
+        ref_index=get_ref_index("data/MSU.xlsx"))),
+    "line": (("line_data",), ("wason_log",), ("data/Line.xlsx",), _line_analyzer),
+    "client": (("client_data",), (), ("data/Client.xlsx",), lambda d: Client_Analyzer(
+        df_client=d["client_data"].copy(), ref_path="data/Client.xlsx")),
+    "fiber": (("osc_data", "fm_data"), (), (), lambda d: FiberflappingAnalyzer(
+        df_optical=d["osc_data"].copy(), df_fm=d["fm_data"].copy(), threshold=2.0)),
+    "eol": (("atten_data",), (), ("data/EOL.xlsx",), lambda d: EOLAnalyzer(
+        df_ref=None, df_raw_data=d["atten_data"].copy(), ref_path="data/EOL.xlsx")),
+    "core": (("atten_data",), (), ("data/EOL.xlsx",), lambda d: CoreAnalyzer(
+        df_ref=None, df_raw_data=d["atten_data"].copy(), ref_path="data/EOL.xlsx")),
+}
+
+
+def _is_current(analyzer, fp: Optional[Fingerprint]) -> bool:
+    # เทียบเฉพาะ input (ข้อมูล + reference): analyzer จากหน้า CPU/FAN/... ใช้ใน Summary ได้แม้ ns ต่างกัน
+    return (
+        analyzer is not None and analyzer.result is not None and fp is not None
+        and analyzer.fingerprint is not None and analyzer.fingerprint.inputs == fp.inputs
+    )
+
+
+def _pending_jobs() -> Dict[str, Tuple[dict, Optional[Fingerprint]]]:
+    """analyzer ที่ยังไม่มี (หรือคำนวณจากข้อมูล/reference เก่า) แต่มีข้อมูลแล้ว → {key: (ข้อมูลจาก session, fingerprint)}"""
+    jobs = {}
+    for key, (required, optional, refs, _build) in ANALYZER_SPECS.items():
+        data = {k: st.session_state.get(k) for k in required + optional}
+        if any(data[k] is None for k in required):
+            continue
+        try:
+            fp = fingerprint(inputs=[data[k] for k in required + optional], refs=refs, params=("summary",))
+        except OSError:
+            fp = None  # ไม่มีไฟล์ reference → ให้ worker แจ้ง error ตอนสร้าง
+        if not _is_current(st.session_state.get(f"{key}_analyzer"), fp):
+            jobs[key] = (data, fp)
+    return jobs
+
+
+def _prepare(key: str, data: dict, fp: Optional[Fingerprint]):
+    analyzer = ANALYZER_SPECS[key][3](data)
+    analyzer.prepare()  # ✅ ใช้ prepare() (ไม่ render UI)
+    analyzer.fingerprint = fp
+    return analyzer
+
+
+def prepare_analyzers(jobs: Dict[str, Tuple[dict, Optional[Fingerprint]]], on_ready: Optional[Callable[[str], None]] = None) -> None:
     """
-    ตรวจสอบและสร้าง analyzer อัตโนมัติถ้ายังไม่มี
-    key = 'cpu' หรือ 'fan' หรือ 'msu' หรือ 'line' หรือ 'client' หรือ 'eol' หรือ 'core'
+    prepare() ทุก analyzer ใน jobs พร้อมกันบน thread pool (อ่าน reference + compute ขนานกัน)
+    publish + on_ready(key) ทำใน script thread ทันทีที่แต่ละตัวเสร็จ (ไม่รอตัวที่ช้าที่สุด)
     """
-    analyzer_key = f"{key}_analyzer"
-    data_key = f"{key}_data"
-
-    if st.session_state.get(analyzer_key) is None and st.session_state.get(data_key) is not None:
-        try:
-            df_ref = pd.read_excel(ref_file)
-
-            if key == "cpu":
-                analyzer = analyzer_cls(
-                    df_cpu=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "fan":
-                analyzer = analyzer_cls(
-                    df_fan=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "msu":
-                analyzer = analyzer_cls(
-                    df_msu=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "line":
-                analyzer = analyzer_cls(
-                    df_line=st.session_state[data_key].copy(),
-                    df_ref=df_ref.copy(),
-                    ns=ns
-                )
-            elif key == "client":
-                analyzer = analyzer_cls(
-                    df_client=st.session_state[data_key].copy(),
-                    ref_path=ref_file
-                )
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 4)) as pool:
+        futures = {pool.submit(_prepare, key, data, fp): key for key, (data, fp) in jobs.items()}
+        for fut in as_completed(futures):
+            key = futures[fut]
+            try:
+                analyzer = fut.result()
+            except Exception as e:
+                st.warning(f"Auto-create {key.upper()} analyzer failed: {e}")
             else:
-                return
+                publish(key, analyzer)
+            if on_ready is not None:
+                on_ready(key)
 
-            analyzer.prepare()  # ✅ ใช้ prepare() (ไม่ render UI)
-            st.session_state[analyzer_key] = analyzer
 
-            st.write(
-                f"DEBUG: Analyzer {key} created. "
-                f"df_abnormal rows = {len(analyzer.df_abnormal) if analyzer.df_abnormal is not None else 'None'}"
-            )
-        except Exception as e:
-            st.warning(f"Auto-create {key.upper()} analyzer failed: {e}")
 
+# ==============================
+# Styler Helper
+# ==============================
+_POWER_RULES = [
+    Rule("Input Optical Power(dBm)", max="Maximum threshold(in)", min="Minimum threshold(in)", both_bounds=True),
+    Rule("Output Optical Power (dBm)", max="Maximum threshold(out)", min="Minimum threshold(out)", both_bounds=True),
+]
+_LINE_CELL_RULES = RuleSet([Rule("Instant BER After FEC", max="Threshold")] + _POWER_RULES)
+_CLIENT_CELL_RULES = RuleSet(_POWER_RULES)
+
+
+def _abnormal_cells(df_abn: pd.DataFrame, rules: RuleSet) -> dict:
+    """ไฮไลต์เฉพาะ cell ที่ผิดกฎ (df_abn เป็น abnormal rows อยู่แล้ว)"""
+    cells = rules.cell_masks(df_abn)
+    return {c: (cells[c], CSS_BAD_SOFT) for c in cells.columns if cells[c].any()}
+
+
+def _positive_cells(df_abn: pd.DataFrame, value_col: str) -> dict:
+    return {value_col: (pd.to_numeric(df_abn[value_col], errors="coerce") > 0, CSS_BAD_SOFT)}
 
 
 # ==============================
-# Styler Helper
+# Summary rows (ลำดับแถวในตาราง)
 # ==============================
-#def _style_abnormal_table(df_abn: pd.DataFrame, value_col: str) -> "pd.io.formats.style.Styler":
-    #"""ไฮไลต์ abnormal column (df_abn เป็น abnormal rows อยู่แล้ว)"""
-    #def highlight_red(_):
-        #return "background-color:#ff9999; color:black"
-    #return df_abn.style.applymap(highlight_red, subset=[value_col])
+# (key ของ analyzer, Type, Task, Details, คอลัมน์ค่า)
+SUMMARY_ROWS = [
+    ("cpu", "Performance", "CPU board",
+     "Threshold: Normal if ≤ 90%, Abnormal if > 90%", "CPU utilization ratio"),
+    ("fan", "Performance", "FAN board",
+     "FAN ratio performance\n"
+     "FCC: Normal if ≤ 120, Abnormal if > 120\n"
+     "FCPP: Normal if ≤ 250, Abnormal if > 250\n"
+     "FCPL: Normal if ≤ 120, Abnormal if > 120\n"
+     "FCPS: Normal if ≤ 230, Abnormal if > 230", "Value of Fan Rotate Speed(Rps)"),
+    ("msu", "Performance", "MSU board",
+     "Threshold: Should remain within normal range (not high)", "Laser Bias Current(mA)"),
+    ("line", "Performance", "Line board",
+     "Normal input/output power [xx–xx dB]", "Instant BER After FEC"),
+    ("client", "Performance", "Client board",
+     "Normal input/output power [xx–xx dB]", "Input Optical Power(dBm)"),
+    ("fiber", "Fiber", "Flapping",
+     "Threshold: Normal if ≤ 2 dB, Abnormal if > 2 dB", "Max - Min (dB)"),
+    ("eol", "Fiber", "Loss between EOL",
+     "Normal if < 2 dB, Abnormal if ≥ 2 dB (Loss current - Loss EOL)\nFiber break = Abnormal", "Loss current - Loss EOL"),
+    ("core", "Fiber", "Loss between Core",
+     "Normal if ≤ 2 dB, Abnormal if > 2 dB (Loss between core)", "Loss between core"),
+]
+ROWS_BY_KEY = {row[0]: row for row in SUMMARY_ROWS}
 
 
 # ==============================
@@ -90,16 +168,14 @@ class SummaryTableReport:
     def __init__(self):
         self.sections = []  # เก็บ summary ของแต่ละ analyzer
 
-    def _get_summary(self, key: str, analyzer_cls, details: str, value_col: str):
+    def _get_summary(self, key: str, details: str):
         """ดึง analyzer จาก session และคืนค่า (status, details, df_abn, df_abn_by_type)"""
         analyzer = st.session_state.get(f"{key}_analyzer")
 
         if analyzer is None:
-            st.write(f"DEBUG: Analyzer {key} not found in session_state")
             return ("No data", details, None, {})
 
         df_abn = getattr(analyzer, "df_abnormal", None)
-        st.write(f"DEBUG: {key} df_abnormal type={type(df_abn)}, size={(len(df_abn) if df_abn is not None else 'None')}")
         df_abn_by_type = getattr(analyzer, "df_abnormal_by_type", {})
         status = "Normal"
         if df_abn is not None and not df_abn.empty:
@@ -112,19 +188,6 @@ class SummaryTableReport:
     def render(self) -> None:
         st.markdown("## Summary Table — Network Inspection")
 
-        #2 ✅ Ensure analyzers are ready
-        _ensure_analyzer("cpu", CPU_Analyzer, "data/CPU.xlsx", "cpu_summary")
-        _ensure_analyzer("fan", FAN_Analyzer, "data/FAN.xlsx", "fan_summary")
-        _ensure_analyzer("msu", MSU_Analyzer, "data/MSU.xlsx", "msu_summary")
-        _ensure_analyzer("line", Line_Analyzer, "data/Line.xlsx", "line_summary")
-        _ensure_analyzer("client", Client_Analyzer, "data/Client.xlsx", "client_summary")
-   
-
-
-
-
-
-
         # ===== Header =====
         col1, col2, col3, col4, col5 = st.columns([1, 1, 3, 1, 1])
         col1.markdown("**Type**")
@@ -133,85 +196,66 @@ class SummaryTableReport:
         col4.markdown("**Results**")
         col5.markdown("**View**")
 
-        # ==============================
-        # CPU Section
-        # ==============================
-        #3
-        CPU_DETAILS = "Threshold: Normal if ≤ 90%, Abnormal if > 90%"
-        cpu_status, cpu_details, cpu_abn, cpu_abn_by_type = self._get_summary(
-            "cpu", CPU_Analyzer, CPU_DETAILS, "CPU utilization ratio"
-        )
-        self._render_row("Performance", "CPU board", cpu_details, cpu_status, cpu_abn, "CPU utilization ratio")
-
-        # ==============================
-        # FAN Section
-        # ==============================
-        FAN_DETAILS = (
-            "FAN ratio performance\n"
-            "FCC: Normal if ≤ 120, Abnormal if > 120\n"
-            "FCPP: Normal if ≤ 250, Abnormal if > 250\n"
-            "FCPL: Normal if ≤ 120, Abnormal if > 120\n"
-            "FCPS: Normal if ≤ 230, Abnormal if > 230"
-        )
-        fan_status, fan_details, fan_abn, fan_abn_by_type = self._get_summary(
-            "fan", FAN_Analyzer, FAN_DETAILS, "Value of Fan Rotate Speed(Rps)"
-        )
-        self._render_row("Performance", "FAN board", fan_details, fan_status, fan_abn, "Value of Fan Rotate Speed(Rps)")
-
-        # ==============================
-        # MSU Section
-        # ==============================
-        MSU_DETAILS = "Threshold: Should remain within normal range (not high)"
-        msu_status, msu_details, msu_abn, msu_abn_by_type = self._get_summary(
-            "msu", MSU_Analyzer, MSU_DETAILS, "Laser Bias Current(mA)"
-        )
-        self._render_row("Performance", "MSU board", msu_details, msu_status, msu_abn, "Laser Bias Current(mA)")
-
-        # ==============================
-        # LINE Section
-        # ==============================
-        LINE_DETAILS = "Normal input/output power [xx–xx dB]"
-        line_status, line_details, line_abn, line_abn_by_type = self._get_summary(
-            "line", Line_Analyzer, LINE_DETAILS, "Instant BER After FEC"
-        )
-        self._render_row("Performance", "Line board", line_details, line_status, line_abn, "Instant BER After FEC")
-
-        CLIENT_DETAILS = ("Normal input/output power [xx–xx dB]")
-        client_status, client_details, client_abn, client_abn_by_type = self._get_summary(
-            "client", Client_Analyzer, CLIENT_DETAILS, "Input Optical Power(dBm)"
-        )
-        self._render_row("Performance", "Client board", client_details, client_status, client_abn, "Input Optical Power(dBm)")
-
-        # ==============================
-        # FLAPPING Section
-        # ==============================
-        FLAP_DETAILS = "Threshold: Normal if ≤ 2 dB, Abnormal if > 2 dB"
-        fiber_status, fiber_details, fiber_abn, fiber_abn_by_type = self._get_summary(
-            "fiber", FiberflappingAnalyzer, FLAP_DETAILS, "Max - Min (dB)"
-        )
-        self._render_row("Fiber", "Flapping", fiber_details, fiber_status, fiber_abn, "Max - Min (dB)")
-
+        #2 ✅ Ensure analyzers are ready: จองที่ให้ทุกแถวก่อน แล้วเติมแถวที่ analyzer พร้อมแล้วทันที
+        #   ตัวที่ยังไม่มี → prepare() พร้อมกันบน thread pool แล้วเติมแถวทีละตัวตามลำดับที่เสร็จ
+        jobs = _pending_jobs()
+        slots = {}
+        for key, *_row in SUMMARY_ROWS:
+            slots[key] = st.empty()
+            if key in jobs:
+                slots[key].caption(f"Preparing {key.upper()}…")
+
+        sections = {}
+
+        def _fill(key: str) -> None:
+            _key, type_name, task_name, details, value_col = ROWS_BY_KEY[key]
+            with slots[key].container():
+                status, details, df_abn, df_abn_by_type = self._get_summary(key, details)
+                self._render_row(type_name, task_name, details, status, df_abn, value_col)
+            sections[key] = df_abn_by_type
+
+        for key in ROWS_BY_KEY:
+            if key not in jobs:
+                _fill(key)
+        prepare_analyzers(jobs, on_ready=_fill)
 
         #4 ===== Export PDF รวม =====
         st.markdown("### Export Report")
         all_abnormal = {
-            "CPU": cpu_abn_by_type,   # ✅ CPU มาก่อน
-            "FAN": fan_abn_by_type,
-            "MSU": msu_abn_by_type,
-            "Line": line_abn_by_type,
-            "Client": client_abn_by_type,
-   
-
+            "CPU": sections["cpu"],   # ✅ CPU มาก่อน
+            "FAN": sections["fan"],
+            "MSU": sections["msu"],
+            "Line": sections["line"],
+            "Client": sections["client"],
         }
-        pdf_bytes = generate_report(all_abnormal=all_abnormal)
+        # สร้าง PDF ตอนกดดาวน์โหลดเท่านั้น (ตารางที่ไม่เปลี่ยนใช้ข้อมูลจาก cache ของ report)
         st.download_button(
             label="Download Report (All Sections)",
-            data=pdf_bytes,
+            data=lambda: generate_report(all_abnormal=all_abnormal),
             file_name="Network_Inspection_Report.pdf",
             mime="application/pdf",
         )
 
-    def _render_row(self, type_name, task_name, details, status, df_abn, value_col: str, df_abn_by_type=None):
+        # ผลเต็ม + abnormal ของทุก analyzer เป็น ZIP (Parquet/CSV ต่อ section) — สร้างตอนกดเท่านั้น
+        results = {}
+        for key in ROWS_BY_KEY:
+            analyzer = st.session_state.get(f"{key}_analyzer")
+            results[key] = getattr(analyzer, "result", None)
+        fmt = st.radio(
+            "Results bundle format",
+            FORMATS,
+            format_func=str.upper,
+            horizontal=True,
+            key="summary_bundle_format",
+        )
+        st.download_button(
+            label="Download Results Bundle (All Analyzers)",
+            data=lambda: bundle_bytes(results, fmt),
+            file_name=f"Network_Inspection_Results_{fmt}.zip",
+            mime="application/zip",
+        )
+
+    def _render_row(self, type_name, task_name, details, status, df_abn, value_col: str):
         """วาด summary row + toggle abnormal"""
         col1, col2, col3, col4, col5 = st.columns([1, 1, 3, 1, 1])
         col1.write(type_name)
@@ -262,14 +306,12 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    styled = (
-                        df_abn.style
-                        .format({c: "{:.2f}" for c in numeric_cols}, na_rep="-")
-                        .applymap(lambda v: "background-color:#ff9999; color:black"
-                                if isinstance(v, (int, float)) and pd.notna(v) and v > 0 else "",
-                                subset=["CPU utilization ratio"])
+                    render_table(
+                        df_abn,
+                        cells=_positive_cells(df_abn, "CPU utilization ratio"),
+                        fmt={c: "{:.2f}" for c in numeric_cols},
+                        na_rep="-",
                     )
-                    st.dataframe(styled, use_container_width=True)
 
                 # ===================== FAN =====================
                 elif task_name == "FAN board":
@@ -281,14 +323,12 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    styled = (
-                        df_abn.style
-                        .format({c: "{:.2f}" for c in numeric_cols}, na_rep="-")
-                        .applymap(lambda v: "background-color:#ff9999; color:black"
-                                if isinstance(v, (int, float)) and pd.notna(v) and v > 0 else "",
-                                subset=["Value of Fan Rotate Speed(Rps)"])
+                    render_table(
+                        df_abn,
+                        cells=_positive_cells(df_abn, "Value of Fan Rotate Speed(Rps)"),
+                        fmt={c: "{:.2f}" for c in numeric_cols},
+                        na_rep="-",
                     )
-                    st.dataframe(styled, use_container_width=True)
 
                 # ===================== MSU =====================
                 elif task_name == "MSU board":
@@ -300,14 +340,12 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    styled = (
-                        df_abn.style
-                        .format({c: "{:.2f}" for c in numeric_cols}, na_rep="-")
-                        .applymap(lambda v: "background-color:#ff9999; color:black"
-                                if isinstance(v, (int, float)) and pd.notna(v) and v > 0 else "",
-                                subset=["Laser Bias Current(mA)"])
+                    render_table(
+                        df_abn,
+                        cells=_positive_cells(df_abn, "Laser Bias Current(mA)"),
+                        fmt={c: "{:.2f}" for c in numeric_cols},
+                        na_rep="-",
                     )
-                    st.dataframe(styled, use_container_width=True)
 
                 # ===================== LINE =====================
                 elif task_name == "Line board":
@@ -324,42 +362,15 @@ class SummaryTableReport:
                     for c in numeric_cols:
                         df_abn[c] = pd.to_numeric(df_abn[c], errors="coerce")
 
-                    def highlight_line_row(row):
-                        styles = [""] * len(row)
-                        col_map = {c: i for i, c in enumerate(df_abn.columns)}
-
-                        try:
-                            ber, thr = row["Instant BER After FEC"], row["Threshold"]
-                            if pd.notna(ber) and pd.notna(thr) and ber > thr:
-                                styles[col_map["Instant BER After FEC"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        try:
-                            v, lo, hi = row["Input Optical Power(dBm)"], row["Minimum threshold(in)"], row["Maximum threshold(in)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Input Optical Power(dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        try:
-                            v, lo, hi = row["Output Optical Power (dBm)"], row["Minimum threshold(out)"], row["Maximum threshold(out)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Output Optical Power (dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        return styles
-
-                    styled = (
-                        df_abn.style
-                        .apply(highlight_line_row, axis=1)
-                        .format({
+                    render_table(
+                        df_abn,
+                        cells=_abnormal_cells(df_abn, _LINE_CELL_RULES),
+                        fmt={
                             "Threshold": "{:.2E}",
                             "Instant BER After FEC": "{:.2E}",
-                        }, na_rep="-")
+                        },
+                        na_rep="-",
                     )
-                    st.dataframe(styled, use_container_width=True)
 
                 # ===================== CLIENT =====================
                 elif task_name == "Client board":
@@ -370,28 +381,11 @@ class SummaryTableReport:
                     ]
                     df_abn = df_abn[[c for c in cols_to_show if c in df_abn.columns]].copy()
 
-                    def highlight_client_row(row):
-                        styles = [""] * len(row)
-                        col_map = {c: i for i, c in enumerate(df_abn.columns)}
-
-                        try:
-                            v, lo, hi = row["Output Optical Power (dBm)"], row["Minimum threshold(out)"], row["Maximum threshold(out)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Output Optical Power (dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        try:
-                            v, lo, hi = row["Input Optical Power(dBm)"], row["Minimum threshold(in)"], row["Maximum threshold(in)"]
-                            if pd.notna(v) and pd.notna(lo) and pd.notna(hi) and (v < lo or v > hi):
-                                styles[col_map["Input Optical Power(dBm)"]] = "background-color:#ff9999; color:black"
-                        except:
-                            pass
-
-                        return styles
+                    render_table(df_abn, cells=_abnormal_cells(df_abn, _CLIENT_CELL_RULES))
 
-                    styled = df_abn.style.apply(highlight_client_row, axis=1)
-                    st.dataframe(styled, use_container_width=True)
+                # ===================== FIBER (Flapping / EOL / Core) =====================
+                else:
+                    render_table(df_abn, na_rep="-")
 
             elif status == "Normal":
                 st.info(f"✅ All {task_name} values are within normal range.")
@@ -0,0 +1,129 @@
+# utils/analysis.py
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from utils.ref_registry import ref_version
+
+
+@dataclass
+class AnalysisResult:
+    """
+    ผลวิเคราะห์แบบ headless (ไม่มี Streamlit) ของ analyzer หนึ่งตัว
+      - df_result:        ตารางหลักหลัง merge กับ reference (เรียงตาม order ของ reference)
+      - masks:            {ชื่อ: bool Series ตาม index ของ df_result} เช่น "abnormal"
+      - df_abnormal:      แถว abnormal ทั้งหมด
+      - abnormal_by_type: abnormal แยกตามชนิด (ใช้ใน Summary / report)
+      - kpis:             ตัวเลขสรุป (จำนวน link, จำนวน abnormal ฯลฯ)
+      - frames:           ตารางประกอบอื่น ๆ ที่ renderer ใช้ (avg, pivot, loss ฯลฯ)
+      - df_unmatched:     แถวในไฟล์ที่ไม่พบใน reference
+    """
+    kind: str
+    df_result: pd.DataFrame = field(default_factory=pd.DataFrame)
+    masks: Dict[str, pd.Series] = field(default_factory=dict)
+    df_abnormal: pd.DataFrame = field(default_factory=pd.DataFrame)
+    abnormal_by_type: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    kpis: Dict[str, Any] = field(default_factory=dict)
+    frames: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    df_unmatched: pd.DataFrame = field(default_factory=pd.DataFrame)
+
+    @property
+    def abn_count(self) -> int:
+        return len(self.df_abnormal)
+
+    @property
+    def status(self) -> str:
+        if self.df_result.empty:
+            return "No data"
+        return "Abnormal" if self.abn_count else "Normal"
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    """
+    fingerprint ของ input ที่ compute() ใช้ (stage load → normalize → merge → evaluate → aggregate)
+      - inputs: token ของข้อมูลใน session (identity ของ object) + (path, mtime) ของ reference
+      - params: พารามิเตอร์ของหน้า (ns, threshold ฯลฯ)
+    object ใน inputs ถูกเก็บไว้ใน _pins (ไม่ใช้เทียบ) → id ไม่ถูกใช้ซ้ำตราบที่ fingerprint ยังอยู่
+    """
+    inputs: Tuple[Any, ...]
+    params: Tuple[Any, ...] = ()
+    _pins: Tuple[Any, ...] = field(default=(), compare=False, repr=False)
+
+
+def fingerprint(inputs: Iterable[Any] = (), refs: Iterable[str] = (), params: Iterable[Any] = ()) -> Fingerprint:
+    """
+    inputs: ข้อมูลจาก st.session_state (DataFrame / log) — object เดิมถือว่าเนื้อเดิม
+            (หน้าแรกแทนที่ด้วย object ใหม่ทุกครั้งที่ Run Analysis, analyzer ทำงานบนสำเนา)
+    refs:   path ของ reference (ไฟล์เปลี่ยน = mtime เปลี่ยน)
+    """
+    pins = tuple(inputs)
+    tokens = tuple(None if x is None else id(x) for x in pins)
+    return Fingerprint(tokens + tuple(ref_version(p) for p in refs), tuple(params), pins)
+
+
+class HeadlessAnalyzer:
+    """
+    แยก analyzer เป็น 2 ชั้น:
+      - compute() → AnalysisResult   (pandas ล้วน เรียกจาก thread/สคริปต์/test ได้)
+      - render(result)               (Streamlit: filter, ตาราง, กราฟ)
+    prepare() = compute อย่างเดียว, process() = compute + render
+    """
+
+    result: Optional[AnalysisResult] = None
+    fingerprint: Optional[Fingerprint] = None  # input ของ result (ตั้งโดย run_cached / หน้า Summary)
+
+    def compute(self) -> AnalysisResult:
+        raise NotImplementedError
+
+    def render(self, result: AnalysisResult, **kwargs) -> None:
+        raise NotImplementedError
+
+    def _store(self, result: AnalysisResult) -> AnalysisResult:
+        # คงชื่อ attribute เดิมไว้ให้ Summary / report อ่านได้เหมือนเดิม
+        self.result = result
+        self.df_abnormal = result.df_abnormal
+        self.df_abnormal_by_type = result.abnormal_by_type
+        self.df_unmatched = result.df_unmatched
+        return result
+
+    def prepare(self) -> pd.DataFrame:
+        """คำนวณอย่างเดียว (ไม่ render UI)"""
+        return self._store(self.compute()).df_result
+
+    def process(self, **kwargs) -> pd.DataFrame:
+        result = self._store(self.compute())
+        self.render(result, **kwargs)
+        return result.df_result
+
+
+def publish(key: str, analyzer: HeadlessAnalyzer) -> None:
+    """เก็บ analyzer + สถานะลง session_state (ฝั่ง UI เท่านั้น)"""
+    import streamlit as st
+
+    result = analyzer.result or AnalysisResult(key)
+    st.session_state[f"{key}_analyzer"] = analyzer
+    st.session_state[f"{key}_status"] = result.status
+    st.session_state[f"{key}_abn_count"] = result.abn_count
+
+
+def run_cached(key: str, fp: Fingerprint, build: Callable[[], HeadlessAnalyzer], **render_kwargs) -> HeadlessAnalyzer:
+    """
+    stage ของหน้า analyzer: input (session data + reference) → compute → render
+      - compute (load/normalize/merge/evaluate/aggregate) ทำใหม่เฉพาะเมื่อ fingerprint เปลี่ยน
+        ไม่เปลี่ยน → ใช้ analyzer + result เดิมใน session (ไม่ copy / อ่าน reference / merge ซ้ำ)
+      - render (filter → ตาราง → กราฟ) ทำทุก rerun; result เป็น object เดิม →
+        cascading_filter ใช้ code ต่อคอลัมน์ที่ cache ไว้และคำนวณเฉพาะชั้นใต้ widget ที่เปลี่ยน
+    build() ถูกเรียกเฉพาะตอนต้อง compute ใหม่ (สร้าง analyzer จากสำเนาของข้อมูล)
+    """
+    import streamlit as st
+
+    analyzer = st.session_state.get(f"{key}_analyzer")
+    if analyzer is None or analyzer.result is None or analyzer.fingerprint != fp:
+        analyzer = build()
+        analyzer.prepare()
+        analyzer.fingerprint = fp
+    publish(key, analyzer)
+    analyzer.render(analyzer.result, **render_kwargs)
+    return analyzer
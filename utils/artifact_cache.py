@@ -0,0 +1,243 @@
+# utils/artifact_cache.py
+import os
+import hashlib
+import tempfile
+import pandas as pd
+
+from utils.log_source import LogSource
+
+# pyarrow ใช้สำหรับเขียน/อ่าน Parquet — ถ้าไม่มีจะปิด cache ของ DataFrame ไปเฉย ๆ
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    _HAS_PARQUET = True
+except ImportError:
+    _HAS_PARQUET = False
+
+# คอลัมน์ที่มีหลายชนิดปนกัน (เช่น BER ที่มีทั้ง 0, 1.2E-4 และ "--") เก็บเป็น string + tag ชนิด
+_TAG_PREFIX = "__type__::"
+_META_KEY = b"artifact_cache.mixed"
+
+
+DEFAULT_CACHE_DIR = os.environ.get("PARSED_CACHE_DIR", os.path.join(".cache", "parsed"))
+DEFAULT_MAX_BYTES = int(float(os.environ.get("PARSED_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+
+def zip_digest(zip_file) -> str:
+    """sha256 ของเนื้อไฟล์ ZIP (รับ path / bytes / BytesIO / file-like ที่ seek ได้)"""
+    h = hashlib.sha256()
+    if isinstance(zip_file, (bytes, bytearray, memoryview)):
+        h.update(zip_file)
+        return h.hexdigest()
+
+    if isinstance(zip_file, (str, os.PathLike)):
+        with open(zip_file, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return h.hexdigest()
+
+    if hasattr(zip_file, "getbuffer"):
+        h.update(zip_file.getbuffer())
+        return h.hexdigest()
+
+    pos = zip_file.tell()
+    zip_file.seek(0)
+    for chunk in iter(lambda: zip_file.read(1024 * 1024), b""):
+        h.update(chunk)
+    zip_file.seek(pos)
+    return h.hexdigest()
+
+
+def _tag_of(v) -> str:
+    if v is None:
+        return "n"
+    if isinstance(v, bool):
+        return "b"
+    if isinstance(v, int):
+        return "i"
+    if isinstance(v, float):
+        return "f"
+    if isinstance(v, str):
+        return "s"
+    if isinstance(v, pd.Timestamp):
+        return "t"
+    raise TypeError(f"unsupported cell type: {type(v).__name__}")
+
+
+_DECODERS = {
+    "n": lambda s: None,
+    "b": lambda s: s == "True",
+    "i": int,
+    "f": float,
+    "s": lambda s: s,
+    "t": pd.Timestamp,
+}
+
+
+def _encode_mixed(df: pd.DataFrame) -> tuple[pd.DataFrame, list[str]]:
+    """แปลงคอลัมน์ object ที่ Arrow แปลงตรง ๆ ไม่ได้ ให้เป็น (string, tag) แบบ lossless"""
+    out = df
+    mixed = []
+    for c in df.columns:
+        if df[c].dtype != object:
+            continue
+        try:
+            pa.array(df[c], from_pandas=True)
+            continue
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        if out is df:
+            out = df.copy()
+        vals = df[c].tolist()
+        out[_TAG_PREFIX + c] = [_tag_of(v) for v in vals]
+        out[c] = [v.isoformat() if isinstance(v, pd.Timestamp) else str(v) for v in vals]
+        mixed.append(c)
+    return out, mixed
+
+
+def _decode_mixed(df: pd.DataFrame, mixed: list[str]) -> pd.DataFrame:
+    for c in mixed:
+        tags = df.pop(_TAG_PREFIX + c).tolist()
+        df[c] = pd.Series(
+            [_DECODERS[t](v) for t, v in zip(tags, df[c].tolist())],
+            index=df.index, dtype=object,
+        )
+    return df
+
+
+class ArtifactCache:
+    """
+    Cache บนดิสก์สำหรับผลการ parse ไฟล์ในZIP:
+      - key = hash ของ ZIP + ชื่อ member (รวม path ของ ZIP ซ้อน)
+      - DataFrame เก็บเป็น Parquet, log (.txt) เก็บเป็นไฟล์ข้อความ utf-8
+      - จำกัดขนาดรวมด้วย LRU (ใช้ mtime เป็นเวลาใช้งานล่าสุด)
+
+    วิธีใช้:
+        cache = ArtifactCache()
+        obj = cache.get(digest, member)
+        if obj is None:
+            obj = parse(...)
+            cache.put(digest, member, obj)
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ---------- Utilities ----------
+    @staticmethod
+    def _entry_key(digest: str, member: str) -> str:
+        return hashlib.sha256(f"{digest}::{member}".encode("utf-8")).hexdigest()
+
+    def _path(self, digest: str, member: str, suffix: str) -> str:
+        return os.path.join(self.cache_dir, self._entry_key(digest, member) + suffix)
+
+    def _entries(self) -> list:
+        out = []
+        for e in os.scandir(self.cache_dir):
+            if e.is_file() and e.name.endswith((".parquet", ".txt")):
+                try:
+                    st_ = e.stat()
+                except FileNotFoundError:
+                    continue  # ถูก process อื่นลบไประหว่างทาง
+                out.append((st_.st_mtime, st_.st_size, e.path))
+        return out
+
+    def _evict(self) -> None:
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        # ลบตัวที่ไม่ได้ใช้นานที่สุดก่อน
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def _atomic_write(self, path: str, writer) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            writer(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @staticmethod
+    def _write_parquet(df: pd.DataFrame, path: str) -> None:
+        df_enc, mixed = _encode_mixed(df)
+        table = pa.Table.from_pandas(df_enc, preserve_index=True)
+        meta = dict(table.schema.metadata or {})
+        meta[_META_KEY] = "\x1f".join(mixed).encode("utf-8")
+        pq.write_table(table.replace_schema_metadata(meta), path)
+
+    @staticmethod
+    def _read_parquet(path: str) -> pd.DataFrame:
+        table = pq.read_table(path)
+        raw = (table.schema.metadata or {}).get(_META_KEY, b"")
+        mixed = [c for c in raw.decode("utf-8").split("\x1f") if c]
+        return _decode_mixed(table.to_pandas(), mixed)
+
+    # ---------- MAIN ----------
+    def get(self, digest: str, member: str):
+        """คืน DataFrame / LogSource (หรือ str สำหรับ cache เก่า) ที่ cache ไว้ หรือ None ถ้าไม่มี"""
+        for suffix in (".parquet", ".txt"):
+            path = self._path(digest, member, suffix)
+            if not os.path.exists(path):
+                continue
+            try:
+                if suffix == ".parquet":
+                    obj = self._read_parquet(path) if _HAS_PARQUET else None
+                else:
+                    obj = LogSource.from_path(path)  # mmap ตรงจากไฟล์ cache (ไม่อ่านทั้งไฟล์เข้า RAM)
+            except Exception:
+                # ไฟล์เสีย → ทิ้งแล้วให้ parse ใหม่
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                return None
+            if obj is not None:
+                os.utime(path)  # touch = ใช้งานล่าสุด (LRU)
+            return obj
+        return None
+
+    def put(self, digest: str, member: str, obj) -> bool:
+        """บันทึกผล parse ลง cache (best-effort: เขียนไม่ได้ก็คืน False)"""
+        try:
+            if isinstance(obj, pd.DataFrame):
+                if not _HAS_PARQUET:
+                    return False
+                path = self._path(digest, member, ".parquet")
+                self._atomic_write(path, lambda p: self._write_parquet(obj, p))
+            elif isinstance(obj, LogSource):
+                path = self._path(digest, member, ".txt")
+                self._atomic_write(path, obj.save)
+            elif isinstance(obj, str):
+                path = self._path(digest, member, ".txt")
+
+                def _write_text(p):
+                    with open(p, "w", encoding="utf-8", newline="") as f:
+                        f.write(obj)
+                self._atomic_write(path, _write_text)
+            else:
+                return False
+        except Exception:
+            # เช่น cell ชนิดที่ encode ไม่ได้ หรือดิสก์เต็ม → ข้ามการ cache ไป
+            return False
+
+        self._evict()
+        return True
+
+    def clear(self) -> None:
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,105 @@
+# utils/export_bundle.py
+import io
+import json
+import zipfile
+from datetime import datetime
+from typing import IO, Dict, Iterator, Optional, Tuple
+
+import pandas as pd
+
+from utils.analysis import AnalysisResult
+
+# pyarrow ใช้สำหรับเขียน Parquet — ถ้าไม่มีจะเหลือแค่ CSV
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    _HAS_PARQUET = True
+except ImportError:
+    _HAS_PARQUET = False
+
+FORMATS = ("parquet", "csv") if _HAS_PARQUET else ("csv",)
+_CSV_CHUNK_ROWS = 50_000
+
+
+# ---------- frame ต่อ section ----------
+def _slug(name: str) -> str:
+    return "".join(ch if ch.isalnum() else "_" for ch in str(name)).strip("_") or "table"
+
+
+def result_frames(result: AnalysisResult) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """(ชื่อไฟล์ไม่มีนามสกุล, frame) ของผลวิเคราะห์หนึ่งตัว: ผลเต็ม, abnormal ทั้งหมด/แยกชนิด, แถวที่ไม่พบใน reference"""
+    yield "result", result.df_result
+    yield "abnormal", result.df_abnormal
+    for subtype, df in result.abnormal_by_type.items():
+        if isinstance(df, pd.DataFrame) and not df.empty:
+            yield f"abnormal_{_slug(subtype)}", df
+    if not result.df_unmatched.empty:
+        yield "unmatched", result.df_unmatched
+
+
+# ---------- writer ----------
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    """ชื่อคอลัมน์เป็น str + คอลัมน์ object ที่ Arrow แปลงตรง ๆ ไม่ได้ (ชนิดปนกัน) เก็บเป็น string"""
+    out = df
+    if not all(isinstance(c, str) for c in df.columns):
+        out = df.rename(columns=str)
+    for c in out.columns:
+        if out[c].dtype != object:
+            continue
+        try:
+            pa.array(out[c], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            if out is df:
+                out = df.copy(deep=False)
+            out[c] = out[c].astype("string")
+    return out
+
+
+def write_frame(df: pd.DataFrame, stream: IO[bytes], fmt: str) -> None:
+    """เขียน frame ลง stream (binary) ทีละส่วน — ไม่สร้างข้อความทั้งไฟล์ใน memory"""
+    if fmt == "parquet":
+        table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+        pq.write_table(table, stream)
+        return
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="", write_through=True)
+    try:
+        df.to_csv(text, index=False, chunksize=_CSV_CHUNK_ROWS)
+        text.flush()
+    finally:
+        text.detach()  # ไม่ปิด stream ของ zip entry แทนผู้เรียก
+
+
+def write_bundle(
+    results: Dict[str, Optional[AnalysisResult]],
+    fileobj: IO[bytes],
+    fmt: str = "parquet",
+) -> dict:
+    """
+    เขียนผลของทุก analyzer ลง ZIP เดียว: <key>/<ชื่อ>.<fmt> ทีละ frame (stream ตรงเข้า entry ของ zip)
+    + manifest.json (สถานะ, จำนวนแถว, ไฟล์ของแต่ละ section) — คืน manifest
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}' (available: {', '.join(FORMATS)})")
+
+    manifest = {"generated_at": datetime.now().isoformat(timespec="seconds"), "format": fmt, "sections": {}}
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for key, result in results.items():
+            if result is None:
+                manifest["sections"][key] = {"status": "No data", "files": {}}
+                continue
+            files = {}
+            for name, df in result_frames(result):
+                path = f"{key}/{name}.{fmt}"
+                with zf.open(path, "w", force_zip64=True) as entry:
+                    write_frame(df, entry, fmt)
+                files[name] = {"path": path, "rows": len(df), "columns": [str(c) for c in df.columns]}
+            manifest["sections"][key] = {"status": result.status, "abn_count": result.abn_count, "files": files}
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2, default=str))
+    return manifest
+
+
+def bundle_bytes(results: Dict[str, Optional[AnalysisResult]], fmt: str = "parquet") -> bytes:
+    """ZIP ทั้งก้อนเป็น bytes (สำหรับ st.download_button)"""
+    buf = io.BytesIO()
+    write_bundle(results, buf, fmt)
+    return buf.getvalue()
@@ -1,7 +1,69 @@
 # utils/filters.py
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
 import streamlit as st
 import pandas as pd
-from typing import Dict, List, Tuple
+
+
+# ---------- codes ต่อคอลัมน์ (คำนวณครั้งเดียวต่อ frame) ----------
+class _ColumnCodes:
+    """
+    ค่าในคอลัมน์ (เทียบแบบ str เหมือนเดิม) → code จำนวนเต็มเรียงตามลำดับตัวอักษร, ค่าว่าง = -1
+      - options ของชั้น = labels ของ code ที่ bincount > 0 ในแถวที่ผ่าน mask (เรียงอยู่แล้ว)
+      - mask ของชั้น = isin บน code (ไม่ต้องแปลงทั้งคอลัมน์เป็น str ซ้ำ)
+    """
+
+    __slots__ = ("codes", "labels", "_lookup")
+
+    def __init__(self, s: pd.Series):
+        notna = s.notna().to_numpy()
+        codes, uniques = pd.factorize(s[notna].astype(str), sort=True)
+        self.codes = np.full(len(s), -1, dtype=np.int32)
+        self.codes[notna] = codes
+        self.labels: List[str] = uniques.tolist()
+        self._lookup: Dict[str, int] | None = None
+
+    def options(self, mask: np.ndarray) -> List[str]:
+        c = self.codes[mask]
+        counts = np.bincount(c[c >= 0], minlength=len(self.labels))
+        return [self.labels[i] for i in np.flatnonzero(counts)]
+
+    def isin(self, values: List[str]) -> np.ndarray:
+        if self._lookup is None:  # สร้างเมื่อมีการเลือกค่าในชั้นนี้ครั้งแรก
+            self._lookup = {v: i for i, v in enumerate(self.labels)}
+        return np.isin(self.codes, [self._lookup[v] for v in values if v in self._lookup])
+
+
+# cache ตาม identity ของ frame (result.df_result เดิมทุก rerun → ไม่แปลงคอลัมน์ซ้ำ)
+# token ไม่ซ้ำต่อ frame: id() ของ frame ที่ถูกเก็บกวาดแล้วอาจถูกใช้ซ้ำ จึงไม่ใช้ id เป็น key ของ session
+_CODES_CACHE_MAX = 8
+_codes_cache: "OrderedDict[int, Tuple[weakref.ref, int, int, Dict[str, _ColumnCodes]]]" = OrderedDict()
+_tokens = itertools.count()
+_cache_lock = threading.Lock()
+
+
+def _frame_codes(df: pd.DataFrame, cols: List[str]) -> Tuple[int, Dict[str, _ColumnCodes]]:
+    """(token ของ frame, {คอลัมน์: _ColumnCodes}) — frame เดิม (object เดิม, ไม่ถูกแก้ในที่) สร้างครั้งเดียว"""
+    with _cache_lock:
+        hit = _codes_cache.get(id(df))
+        if hit is not None and hit[0]() is df and hit[1] == len(df):
+            _codes_cache.move_to_end(id(df))
+            token, codes = hit[2], hit[3]
+        else:
+            token, codes = next(_tokens), {}
+            _codes_cache[id(df)] = (weakref.ref(df), len(df), token, codes)
+            while len(_codes_cache) > _CODES_CACHE_MAX:
+                _codes_cache.popitem(last=False)
+    for c in cols:
+        if c not in codes:
+            codes[c] = _ColumnCodes(df[c])
+    return token, codes
+
 
 def cascading_filter(
     df: pd.DataFrame,
@@ -14,6 +76,9 @@ def cascading_filter(
     """
     ฟิลเตอร์แบบไล่ชั้น (cascading): สร้าง multiselect ต่อเนื่องทีละคอลัมน์
     คืนค่า: (DataFrame ที่ถูกกรองแล้ว, selections dict)
+
+    ค่าในคอลัมน์แปลงเป็น code ครั้งเดียวต่อ frame (cache); options/mask ของแต่ละชั้นเก็บไว้ใน
+    session_state → rerun คำนวณใหม่เฉพาะชั้นที่อยู่ใต้ widget ที่เปลี่ยน
     """
 
     if labels is None:
@@ -28,24 +93,46 @@ def cascading_filter(
     if not active_cols:
         return df.reset_index(drop=True), {}
 
+    token, codes = _frame_codes(df, active_cols)
+    key = (token, tuple(active_cols))
+
+    # ชั้นที่ยังใช้ผลเดิมได้: frame เดิม + selection ของชั้นก่อนหน้าไม่เปลี่ยน
+    prev = st.session_state.get(f"{ns}__levels")
+    if prev is None or prev["key"] != key:
+        prev = {"key": key, "sels": [], "opts": [], "masks": []}
+    keep = 0
+    for c, sel in zip(active_cols, prev["sels"]):
+        if st.session_state[f"{ns}_f_{c}"] != sel:
+            break
+        keep += 1
+    # ชั้นที่ keep เปลี่ยน → options ของชั้นนั้นยังเหมือนเดิม (ขึ้นกับชั้นก่อนหน้าเท่านั้น)
+    n_opts = min(keep + 1, len(prev["opts"]))
+
     # สร้าง options ทีละชั้นด้วย mask สะสม
-    masks = [pd.Series(True, index=df.index)]
-    options_per_col = []
-    for i, c in enumerate(active_cols):
+    masks = prev["masks"][:keep + 1] or [np.ones(len(df), dtype=bool)]
+    options_per_col = prev["opts"][:n_opts]
+    sels = prev["sels"][:keep]
+    for i in range(keep, len(active_cols)):
+        c = active_cols[i]
         m = masks[-1]
-        opts = sorted(df.loc[m, c].dropna().astype(str).unique())
-        options_per_col.append(opts)
+        if i >= len(options_per_col):
+            options_per_col.append(codes[c].options(m))
+        opts = options_per_col[i]
 
         # prune ค่าเลือกที่ไม่อยู่ใน opts (กัน selection ค้าง)
-        valid_sel = [x for x in st.session_state[f"{ns}_f_{c}"] if x in opts]
+        opt_set = set(opts)
+        valid_sel = [x for x in st.session_state[f"{ns}_f_{c}"] if x in opt_set]
         st.session_state[f"{ns}_f_{c}"] = valid_sel
+        sels.append(valid_sel)
 
         # อัปเดต mask สำหรับคอลัมน์ถัดไป
         if valid_sel:
-            masks.append(m & df[c].astype(str).isin(valid_sel))
+            masks.append(m & codes[c].isin(valid_sel))
         else:
             masks.append(m)
 
+    st.session_state[f"{ns}__levels"] = {"key": key, "sels": sels, "opts": options_per_col, "masks": masks}
+
     # วาด widgets เป็นแถวเดียว + ปุ่ม Clear
     cols_widgets = st.columns([1] * len(active_cols) + [0.8])
     for i, c in enumerate(active_cols):
@@ -63,13 +150,6 @@ def cascading_filter(
     with cols_widgets[-1]:
         st.button(clear_text, on_click=_clear)
 
-    # สร้าง final mask จาก selections ทั้งหมด
-    final_mask = pd.Series(True, index=df.index)
-    selections: Dict[str, List[str]] = {}
-    for c in active_cols:
-        sel = st.session_state.get(f"{ns}_f_{c}", [])
-        selections[c] = sel
-        if sel:
-            final_mask &= df[c].astype(str).isin(sel)
-
-    return df[final_mask].reset_index(drop=True), selections
+    # final mask = mask สะสมของชั้นสุดท้าย (selection ทุกชั้นผ่านการ prune แล้ว)
+    selections: Dict[str, List[str]] = {c: st.session_state.get(f"{ns}_f_{c}", []) for c in active_cols}
+    return df[masks[-1]].reset_index(drop=True), selections
@@ -0,0 +1,79 @@
+# utils/interval_join.py
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def _as_ns(s: pd.Series) -> np.ndarray:
+    return pd.to_datetime(s, errors="coerce").to_numpy(dtype="datetime64[ns]")
+
+
+class AlarmIntervalIndex:
+    """
+    index ของ alarm (FM) สำหรับหา "มี alarm ของ link นี้ทับช่วงเวลานี้ไหม" แบบทั้งก้อน
+    เงื่อนไขเหมือนของเดิมทุกประการ:
+      - ข้อความ link ต้อง contains ทั้ง ME และ Target ME (substring ตรงตัว)
+      - ช่วงเวลา overlap: Occurrence <= End และ Clear >= Begin (NaT ไม่ match)
+
+    วิธีทำ:
+      - แปลงคอลัมน์ link เป็น str ครั้งเดียว, ผล contains ต่อ token cache ไว้ (ไม่ scan ซ้ำต่อแถว)
+      - alarm ของแต่ละคู่ (ME, Target ME) เรียงตาม Occurrence + running max ของ Clear
+      - ต่อแถว: searchsorted(End) → alarm ที่เริ่มก่อน End ทั้งหมด แล้วเทียบ max(Clear) กับ Begin
+
+    วิธีใช้:
+        idx = AlarmIntervalIndex(df_fm, "Link")
+        matched = idx.overlaps(me, target_me, begin, end)   # bool array ยาวเท่า input
+    """
+
+    def __init__(
+        self,
+        df_fm: pd.DataFrame,
+        link_col: str,
+        start_col: str = "Occurrence Time",
+        end_col: str = "Clear Time",
+    ):
+        occ = _as_ns(df_fm[start_col])
+        clr = _as_ns(df_fm[end_col])
+        valid = ~(np.isnat(occ) | np.isnat(clr))  # alarm ที่ไม่มีเวลา ไม่มีวัน match
+
+        self.links = df_fm[link_col].astype(str)[valid].reset_index(drop=True)
+        self.occ = occ[valid]
+        self.clr = clr[valid]
+        self._hits: Dict[str, np.ndarray] = {}
+        self._pairs: Dict[Tuple[str, str], Tuple[np.ndarray, np.ndarray]] = {}
+
+    def _contains(self, token: str) -> np.ndarray:
+        hit = self._hits.get(token)
+        if hit is None:
+            hit = self.links.str.contains(token, regex=False).to_numpy(dtype=bool)
+            self._hits[token] = hit
+        return hit
+
+    def _intervals(self, me: str, target: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(Occurrence เรียงจากน้อยไปมาก, running max ของ Clear) ของ alarm ที่ตรงกับคู่นี้"""
+        key = (me, target)
+        if key not in self._pairs:
+            sel = self._contains(me) & self._contains(target)
+            occ, clr = self.occ[sel], self.clr[sel]
+            order = np.argsort(occ, kind="stable")
+            self._pairs[key] = (occ[order], np.maximum.accumulate(clr[order]) if len(order) else clr)
+        return self._pairs[key]
+
+    def overlaps(self, me: pd.Series, target: pd.Series, begin: pd.Series, end: pd.Series) -> np.ndarray:
+        """bool ต่อแถว: มี alarm ของ (me, target) ที่ทับช่วง [begin, end] อย่างน้อย 1 ตัว"""
+        begin, end = _as_ns(begin), _as_ns(end)
+        out = np.zeros(len(begin), dtype=bool)
+        timed = ~(np.isnat(begin) | np.isnat(end))
+
+        pairs = pd.DataFrame({"me": np.asarray(me, dtype=object), "target": np.asarray(target, dtype=object)})
+        for (m, t), rows in pairs[timed].groupby(["me", "target"], sort=False).indices.items():
+            occ, clr_max = self._intervals(m, t)
+            if not len(occ):
+                continue
+            rows = np.flatnonzero(timed)[rows]
+            n_started = np.searchsorted(occ, end[rows], side="right")  # alarm ที่ Occurrence <= End
+            started = n_started > 0
+            rows = rows[started]
+            out[rows] = clr_max[n_started[started] - 1] >= begin[rows]
+        return out
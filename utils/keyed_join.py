@@ -0,0 +1,89 @@
+# utils/keyed_join.py
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+def mapping_key(df: pd.DataFrame, me_col: str = "ME", mobj_col: str = "Measure Object") -> pd.Series:
+    """key ฝั่งไฟล์ดิบ (ME + Measure Object) ให้ตรงกับคอลัมน์ Mapping ของ reference"""
+    return df[me_col].astype(str).str.strip() + df[mobj_col].astype(str).str.strip()
+
+
+class RefKeyIndex:
+    """
+    index ของ key ใน reference → ตำแหน่งแถว
+    สร้างครั้งเดียวต่อไฟล์ reference (ต่อ mtime) ที่ utils.ref_registry.get_ref_index แล้วใช้ซ้ำทุกรอบ compute
+    ใช้แทน pd.merge(how="inner") ระหว่างไฟล์ดิบกับ reference:
+      - lookup เป็น integer code ทั้งก้อน (-1 = ไม่พบใน reference)
+      - แถวที่ไม่ match ถูกเก็บแยกไว้ให้ตรวจ แทนที่จะหายไปเงียบ ๆ
+    ถ้า key ใน reference ซ้ำ จะ fallback เป็น pd.merge (ผลเหมือนเดิมทุกกรณี)
+
+    ตำแหน่งใน index อ้างอิงแถวของ reference ที่ใช้สร้าง → df_ref ที่ส่งให้ join() ต้องเป็น view ของการโหลดเดียวกัน
+    for_ref() เทียบ version (df_ref.attrs["ref_version"] จาก registry) ถ้าไม่ตรง (ไฟล์ถูกโหลดใหม่ระหว่างทาง
+    หรือ df_ref ไม่ได้มาจาก registry) จะสร้าง index ใหม่จาก df_ref
+
+    วิธีใช้:
+        idx = RefKeyIndex.for_ref(df_ref, get_ref_index("data/CPU.xlsx"))
+        df_merged, df_unmatched = idx.join(df_raw, "Mapping Format", df_ref, ["Mapping", "Site Name", "order"])
+    """
+
+    def __init__(self, keys: Union[pd.Series, pd.Index], key: str = "Mapping", version: Optional[tuple] = None):
+        self.key = key
+        self.version = version  # version ของ reference ที่ใช้สร้าง (None = ไม่ผูกกับการโหลดใด)
+        self.index = pd.Index(keys)
+        self.unique = self.index.is_unique
+        # key ซ้ำ: get_indexer ใช้กับ index ที่ไม่ unique ไม่ได้ → ใช้ key ที่ไม่ซ้ำไว้แยกแถว match / unmatched
+        self._lookup_index = self.index if self.unique else self.index.unique()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @classmethod
+    def for_ref(cls, df_ref: pd.DataFrame, ref_index: Optional["RefKeyIndex"] = None, key: str = "Mapping") -> "RefKeyIndex":
+        """index ที่ precompute ไว้ (ถ้าใช้กับ df_ref นี้ได้) ไม่งั้นสร้างจาก df_ref"""
+        if (
+            ref_index is not None and ref_index.key == key and ref_index.version is not None
+            and ref_index.version == df_ref.attrs.get("ref_version")
+        ):
+            return ref_index
+        return cls(df_ref[key], key)
+
+    def lookup(self, keys: pd.Series) -> np.ndarray:
+        """ตำแหน่งใน reference (-1 = ไม่พบ); ถ้า key ซ้ำ ตำแหน่งอ้าง key ที่ไม่ซ้ำ ใช้ได้แค่เช็คว่าพบหรือไม่"""
+        return self._lookup_index.get_indexer(keys)
+
+    def join(
+        self,
+        df_raw: pd.DataFrame,
+        left_on: str,
+        df_ref: pd.DataFrame,
+        ref_cols: Sequence[str],
+        suffixes: Tuple[str, str] = ("_x", "_y"),
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """คืน (merged, unmatched) — merged มีคอลัมน์/ลำดับแถวเหมือน pd.merge(how="inner")"""
+        ref_cols = list(ref_cols)
+        if not self.unique:
+            # key ซ้ำ → merge แบบเดิม (แถวดิบหนึ่งแถวได้หลายแถว), lookup ใช้แยก unmatched
+            hit = self.lookup(df_raw[left_on]) >= 0
+            df_merged = pd.merge(
+                df_raw, df_ref[ref_cols],
+                left_on=left_on, right_on=self.key, how="inner", suffixes=suffixes,
+            )
+            return df_merged, df_raw.loc[~hit]
+
+        codes = self.lookup(df_raw[left_on])
+        hit = codes >= 0
+        df_unmatched = df_raw.loc[~hit]
+
+        left = df_raw.loc[hit].reset_index(drop=True)
+        right = df_ref[ref_cols].take(codes[hit]).reset_index(drop=True)
+
+        if left_on == self.key:
+            right = right.drop(columns=[self.key], errors="ignore")  # pd.merge เก็บ key ไว้คอลัมน์เดียว
+        # ชื่อซ้ำสองฝั่ง → เติม suffix แบบเดียวกับ pd.merge
+        overlap: List[str] = [c for c in right.columns if c in left.columns]
+        if overlap:
+            left = left.rename(columns={c: c + suffixes[0] for c in overlap})
+            right = right.rename(columns={c: c + suffixes[1] for c in overlap})
+        return pd.concat([left, right], axis=1), df_unmatched
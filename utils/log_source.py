@@ -0,0 +1,153 @@
+# utils/log_source.py
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import weakref
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# log ที่ใหญ่กว่านี้ spill ลงไฟล์ชั่วคราวแล้ว mmap (เล็กกว่านี้เก็บเป็น bytes ใน RAM)
+LOG_SPILL_BYTES = int(os.environ.get("LOG_SPILL_BYTES", 8 * 1024 * 1024))
+_COPY_CHUNK = 1024 * 1024
+_EOL_RE = re.compile(rb"\r\n|\r|\n")
+_STR_EOL_RE = re.compile(r"\r\n|\r|\n")
+# ตัวที่ str.splitlines ตัดบรรทัดให้ แต่ LogSource ไม่ตัด (\f \v \x1c-\x1e \x85 \u2028 \u2029)
+_EXTRA_LINE_BREAKS = "\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_ENCODING = "utf-8"
+
+
+def _release(mm: Optional[mmap.mmap], path: Optional[str]) -> None:
+    if mm is not None:
+        try:
+            mm.close()
+        except (BufferError, ValueError):
+            pass
+    if path:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def split_lines(text: str) -> list:
+    """
+    แยกบรรทัดด้วยกฎเดียวกับ LogSource.iter_lines (\\r\\n, \\r, \\n เท่านั้น) → log ที่โหลดเป็น str หรือ LogSource
+    ได้เลขบรรทัดตรงกัน; ไม่มีตัวตัดบรรทัดพิเศษใช้ str.splitlines (เร็วกว่า, ผลเหมือนกัน)
+    """
+    if not any(ch in text for ch in _EXTRA_LINE_BREAKS):
+        return text.splitlines()
+    lines = _STR_EOL_RE.split(text)
+    if lines and lines[-1] == "":
+        lines.pop()  # บรรทัดว่างหลัง newline สุดท้าย (เหมือน splitlines / iter_lines)
+    return lines
+
+
+class LogSource:
+    """
+    เนื้อ log (WASON / MobaXterm) แบบไม่ต้อง decode ทั้งไฟล์เป็น str ก้อนเดียว
+      - ไฟล์เล็กเก็บเป็น bytes, ไฟล์ใหญ่ spill ลง temp file แล้ว mmap
+      - iter_lines(): (byte offset, บรรทัด) ทีละบรรทัด (ตัดที่ \\r\\n, \\r, \\n เหมือน universal newlines)
+      - line_at(offset) / read(start, end): ดึงเฉพาะช่วงที่จะแสดง
+    ส่งข้าม process ได้ (pickle): แบบ mmap จะส่งแค่ path และโอนสิทธิ์ลบไฟล์ให้ฝั่งที่รับ
+    """
+
+    def __init__(self, data: bytes = b"", path: Optional[str] = None, owned: bool = False):
+        self._path = path
+        self._owned = owned and path is not None
+        self._mm: Optional[mmap.mmap] = None
+        if path is not None:
+            self.size = os.path.getsize(path)
+            if self.size:
+                with open(path, "rb") as f:
+                    self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buf = self._mm if self._mm is not None else b""
+        else:
+            self._buf = bytes(data)
+            self.size = len(self._buf)
+        self._finalizer = weakref.finalize(self, _release, self._mm, self._path if self._owned else None)
+        # ผลที่คำนวณจาก log นี้ (เช่น WasonLogIndex) — อายุเท่ากับ object นี้, ไม่ pickle ไปด้วย
+        self.derived: Dict[str, Any] = {}
+
+    # ---------- สร้าง ----------
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LogSource":
+        return cls(data=data)
+
+    @classmethod
+    def from_path(cls, path: str) -> "LogSource":
+        """mmap ไฟล์ที่มีอยู่แล้ว (ไม่ลบไฟล์ตอนปิด)"""
+        return cls(path=path)
+
+    @classmethod
+    def from_stream(cls, f, spill_bytes: int = LOG_SPILL_BYTES) -> "LogSource":
+        """อ่านจาก file-like: เกิน spill_bytes ค่อย ๆ คัดลอกลง temp file แล้ว mmap"""
+        head = f.read(spill_bytes + 1)
+        if len(head) <= spill_bytes:
+            return cls(data=head)
+        fd, path = tempfile.mkstemp(suffix=".log")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(head)
+                shutil.copyfileobj(f, out, _COPY_CHUNK)
+            return cls(path=path, owned=True)
+        except BaseException:
+            _release(None, path)
+            raise
+
+    def close(self) -> None:
+        self._finalizer()
+        self._buf = b""
+        self.derived.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- pickle (ส่งกลับจาก worker process) ----------
+    def __getstate__(self):
+        if self._mm is None:
+            return {"data": bytes(self._buf)}
+        state = {"path": self._path, "owned": self._owned}
+        if self._owned:
+            # โอนสิทธิ์ลบไฟล์ให้ object ฝั่งที่ unpickle (ฝั่งนี้แค่ปิด mmap)
+            self._finalizer.detach()
+            self._owned = False
+            self._finalizer = weakref.finalize(self, _release, self._mm, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(data=state.get("data", b""), path=state.get("path"), owned=state.get("owned", False))
+
+    # ---------- อ่าน ----------
+    def __bool__(self) -> bool:
+        return self.size > 0
+
+    def read(self, start: int = 0, end: Optional[int] = None) -> str:
+        """ข้อความช่วง byte [start, end)"""
+        return self._buf[start:end].decode(_ENCODING, errors="ignore")
+
+    def text(self) -> str:
+        """ทั้งไฟล์เป็น str (สำหรับโค้ดที่ยังต้องการ string ก้อนเดียว)"""
+        return self.read()
+
+    def save(self, path: str) -> None:
+        """เขียน bytes ทั้งหมดลงไฟล์ (เช่น artifact cache)"""
+        with open(path, "wb") as f:
+            for start in range(0, self.size, _COPY_CHUNK):
+                f.write(self._buf[start:start + _COPY_CHUNK])
+
+    def line_at(self, offset: int) -> str:
+        m = _EOL_RE.search(self._buf, offset)
+        return self.read(offset, m.start() if m else self.size)
+
+    def iter_lines(self) -> Iterator[Tuple[int, str]]:
+        """(offset, บรรทัด) ทีละบรรทัด; บรรทัดว่างท้ายไฟล์หลัง newline สุดท้ายไม่นับ (เหมือน str.splitlines)"""
+        buf, pos = self._buf, 0
+        for m in _EOL_RE.finditer(buf):
+            yield pos, buf[pos:m.start()].decode(_ENCODING, errors="ignore")
+            pos = m.end()
+        if pos < self.size:
+            yield pos, buf[pos:].decode(_ENCODING, errors="ignore")
@@ -0,0 +1,134 @@
+# utils/ref_registry.py
+import itertools
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from utils.keyed_join import RefKeyIndex
+from utils.xlsx_reader import read_xlsx
+
+
+# ไฟล์ reference ของแต่ละ analyzer
+REF_FILES = {
+    "cpu": "data/CPU.xlsx",
+    "fan": "data/FAN.xlsx",
+    "msu": "data/MSU.xlsx",
+    "line": "data/Line.xlsx",
+    "client": "data/Client.xlsx",
+    "eol": "data/EOL.xlsx",
+}
+
+
+def _copy_on_write() -> bool:
+    # pandas 3 เปิด Copy-on-Write เสมอ, pandas 2.x เปิดได้ผ่าน option
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    try:
+        return pd.get_option("mode.copy_on_write") is True
+    except Exception:
+        return False
+
+
+_COW = _copy_on_write()
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    # เหมือน _normalize_columns ของ analyzer
+    df.columns = (
+        df.columns.astype(str)
+        .str.strip()
+        .str.replace(r"\s+", " ", regex=True)
+        .str.replace("\u00a0", " ")
+    )
+    return df
+
+
+def prepare_ref(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    เตรียม reference ให้พร้อม merge: normalize ชื่อคอลัมน์, strip Mapping, ใส่ order ตามลำดับในไฟล์
+    เรียกซ้ำได้ (ถ้ามี order แล้วจะไม่ทำซ้ำ)
+    """
+    if "order" in df.columns:
+        return df
+    df = normalize_columns(df.copy(deep=False))
+    if "Mapping" in df.columns:
+        df["Mapping"] = df["Mapping"].astype(str).str.strip()
+    df["order"] = range(len(df))
+    return df
+
+
+class RefRegistry:
+    """
+    โหลด reference workbook ครั้งเดียวต่อ process แล้วเก็บไว้ (เตรียมด้วย prepare_ref แล้ว)
+      - โหลดใหม่อัตโนมัติเมื่อ mtime ของไฟล์เปลี่ยน
+      - get() คืน view แบบอ่านอย่างเดียว: ภายใต้ Copy-on-Write เป็น shallow copy
+        (analyzer แก้ไข view ได้โดยไม่กระทบตัวที่เก็บไว้ และไม่ต้อง copy ข้อมูล)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frames: Dict[Tuple[str, Optional[Tuple[str, ...]]], Tuple[float, pd.DataFrame]] = {}
+        # index ของ key (เช่น Mapping) ต่อไฟล์ — สร้างครั้งเดียวต่อ mtime ใช้ร่วมกับ frame ที่เก็บไว้
+        self._indexes: Dict[Tuple[str, str], RefKeyIndex] = {}
+        self._loads = itertools.count()
+        # lock ต่อไฟล์: หลาย thread (prepare พร้อมกันในหน้า Summary) โหลดคนละไฟล์ได้พร้อมกัน
+        # แต่ไฟล์เดียวกันโหลดครั้งเดียว
+        self._key_locks: Dict[tuple, threading.Lock] = {}
+
+    def _key_lock(self, key: tuple) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load(self, path: str, usecols: Optional[Iterable[str]] = None) -> Tuple[float, pd.DataFrame]:
+        path = REF_FILES.get(path, path)
+        key = (os.path.normpath(path), tuple(usecols) if usecols is not None else None)
+        mtime = os.path.getmtime(path)
+        with self._key_lock(key):
+            hit = self._frames.get(key)
+            if hit is None or hit[0] != mtime:
+                df = prepare_ref(read_xlsx(path, usecols=usecols))
+                # version ของการโหลดครั้งนี้ ติดไปกับทุก view (attrs ถูก copy ไปด้วย) → เทียบกับ RefKeyIndex.version
+                df.attrs["ref_version"] = (os.path.normpath(path), mtime, next(self._loads))
+                hit = (mtime, df)
+                self._frames[key] = hit
+        return hit
+
+    def get(self, path: str, usecols: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        return self._load(path, usecols)[1].copy(deep=not _COW)
+
+    def get_index(self, path: str, key: str = "Mapping") -> RefKeyIndex:
+        _mtime, df = self._load(path)
+        version = df.attrs["ref_version"]
+        ikey = (os.path.normpath(REF_FILES.get(path, path)), key)
+        with self._key_lock(ikey):
+            idx = self._indexes.get(ikey)
+            if idx is None or idx.version != version:
+                idx = RefKeyIndex(df[key], key, version=version)
+                self._indexes[ikey] = idx
+        return idx
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+            self._indexes.clear()
+
+
+_registry = RefRegistry()
+
+
+def ref_version(path: str) -> Tuple[str, float]:
+    """(path, mtime) ของไฟล์ reference — เปลี่ยนเมื่อไฟล์ถูกแก้ (ใช้ทำ fingerprint ของผลวิเคราะห์)"""
+    path = REF_FILES.get(path, path)
+    return os.path.normpath(path), os.path.getmtime(path)
+
+
+def get_ref(path: str, usecols: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """view ของ reference (รับ path หรือ key ใน REF_FILES เช่น "cpu")"""
+    return _registry.get(path, usecols)
+
+
+def get_ref_index(path: str, key: str = "Mapping") -> RefKeyIndex:
+    """index ของคอลัมน์ key ใน reference — สร้างครั้งเดียวต่อการโหลดไฟล์ (ใช้กับ view จาก get_ref ของการโหลดเดียวกัน)"""
+    return _registry.get_index(path, key)
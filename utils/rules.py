@@ -0,0 +1,138 @@
+# utils/rules.py
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+
+Bound = Union[str, float, int, None]  # ชื่อคอลัมน์ (threshold จาก reference) หรือค่าคงที่
+
+
+def _num(df: pd.DataFrame, col: str) -> pd.Series:
+    if col not in df.columns:
+        return pd.Series(np.nan, index=df.index, dtype=float)
+    return pd.to_numeric(df[col], errors="coerce")
+
+
+def _bound(df: pd.DataFrame, b: Bound) -> Union[pd.Series, float, None]:
+    if b is None:
+        return None
+    if isinstance(b, str):
+        return _num(df, b)
+    return float(b)
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    กฎตรวจค่าหนึ่งคอลัมน์ (ประเมินทั้งคอลัมน์ทีเดียว):
+      - column:      คอลัมน์ค่าที่วัด
+      - max / min:   ชื่อคอลัมน์ threshold หรือค่าคงที่ (None = ไม่ตรวจด้านนั้น)
+      - pattern:     regex บน pattern_col — ใช้กฎเฉพาะแถวที่ match (เช่น "FCC", "LB2R")
+      - inclusive:   True = ชนขอบถือว่าผิด (>= max / <= min)
+      - both_bounds: True = ตรวจเฉพาะแถวที่มีทั้ง min และ max
+      - only_if_na:  ใช้กฎนี้เฉพาะแถวที่คอลัมน์นี้ว่าง (threshold สำรอง)
+    ค่าว่าง/แปลงเป็นตัวเลขไม่ได้ → ไม่ผิด
+    """
+    column: str
+    max: Bound = None
+    min: Bound = None
+    pattern: Optional[str] = None
+    pattern_col: str = "Measure Object"
+    inclusive: bool = False
+    both_bounds: bool = False
+    only_if_na: Optional[str] = None
+    name: Optional[str] = None
+
+    @property
+    def label(self) -> str:
+        return self.name or self.column
+
+    def mask(self, df: pd.DataFrame) -> pd.Series:
+        v = _num(df, self.column)
+        hi = _bound(df, self.max)
+        lo = _bound(df, self.min)
+
+        bad = pd.Series(False, index=df.index)
+        if hi is not None:
+            bad |= (v >= hi) if self.inclusive else (v > hi)
+        if lo is not None:
+            bad |= (v <= lo) if self.inclusive else (v < lo)
+
+        if self.both_bounds and hi is not None and lo is not None:
+            bad &= pd.Series(hi, index=df.index).notna() & pd.Series(lo, index=df.index).notna()
+        if self.pattern is not None:
+            if self.pattern_col not in df.columns:
+                return pd.Series(False, index=df.index)
+            bad &= df[self.pattern_col].astype(str).str.contains(self.pattern, regex=True, na=False)
+        if self.only_if_na is not None:
+            bad &= _num(df, self.only_if_na).isna()
+        return bad.fillna(False).astype(bool)
+
+
+@dataclass
+class RuleSet:
+    """
+    ชุดกฎของ analyzer หนึ่งตัว — แถวผิดถ้าผิดกฎใดกฎหนึ่ง
+    skip_values: แถวที่คอลัมน์มีค่า sentinel (เช่น -60 dBm = ไม่มีแสง) ไม่นับว่าผิด
+    """
+    rules: List[Rule]
+    skip_values: Dict[str, Tuple[float, ...]] = field(default_factory=dict)
+
+    def _skip(self, df: pd.DataFrame) -> pd.Series:
+        skip = pd.Series(False, index=df.index)
+        for col, values in self.skip_values.items():
+            skip |= _num(df, col).isin(values)
+        return skip
+
+    def masks(self, df: pd.DataFrame) -> Dict[str, pd.Series]:
+        """mask ต่อกฎ (กฎที่ label ซ้ำกันจะถูก OR รวมกัน)"""
+        skip = self._skip(df) if self.skip_values else None
+        out: Dict[str, pd.Series] = {}
+        for r in self.rules:
+            m = r.mask(df)
+            if skip is not None:
+                m &= ~skip
+            out[r.label] = (out[r.label] | m) if r.label in out else m
+        return out
+
+    def cell_masks(self, df: pd.DataFrame) -> pd.DataFrame:
+        """DataFrame bool ขนาดเท่า df: True เฉพาะ cell ค่าที่ผิดกฎ (ไว้ไฮไลต์)"""
+        cells = pd.DataFrame(False, index=df.index, columns=df.columns)
+        for r in self.rules:
+            if r.column in cells.columns:
+                m = r.mask(df)
+                if self.skip_values:
+                    m &= ~self._skip(df)
+                cells[r.column] |= m
+        return cells
+
+    def mask(self, df: pd.DataFrame) -> pd.Series:
+        """แถวที่ผิดอย่างน้อยหนึ่งกฎ"""
+        bad = pd.Series(False, index=df.index)
+        for m in self.masks(df).values():
+            bad |= m
+        return bad
+
+
+def classify(
+    index: pd.Index,
+    cases: Sequence[Tuple[str, pd.Series]],
+    default: str,
+) -> pd.Series:
+    """
+    สร้างคอลัมน์สถานะแบบ categorical จาก mask หลายตัว (ตัวแรกที่เป็น True ชนะ)
+        classify(df.index, [("EOL Fiber Break", m_break), ("EOL Excess Loss", m_excess)], "EOL Normal")
+    """
+    labels = [default] + [lbl for lbl, _ in cases]
+    if not cases:
+        return pd.Series(pd.Categorical([default] * len(index), categories=labels), index=index)
+    conds = [m.reindex(index, fill_value=False).to_numpy(dtype=bool) for _, m in cases]
+    values = np.select(conds, [lbl for lbl, _ in cases], default=default)
+    return pd.Series(pd.Categorical(values, categories=list(dict.fromkeys(labels))), index=index)
+
+
+def nonblank(s: pd.Series) -> pd.Series:
+    """True ถ้ามีข้อความ — NaN นับว่ามีข้อความ (ตรงกับ str(x).strip() != "" แบบเดิม ที่ได้ "nan")"""
+    return s.isna() | (s.astype(str).str.strip() != "")
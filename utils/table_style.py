@@ -0,0 +1,139 @@
+# utils/table_style.py
+import os
+import re
+from typing import Dict, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+# สีมาตรฐานของตาราง
+CSS_ROW = "background-color:#e6e6e6; color:black"         # ทั้งแถวที่มีปัญหา
+CSS_BAD = "background-color:#ff4d4d; color:white"         # ค่าที่ผิด threshold
+CSS_BAD_SOFT = "background-color:#ff9999; color:black"    # ค่าที่ผิดในตาราง drill-down (Summary)
+CSS_PRESET = "background-color:lightblue; color:black"    # Route ที่เป็น Preset
+
+# ตารางที่ใหญ่กว่านี้ (จำนวน cell) ไม่ render เป็น HTML Styler แต่ใช้ st.dataframe + column_config
+# ปรับได้ด้วย env STYLER_MAX_CELLS (ค่าเริ่มต้น = styler.render.max_elements ของ pandas)
+STYLER_MAX_CELLS = int(os.environ.get("STYLER_MAX_CELLS", 262_144))
+
+Mask = Union[pd.Series, np.ndarray]
+CellSpec = Mapping[str, Tuple[Mask, str]]  # {คอลัมน์: (mask, css)}
+RowSpec = Sequence[Tuple[Mask, str]]       # [(mask, css), ...] ตัวหลังทับตัวก่อน
+
+
+def _as_bool(mask: Mask, index: pd.Index) -> np.ndarray:
+    if isinstance(mask, pd.Series):
+        mask = mask.reindex(index, fill_value=False)
+    return np.asarray(mask, dtype=bool)
+
+
+def _row_layers(row_mask: Optional[Mask], row_css: str, rows: Optional[RowSpec]) -> list:
+    return ([(row_mask, row_css)] if row_mask is not None else []) + list(rows or [])
+
+
+def css_frame(
+    df: pd.DataFrame,
+    row_mask: Optional[Mask] = None,
+    cells: Optional[CellSpec] = None,
+    row_css: str = CSS_ROW,
+    rows: Optional[RowSpec] = None,
+) -> pd.DataFrame:
+    """
+    ตาราง CSS ขนาดเท่า df สร้างจาก mask ทีเดียว (ไม่มี callback ต่อแถว/ต่อ cell)
+      - row_mask: แถวที่ระบายทั้งแถวด้วย row_css
+      - rows:     ระบายทั้งแถวหลายสี [(mask, css), ...] (ตัวหลังทับตัวก่อน)
+      - cells:    {คอลัมน์: (mask, css)} ระบายเฉพาะ cell (ทับสีของแถว)
+    """
+    out = np.full(df.shape, "", dtype=object)
+    for mask, css in _row_layers(row_mask, row_css, rows):
+        out[_as_bool(mask, df.index), :] = css
+    for col, (mask, css) in (cells or {}).items():
+        if col in df.columns:
+            out[_as_bool(mask, df.index), df.columns.get_loc(col)] = css
+    return pd.DataFrame(out, index=df.index, columns=df.columns)
+
+
+def style_table(
+    df: pd.DataFrame,
+    row_mask: Optional[Mask] = None,
+    cells: Optional[CellSpec] = None,
+    fmt: Optional[Dict[str, str]] = None,
+    na_rep: Optional[str] = None,
+    row_css: str = CSS_ROW,
+    rows: Optional[RowSpec] = None,
+):
+    """Styler จาก mask: apply ครั้งเดียวทั้งตาราง (axis=None)"""
+    css = css_frame(df, row_mask, cells, row_css, rows)
+    styled = df.style.apply(lambda _: css, axis=None)
+    fmt = {c: f for c, f in (fmt or {}).items() if c in df.columns}
+    if fmt or na_rep is not None:
+        styled = styled.format(fmt or None, na_rep=na_rep)
+    return styled
+
+
+def _printf(fmt: str) -> Optional[str]:
+    """แปลง format แบบ Python ("{:.2f}%", "{:.2E}") เป็นแบบ printf ของ st.column_config"""
+    m = re.fullmatch(r"(.*)\{:\.(\d+)([fFeE])\}(.*)", fmt)
+    if not m:
+        return None
+    pre, digits, kind, post = m.groups()
+    return f"{pre.replace('%', '%%')}%.{digits}{kind.lower()}{post.replace('%', '%%')}"
+
+
+def column_config(df: pd.DataFrame, fmt: Optional[Dict[str, str]] = None) -> dict:
+    config = {}
+    for col, f in (fmt or {}).items():
+        printf = _printf(f)
+        if col in df.columns and printf and pd.api.types.is_numeric_dtype(df[col]):
+            config[col] = st.column_config.NumberColumn(col, format=printf)
+    return config
+
+
+def render_table(
+    df: pd.DataFrame,
+    row_mask: Optional[Mask] = None,
+    cells: Optional[CellSpec] = None,
+    fmt: Optional[Dict[str, str]] = None,
+    na_rep: Optional[str] = None,
+    row_css: str = CSS_ROW,
+    rows: Optional[RowSpec] = None,
+    flag_col: str = "⚠",
+    **kwargs,
+) -> None:
+    """
+    แสดงตารางพร้อมไฮไลต์:
+      - ตารางเล็ก (≤ STYLER_MAX_CELLS) → Styler จาก mask
+      - ตารางใหญ่ → st.dataframe ตรง ๆ + column_config (format ตัวเลข)
+        และคอลัมน์ flag บอกแถวที่มีปัญหาแทนการระบายสี
+    kwargs ส่งต่อให้ st.dataframe (เช่น use_container_width, hide_index)
+    """
+    kwargs.setdefault("use_container_width", True)
+    if df.size <= STYLER_MAX_CELLS:
+        st.dataframe(style_table(df, row_mask, cells, fmt, na_rep, row_css, rows), **kwargs)
+        return
+
+    flag = np.zeros(len(df), dtype=bool)
+    for mask, _css in _row_layers(row_mask, row_css, rows):
+        flag |= _as_bool(mask, df.index)
+    for col, (mask, css) in (cells or {}).items():
+        if col in df.columns and css != CSS_PRESET:  # Preset เป็นข้อมูล ไม่ใช่ปัญหา
+            flag |= _as_bool(mask, df.index)
+
+    config = column_config(df, fmt)
+    if flag.any():
+        df = df.copy(deep=False)
+        df.insert(0, flag_col, flag)
+        config[flag_col] = st.column_config.CheckboxColumn(flag_col, help="แถวที่มีค่าเกิน threshold")
+    st.caption(f"ตารางมี {len(df):,} แถว — แสดงแบบไม่ระบายสี (คอลัมน์ {flag_col} = แถวที่มีปัญหา)")
+    st.dataframe(df, column_config=config, **kwargs)
+
+
+def render_unmatched(df_unmatched: pd.DataFrame, label: str, cols: Sequence[str] = ("ME", "Measure Object")) -> None:
+    """แสดงแถวในไฟล์ดิบที่ไม่พบใน reference (ถ้ามี)"""
+    if df_unmatched is None or df_unmatched.empty:
+        return
+    show = [c for c in cols if c in df_unmatched.columns]
+    with st.expander(f"⚠️ {len(df_unmatched)} {label} row(s) not found in reference"):
+        st.dataframe(df_unmatched[show].drop_duplicates(), use_container_width=True)
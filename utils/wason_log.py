@@ -0,0 +1,203 @@
+# utils/wason_log.py
+import os
+import re
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Sequence, Tuple, Union
+
+from utils.log_source import LogSource, split_lines
+
+# ---------- รูปแบบบรรทัดใน WASON / MobaXterm log ----------
+# [WASON][CALL 8] [30.10.90.6 30.10.10.6 85] COPPER
+CALL_MARK = "[CALL"
+LINE_HEADER_RE = re.compile(r"\[CALL\s+\d+\]\s+\[([\d.]+)\s+[\d.]+\s+(\d+)\]")      # Line_Analyzer (ip แรก, call id)
+CALL_HEADER_RE = re.compile(r"\[WASON\]\[CALL\s+(\d+)\]\s+\[([^\]]+)\]")             # Preset (เลข CALL, ip คู่)
+PREROUT_MARK = "[PreRout]:"
+USED_SUCCESS_RE = re.compile(r"--(\d+)--WORK--\(USED\)--\(SUCCESS\)")
+# [WASON]    Conn [30.10.90.6 30.10.10.6 2 1] APO state ...
+APO_CONN_RE = re.compile(r"^\[WASON\]\s*Conn\s*\[")
+APO_CONN_PAIR_RE = re.compile(r"Conn\s*\[\s*([\d\.]+)\s+([\d\.]+)\s+(\d+)\s+(\d+)\s*\]")
+APO_PREFIXES = ("[WASON]", "[APOPLUS]")
+
+LogText = Union[str, bytes, LogSource]
+
+
+class _SourceLines(Sequence[str]):
+    """list ของบรรทัดแบบ lazy: เก็บแค่ byte offset แล้วอ่านจาก LogSource ตอนใช้"""
+
+    def __init__(self, source: LogSource, offsets: array):
+        self.source = source
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.source.line_at(o) for o in self.offsets[i]]
+        return self.source.line_at(self.offsets[i])
+
+
+class LineRange(Sequence[str]):
+    """บรรทัด [start, end) ของ log แบบไม่คัดลอก (เก็บแค่ช่วงเลขบรรทัด + อ้าง lines ของ index)"""
+
+    def __init__(self, base: Sequence[str], start: int, end: int):
+        self.base = base
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.base[self.start + k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.base[self.start + i]
+
+    def __iter__(self):
+        return iter(self.base[self.start:self.end])
+
+    def text(self) -> str:
+        return "\n".join(self)
+
+
+class WasonLogIndex:
+    """
+    index ของ WASON log จากการอ่านทีละบรรทัดรอบเดียว ใช้ร่วมกันระหว่าง Line / Preset / APO
+      - call_marks:   บรรทัดที่มี "[CALL" (ขอบเขต block แบบ Line_Analyzer)
+      - headers:      (บรรทัด, ip แรก, call id) ของหัว CALL
+      - call_blocks:  (บรรทัด, เลข CALL, ip คู่) ของหัว [WASON][CALL ...] (ขอบเขต block แบบ Preset)
+      - by_call:      (ip แรก, call id) → บรรทัดหัว CALL
+      - prerout:      บรรทัด "[PreRout]:"
+      - used_success: (บรรทัด, เลข preroute) ของ --N--WORK--(USED)--(SUCCESS)
+      - apo_lines:    บรรทัดที่มีผลกับ parser ของ APO ([WASON]/[APOPLUS]/ZXPOTN exec)
+      - apo_conns:    บรรทัด Conn ของ SetupApo → (ip แรก, call id, conn hex)
+      - call_presets: (ip แรก, call id, preset) ของ CALL ที่มี PreRout → USED/SUCCESS (state machine ใน scan)
+      - derived:      ผลที่คำนวณต่อจาก index (เช่น preset map) เก็บไว้ใช้ซ้ำ
+    รับ str / bytes / LogSource (แบบ LogSource จะเก็บ offsets แทน str ของทุกบรรทัด)
+    ทุกตัวเป็นเลขบรรทัด (อ้าง lines) เรียงจากน้อยไปมาก
+    """
+
+    def __init__(self, text: LogText):
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", errors="ignore")  # เหมือน loader .txt เดิม
+        # LogSource: ไม่เก็บ str ของทุกบรรทัด เก็บแค่ offset (lines อ่านจาก source ตอนใช้)
+        self.offsets = array("q") if isinstance(text, LogSource) else None
+        self.lines: Sequence[str] = []
+
+        self.call_marks: List[int] = []
+        self.headers: List[Tuple[int, str, str]] = []
+        self.call_blocks: List[Tuple[int, int, str]] = []
+        self.by_call: Dict[Tuple[str, str], List[int]] = {}
+        self.prerout: List[int] = []
+        self.used_success: List[Tuple[int, str]] = []
+        self.apo_lines: List[int] = []
+        self.apo_conns: Dict[int, Tuple[str, int, str]] = {}
+        self.call_presets: List[Tuple[str, str, str]] = []
+        self.derived: Dict[str, Any] = {}
+        if self.offsets is None:
+            self.lines = split_lines(text)  # กฎเดียวกับ LogSource.iter_lines
+            self._scan(self.lines)
+        else:
+            self._scan(self._offset_lines(text))
+            self.lines = _SourceLines(text, self.offsets)
+
+    def _offset_lines(self, source: LogSource) -> Iterable[str]:
+        for offset, ln in source.iter_lines():
+            self.offsets.append(offset)
+            yield ln
+
+    def _scan(self, lines: Iterable[str]) -> None:
+        # state ของ preset: None → "call" (เจอหัว) → "prerout" (เจอ [PreRout]:) → "done" (ได้ USED/SUCCESS)
+        # ทุกบรรทัดที่มี "[CALL" ปิด block เดิม (เหมือนเดิม: หาเฉพาะถึง [CALL ถัดไป)
+        state, cur = None, None
+        for i, ln in enumerate(lines):
+            is_prerout = PREROUT_MARK in ln
+            used = USED_SUCCESS_RE.search(ln) if "WORK" in ln else None
+            if is_prerout:
+                self.prerout.append(i)
+            if used:
+                self.used_success.append((i, used.group(1).strip()))
+
+            if CALL_MARK in ln:
+                self.call_marks.append(i)
+                state = None
+                m = LINE_HEADER_RE.search(ln)
+                if m:
+                    ip, cid = m.group(1).strip(), m.group(2).strip().lstrip("0")
+                    self.headers.append((i, ip, cid))
+                    self.by_call.setdefault((ip, cid), []).append(i)
+                    state, cur = "call", (ip, cid)
+                m = CALL_HEADER_RE.search(ln)
+                if m:
+                    self.call_blocks.append((i, int(m.group(1)), m.group(2)))
+            elif state == "call" and is_prerout:
+                state = "prerout"
+            elif state == "prerout" and used:
+                self.call_presets.append((*cur, used.group(1).strip()))
+                state = "done"
+
+            # regex ปิด block ของ APO เป็น re.I → เทียบ prefix แบบไม่สนตัวพิมพ์
+            if ln[:9].upper().startswith(APO_PREFIXES) or "ZXPOTN(" in ln:
+                self.apo_lines.append(i)
+                if APO_CONN_RE.search(ln):
+                    m = APO_CONN_PAIR_RE.search(ln)
+                    if m:
+                        first_ip, _second_ip, call_id, conn_no = m.groups()
+                        self.apo_conns[i] = (first_ip, int(call_id), f"0x{int(conn_no):08x}")
+
+    # ---------- ขอบเขต block ----------
+    def iter_call_blocks(self):
+        """(เลข CALL, ip คู่, LineRange) ตั้งแต่หัว [WASON][CALL ...] จนถึงหัวถัดไป"""
+        starts = [b[0] for b in self.call_blocks] + [len(self.lines)]
+        for (start, call_no, ip), end in zip(self.call_blocks, starts[1:]):
+            yield call_no, ip, LineRange(self.lines, start, end)
+
+
+# ---------- cache: log เดียวกัน parse ครั้งเดียว ----------
+# LogSource: index เก็บไว้ใน source.derived → อายุเท่ากับ log (upload ใหม่แทนที่ใน session แล้ว
+#   log เก่าพร้อม index/mmap ถูกเก็บกวาดตามปกติ ไม่ค้างใน cache)
+# str / bytes (weakref ไม่ได้): key = (ชนิด, ความยาว, hash) — ไม่เก็บตัว log ไว้ใน cache
+#   จำกัดขนาดรวมตามความยาว log (LOG_INDEX_CACHE_MB) ตัวล่าสุดเก็บไว้เสมอ ตัวเก่าถูกตัดออกก่อน
+_INDEX_CACHE_CHARS = int(os.environ.get("LOG_INDEX_CACHE_MB", 64)) * 1024 * 1024
+_cache: "OrderedDict[Tuple[type, int, int], Tuple[int, WasonLogIndex]]" = OrderedDict()
+_cache_size = 0
+_cache_lock = threading.Lock()
+
+
+def _source_index(source: LogSource) -> WasonLogIndex:
+    with _cache_lock:
+        idx = source.derived.get("wason_index")
+    if idx is None:
+        idx = WasonLogIndex(source)
+        with _cache_lock:
+            idx = source.derived.setdefault("wason_index", idx)
+    return idx
+
+
+def get_log_index(text: LogText) -> WasonLogIndex:
+    """WasonLogIndex ของ log นี้ (log เดิม = index เดิม ไม่ parse ซ้ำ)"""
+    global _cache_size
+    if isinstance(text, LogSource):
+        return _source_index(text)
+
+    key = (type(text), len(text), hash(text))
+    with _cache_lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit[1]
+    idx = WasonLogIndex(text)
+    with _cache_lock:
+        if key not in _cache:
+            _cache[key] = (len(text), idx)
+            _cache_size += len(text)
+        while len(_cache) > 1 and _cache_size > _INDEX_CACHE_CHARS:
+            size, _old = _cache.popitem(last=False)[1]
+            _cache_size -= size
+    return idx
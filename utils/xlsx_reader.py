@@ -0,0 +1,70 @@
+# utils/xlsx_reader.py
+import os
+import importlib.util
+from typing import Dict, Iterable, Optional
+
+import pandas as pd
+
+
+# ลำดับ engine ที่ต้องการ: calamine (Rust, เร็วกว่ามาก) ถ้าติดตั้งไว้ ไม่งั้นใช้ openpyxl
+# บังคับ engine ได้ด้วย env XLSX_ENGINE=openpyxl / calamine
+ENGINE_MODULES = {
+    "calamine": "python_calamine",
+    "openpyxl": "openpyxl",
+}
+
+
+def available_engines() -> list:
+    return [e for e, mod in ENGINE_MODULES.items() if importlib.util.find_spec(mod) is not None]
+
+
+def default_engine() -> str:
+    forced = os.environ.get("XLSX_ENGINE")
+    engines = available_engines()
+    if forced in engines:
+        return forced
+    return engines[0] if engines else "openpyxl"
+
+
+def _norm(c) -> str:
+    # เหมือน _normalize_columns ของ analyzer: ตัดช่องว่างหัวท้าย + ยุบช่องว่างซ้ำ
+    return " ".join(str(c).split())
+
+
+def read_xlsx(
+    src,
+    *,
+    usecols: Optional[Iterable[str]] = None,
+    dtype: Optional[Dict[str, object]] = None,
+    nrows: Optional[int] = None,
+    sheet_name=0,
+    engine: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    อ่าน Excel หนึ่งชีตเป็น DataFrame (แทน pd.read_excel ตรง ๆ)
+      - usecols: ชื่อคอลัมน์ที่ต้องการ (เทียบหลัง normalize ช่องว่าง เช่น "Sink Port " = "Sink Port")
+      - dtype:   กำหนดชนิดตั้งแต่ตอน parse (key เป็นชื่อคอลัมน์ตามไฟล์)
+      - nrows=0: อ่านเฉพาะหัวตาราง
+    openpyxl ถูกเปิดแบบ read-only (streaming ทีละแถว) อยู่แล้วผ่าน pandas
+    ถ้า engine ที่เลือกอ่านไฟล์นี้ไม่ได้ จะลองใหม่ด้วย openpyxl
+    """
+    engine = engine or default_engine()
+    kwargs = {"sheet_name": sheet_name, "nrows": nrows, "dtype": dtype}
+    if usecols is not None:
+        wanted = {_norm(c) for c in usecols}
+        kwargs["usecols"] = lambda c: _norm(c) in wanted
+
+    pos = src.tell() if hasattr(src, "tell") else None
+    try:
+        return pd.read_excel(src, engine=engine, **kwargs)
+    except Exception:
+        if engine == "openpyxl":
+            raise
+        if pos is not None:
+            src.seek(pos)
+        return pd.read_excel(src, engine="openpyxl", **kwargs)
+
+
+def read_header(src, engine: Optional[str] = None) -> list:
+    """ชื่อคอลัมน์ของชีตแรก (ไม่อ่านข้อมูล)"""
+    return list(read_xlsx(src, nrows=0, engine=engine).columns)
@@ -0,0 +1,294 @@
+# utils/zip_ingest.py
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from utils.artifact_cache import ArtifactCache, zip_digest
+from utils.log_source import LogSource
+from utils.xlsx_reader import read_xlsx, read_header
+
+
+# ZIP ซ้อนจะถูก spool ลงไฟล์ชั่วคราว: เล็กกว่านี้อยู่ใน RAM, ใหญ่กว่านี้ spill ลงดิสก์
+SPOOL_MAX_BYTES = 32 * 1024 * 1024
+_COPY_CHUNK = 1024 * 1024
+
+
+# ====== ZIP PARSER ======
+# (ย้ายมาจาก app9.py เพื่อให้ worker process import ได้โดยไม่ต้องรันหน้า Streamlit)
+KW = {
+    "cpu": ("cpu",), "fan": ("fan",), "msu": ("msu",),
+    "client": ("client", "client board"), "line": ("line","line board"),
+    "wason": ("wason","log"), "osc": ("osc","osc optical"),
+    "fm": ("fm","alarm","fault management"),
+    "atten": ("optical attenuation report", "optical_attenuation_report", "optical attenuation"),
+    "preset": ("mobaxterm", "moba xterm", "moba"),
+}
+
+LOADERS = {
+    ".xlsx": read_xlsx,
+    ".xls": read_xlsx,
+    ".txt": LogSource.from_stream,  # log ใหญ่ spill ลง temp file + mmap (ไม่ decode ทั้งไฟล์)
+}
+
+def _ext(name: str) -> str:
+    name = name.lower()
+    return next((e for e in LOADERS if name.endswith(e)), "")
+
+def _kind(name):
+    n = name.lower()
+    hits = [k for k, kws in KW.items() if any(s in n for s in kws)]
+    if "wason" in hits: return "wason"
+    if "preset" in hits: return "preset"
+    if "line" in hits and (n.endswith(".xlsx") or n.endswith(".xls") or n.endswith(".xlsm")): return "line"
+    for k in ("fan","cpu","msu","client","osc","fm","atten"):
+        if k in hits: return k
+    return hits[0] if hits else None
+
+
+# ---------- Header sniffing ----------
+# อ่านแค่หัวตาราง (xlsx) หรือต้นไฟล์ (txt) เพื่อยืนยันชนิดก่อน parse เต็ม
+# คอลัมน์ต้องตรงกับ _check_required / REQ_*_COLS ของ analyzer แต่ละตัว
+SNIFF_TEXT_BYTES = 64 * 1024
+REQUIRED_COLS = {
+    "cpu": {"ME", "Measure Object", "CPU utilization ratio"},
+    "fan": {"ME", "Measure Object", "Begin Time", "End Time", "Value of Fan Rotate Speed(Rps)"},
+    "msu": {"ME", "Measure Object", "Laser Bias Current(mA)"},
+    "line": {"ME", "Measure Object", "Instant BER After FEC",
+             "Input Optical Power(dBm)", "Output Optical Power (dBm)"},
+    "client": {"ME", "Measure Object", "Input Optical Power(dBm)", "Output Optical Power (dBm)"},
+    "osc": {"ME", "Measure Object", "Begin Time", "End Time",
+            "Max Value of Input Optical Power(dBm)", "Min Value of Input Optical Power(dBm)"},
+    "fm": {"Occurrence Time", "Clear Time"},
+    "atten": {"Source Port", "Sink Port", "Optical Attenuation (dB)"},
+}
+TEXT_MARKERS = {
+    "wason": ("[wason]",),
+    "preset": ("mobaxterm",),
+}
+# ถ้าชื่อไฟล์บอกอะไรไม่ได้ ให้ลองตามลำดับนี้ (line ก่อน client/osc เพราะ line มีคอลัมน์ครบกว่า)
+_SNIFF_ORDER = ("fan", "cpu", "msu", "line", "client", "osc", "fm", "atten", "wason", "preset")
+
+
+def _norm_cols(cols) -> set:
+    # เหมือน _normalize_columns ของ analyzer
+    return {" ".join(str(c).split()) for c in cols}
+
+
+def _sniff(f, ext: str):
+    """คืน set ชื่อคอลัมน์ (xlsx/xls) หรือข้อความต้นไฟล์ตัวพิมพ์เล็ก (txt); อ่านไม่ได้คืน None"""
+    try:
+        if ext == ".txt":
+            return f.read(SNIFF_TEXT_BYTES).decode("utf-8", errors="ignore").lower()
+        return _norm_cols(read_header(f))
+    except Exception:
+        return None
+
+
+def _header_of(obj):
+    if isinstance(obj, pd.DataFrame):
+        return _norm_cols(obj.columns)
+    if isinstance(obj, LogSource):
+        return obj.read(0, SNIFF_TEXT_BYTES).lower()
+    return obj[:SNIFF_TEXT_BYTES].lower()
+
+
+def _matches(kind: str, header) -> bool:
+    if isinstance(header, str):
+        return any(m in header for m in TEXT_MARKERS.get(kind, ()))
+    req = REQUIRED_COLS.get(kind)
+    return req is not None and req <= header
+
+
+def _classify(name: str, header):
+    """
+    ชื่อไฟล์เป็นตัวเสนอชนิด, หัวตารางเป็นตัวยืนยัน
+    - ชื่อไฟล์ตรงและหัวตารางผ่าน → ใช้ชนิดตามชื่อ
+    - หัวตารางไม่ผ่าน → หาชนิดที่หัวตารางตรงแทน (ไม่มีก็ทิ้งไฟล์นี้)
+    - sniff ไม่ได้ / ชนิดที่ไม่มี signature → ใช้ชื่อไฟล์เหมือนเดิม
+    - log (.txt) ที่ชื่อไฟล์บอกชนิด log → ใช้ชื่อไฟล์ (marker อาจอยู่ลึกกว่าช่วงที่ sniff เช่น banner/login ยาว)
+      marker ใช้จัดชนิดเฉพาะไฟล์ที่ชื่อบอกอะไรไม่ได้
+    """
+    hinted = _kind(name.lower())
+    if header is None:
+        return hinted
+    if isinstance(header, str) and hinted in TEXT_MARKERS:
+        return hinted
+    if hinted and (_matches(hinted, header) or (hinted not in REQUIRED_COLS and hinted not in TEXT_MARKERS)):
+        return hinted
+    return next((k for k in _SNIFF_ORDER if _matches(k, header)), None)
+
+
+def _spool_member(zf: zipfile.ZipFile, name: str):
+    """
+    คัดลอก member (เช่น ZIP ซ้อน) ออกมาเป็น stream ที่ seek ได้ทีละ chunk
+    ใช้ RAM ไม่เกิน SPOOL_MAX_BYTES ต่อชั้น ส่วนที่เกินจะอยู่บนดิสก์
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    with zf.open(name) as src:
+        shutil.copyfileobj(src, spool, _COPY_CHUNK)
+    spool.seek(0)
+    return spool
+
+
+def find_in_zip(zip_file, cache: ArtifactCache | None = None):
+    """
+    เดินไฟล์ใน ZIP (รวม ZIP ซ้อน) แล้วหยิบไฟล์แรกของแต่ละ kind
+    ที่หัวตารางผ่าน required columns ของ analyzer (ดู _classify)
+    zip_file: path บนดิสก์ หรือ file-like ที่ seek ได้ (ไม่ต้องโหลดทั้งไฟล์เข้า RAM)
+    คืนค่า: {kind: (df หรือ LogSource, ชื่อไฟล์) | None}
+    raise ถ้า ZIP ชั้นนอกเปิดไม่ได้ (ให้ผู้เรียกตัดสินใจแสดง error เอง)
+    """
+    found = {k: None for k in KW}
+    # key ของ cache = hash เนื้อ ZIP + path ของ member (รวม ZIP ซ้อน)
+    digest = zip_digest(zip_file) if cache is not None else None
+    def walk(zf, prefix=""):
+        for name in zf.namelist():
+            if all(found.values()): return
+            if name.endswith("/"): continue
+            lname = name.lower()
+            if lname.endswith(".zip"):
+                try:
+                    with _spool_member(zf, name) as spool, zipfile.ZipFile(spool) as inner:
+                        walk(inner, prefix + name + "!/")
+                except: pass
+                continue
+            ext = _ext(lname)
+            if not ext: continue
+            member = prefix + name
+            df = cache.get(digest, member) if cache is not None else None
+            if df is not None:
+                kind = _classify(name, _header_of(df))
+                if kind and not found[kind]:
+                    found[kind] = (df, name)
+                continue
+            # sniff หัวตารางก่อน → parse เต็มเฉพาะไฟล์ที่ชนะช่องของ kind นั้น
+            try:
+                with _spool_member(zf, name) as spool:
+                    kind = _classify(name, _sniff(spool, ext))
+                    if not kind or found[kind]: continue
+                    spool.seek(0)
+                    df = LOADERS[ext](spool)
+            except: continue
+            if cache is not None:
+                cache.put(digest, member, df)
+            found[kind] = (df, name)
+    with zipfile.ZipFile(zip_file) as zf:
+        walk(zf)
+    return found
+
+
+# ====== PARALLEL INGESTION ======
+def _parse_job(src, cache_dir: Optional[str], cache_max_bytes: Optional[int]):
+    """งานที่รันใน worker process: parse ZIP หนึ่งไฟล์ (path หรือ bytes) → (found, error)"""
+    cache = ArtifactCache(cache_dir, cache_max_bytes) if cache_dir else None
+    zip_file = io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src
+    try:
+        return find_in_zip(zip_file, cache=cache), None
+    except Exception as e:
+        return {}, str(e)
+
+
+def make_parse_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Process pool สำหรับ parse XLSX
+    ใช้ 'spawn' เพื่อไม่ fork ทั้ง process ของ Streamlit (ที่มี thread อื่นวิ่งอยู่)
+    """
+    workers = max_workers or max(1, min(4, (os.cpu_count() or 1)))
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def merge_results(results: List[Dict[str, Optional[Tuple]]]) -> Dict[str, Tuple]:
+    """
+    รวมผลหลายไฟล์ตามลำดับที่ผู้ใช้เลือก (ไฟล์หลังทับไฟล์ก่อน เหมือน loop เดิม)
+    → ผลลัพธ์ไม่ขึ้นกับว่า worker ตัวไหนเสร็จก่อน
+    """
+    merged: Dict[str, Tuple] = {}
+    for res in results:
+        for kind, pack in (res or {}).items():
+            if pack:
+                merged[kind] = pack
+    return merged
+
+
+def ingest_zips(
+    paths: List[str],
+    fetch_fn: Callable[[str], Optional[str | io.BytesIO]],
+    parse_pool: ProcessPoolExecutor,
+    *,
+    cache: ArtifactCache | None = None,
+    max_download_workers: int = 4,
+    thread_initializer: Callable[[], None] | None = None,
+    on_progress: Callable[[int, str], None] | None = None,
+) -> Tuple[Dict[str, Tuple], List[Optional[str]]]:
+    """
+    ดาวน์โหลด (thread pool) ซ้อนกับการ parse (process pool):
+    ไฟล์ไหนโหลดเสร็จก่อนก็ส่งเข้า process pool ทันที
+
+    fetch_fn(path) คืน path ไฟล์บนดิสก์ (แนะนำ: worker เปิดเองแบบ streaming)
+    หรือ BytesIO (จะถูกส่งเป็น bytes ไปให้ worker)
+
+    on_progress(i, status): status = "downloaded" | "download failed" | "parsed" | "error: ..."
+    คืนค่า: (ผลรวมต่อ kind, error ต่อไฟล์ตามลำดับ paths)
+    """
+    notify = on_progress or (lambda i, status: None)
+    cache_dir = cache.cache_dir if cache is not None else None
+    cache_max = cache.max_bytes if cache is not None else None
+
+    results: List[Dict] = [{} for _ in paths]
+    errors: List[Optional[str]] = [None] * len(paths)
+    payloads: Dict[int, str | bytes] = {}
+    parse_futs = {}
+
+    def _submit(data: str | bytes) -> Future:
+        try:
+            return parse_pool.submit(_parse_job, data, cache_dir, cache_max)
+        except BrokenProcessPool:
+            fut = Future()
+            fut.set_result(_parse_job(data, cache_dir, cache_max))
+            return fut
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(max_download_workers, len(paths))),
+        initializer=thread_initializer,
+    ) as tpool:
+        dl_futs = {tpool.submit(fetch_fn, p): i for i, p in enumerate(paths)}
+        for fut in as_completed(dl_futs):
+            i = dl_futs[fut]
+            try:
+                buf = fut.result()
+            except Exception as e:
+                buf, errors[i] = None, str(e)
+            if buf is None:
+                errors[i] = errors[i] or "download failed"
+                notify(i, "download failed")
+                continue
+            notify(i, "downloaded")
+            if isinstance(buf, (str, os.PathLike)):
+                data = os.fspath(buf)
+            else:
+                data = buf.getvalue() if hasattr(buf, "getvalue") else bytes(buf)
+            payloads[i] = data
+            parse_futs[_submit(data)] = i
+
+    for fut in as_completed(parse_futs):
+        i = parse_futs[fut]
+        try:
+            found, err = fut.result()
+        except BrokenProcessPool:
+            # worker ตาย (เช่น OOM) → parse ใน process นี้แทน ไม่ให้ทั้งรอบล้ม
+            found, err = _parse_job(payloads[i], cache_dir, cache_max)
+        except Exception as e:
+            found, err = {}, str(e)
+        results[i] = found
+        errors[i] = err
+        notify(i, f"error: {err}" if err else "parsed")
+
+    return merge_results(results), errors